@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# Times full post-review runs against a local stand-in Review Board server.
+#
+# A throwaway Git repository is created with a change of the requested
+# size, and post-review's main() is run on it a number of times, in this
+# process, against rbtools.utils.testserver. Latency and bandwidth limits
+# can be added to the server to see how post-review behaves against a
+# remote server.
+#
+# Arguments after "--" are passed along to post-review. For example:
+#
+#     ./contrib/internal/benchmark.py --runs 5 --latency 0.1 -- --publish
+#
+
+import atexit
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                "..", "..")))
+from rbtools import postreview
+from rbtools.utils.testserver import FakeReviewBoardServer
+
+
+USERNAME = 'benchmark'
+PASSWORD = 'benchmark'
+
+
+def git(*args):
+    p = subprocess.Popen(('git',) + args, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+
+    if p.returncode != 0:
+        sys.stderr.write('git %s failed:\n%s' % (' '.join(args), output))
+        sys.exit(1)
+
+    return output
+
+
+def make_repository(root, num_files, lines_per_file):
+    """
+    Creates a Git clone with a change to post.
+
+    Returns the path to the clone and the URL of its origin.
+    """
+    origin = os.path.join(root, 'origin')
+    clone = os.path.join(root, 'clone')
+
+    os.environ.update({
+        'GIT_AUTHOR_NAME': 'Benchmark',
+        'GIT_AUTHOR_EMAIL': 'benchmark@example.com',
+        'GIT_COMMITTER_NAME': 'Benchmark',
+        'GIT_COMMITTER_EMAIL': 'benchmark@example.com',
+    })
+
+    os.mkdir(origin)
+    os.chdir(origin)
+    git('init', '-q')
+
+    for i in xrange(num_files):
+        write_file('file%d.txt' % i, lines_per_file, 'original')
+
+    git('add', '.')
+    git('commit', '-q', '-m', 'Initial commit')
+
+    git('clone', '-q', origin, clone)
+    os.chdir(clone)
+
+    for i in xrange(num_files):
+        write_file('file%d.txt' % i, lines_per_file, 'changed')
+
+    git('commit', '-q', '-a', '-m', 'Change to post')
+
+    return clone, origin
+
+
+def write_file(filename, num_lines, word):
+    fp = open(filename, 'w')
+
+    try:
+        for i in xrange(num_lines):
+            if i % 2:
+                fp.write('Line %d is %s.\n' % (i, word))
+            else:
+                fp.write('Line %d.\n' % i)
+    finally:
+        fp.close()
+
+
+def run_post_review(args):
+    """
+    Runs post-review's main(), returning the time it took.
+
+    The exit handlers post-review registers (such as saving cookies) are
+    run right away and counted in the time, as they would be at the end of
+    a real run.
+    """
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    sys.argv = ['post-review'] + args
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+
+    try:
+        try:
+            postreview.main()
+        except SystemExit, e:
+            if e.code:
+                sys.stderr.write('post-review exited with status %s\n'
+                                 % e.code)
+                sys.exit(1)
+
+        atexit._run_exitfuncs()
+    finally:
+        sys.stdout.close()
+        sys.stdout = old_stdout
+        sys.argv = old_argv
+
+    return time.time() - start
+
+
+def parse_options():
+    parser = OptionParser(usage='%prog [options] [-- post-review options]')
+    parser.add_option('--runs', type='int', default=3,
+                      help='the number of times to post')
+    parser.add_option('--warm', action='store_true', default=False,
+                      help='keep the caches and cookies between runs')
+    parser.add_option('--latency', type='float', default=0,
+                      help='seconds of latency added to each request')
+    parser.add_option('--bandwidth', type='int', default=None,
+                      help='the bandwidth limit, in bytes per second')
+    parser.add_option('--repositories', type='int', default=100,
+                      help='the number of other repositories on the server')
+    parser.add_option('--files', type='int', default=10,
+                      help='the number of files in the change')
+    parser.add_option('--lines', type='int', default=1000,
+                      help='the number of lines in each changed file')
+
+    return parser.parse_args()
+
+
+def main():
+    options, args = parse_options()
+    origcwd = os.getcwd()
+    old_home = os.environ.get('HOME')
+    root = tempfile.mkdtemp(prefix='rbtools-benchmark.')
+
+    try:
+        clone, origin = make_repository(root, options.files, options.lines)
+
+        repositories = [
+            {
+                'name': 'Repository %d' % i,
+                'path': 'git://git.example.com/repo%d.git' % i,
+                'tool': 'Git',
+            }
+            for i in xrange(options.repositories)
+        ]
+        repositories.append({
+            'name': 'Benchmark',
+            'path': origin,
+            'tool': 'Git',
+        })
+
+        server = FakeReviewBoardServer(repositories=repositories,
+                                       users={USERNAME: PASSWORD},
+                                       latency=options.latency,
+                                       bandwidth=options.bandwidth)
+        server.start()
+
+        post_review_args = [
+            '--server=%s' % server.url,
+            '--username=%s' % USERNAME,
+            '--password=%s' % PASSWORD,
+        ] + args
+
+        times = []
+
+        try:
+            for i in xrange(options.runs):
+                if not options.warm or i == 0:
+                    home = os.path.join(root, 'home%d' % i)
+                    os.mkdir(home)
+                    os.environ['HOME'] = home
+
+                server.reset_stats()
+                os.chdir(clone)
+                elapsed = run_post_review(post_review_args)
+                times.append(elapsed)
+                stats = server.stats
+
+                print ('Run %d: %.3fs, %d request(s), %d connection(s), '
+                       '%d bytes sent, %d bytes received'
+                       % (i + 1, elapsed, stats['requests'],
+                          stats['connections'], stats['bytes_received'],
+                          stats['bytes_sent']))
+        finally:
+            server.stop()
+
+        print 'min %.3fs, avg %.3fs, max %.3fs' % \
+            (min(times), sum(times) / len(times), max(times))
+    finally:
+        os.chdir(origcwd)
+
+        if old_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = old_home
+
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Times how long post-review takes to start up, and fails if it's too slow.
+#
+# The post-review launcher is run with --help a number of times, which
+# loads everything a real run loads before doing any work. The fastest run
+# is compared against --max-time, to keep out the noise of a busy machine.
+#
+# The script also fails if running the launcher pulls in any of
+# FORBIDDEN_MODULES, which are slow to import and only needed in some runs
+# (or not at all).
+#
+# By default, the launcher in the source tree is checked. Pass --launcher
+# to check an installed one, or --develop to check the one "setup.py
+# develop" installs from a copy of the tree. For example:
+#
+#     ./contrib/internal/benchmark_startup.py --runs 20 --max-time 0.3 \
+#         --launcher `which post-review`
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SCRIPT = os.path.join(ROOT, 'scripts', 'post-review')
+
+FORBIDDEN_MODULES = ('pkg_resources', 'getpass', 'webbrowser')
+
+# Runs a launcher with --help and writes the modules it loaded to stderr.
+LIST_MODULES_SCRIPT = """
+import sys
+launcher = sys.argv[1]
+sys.argv = [launcher, '--help']
+
+try:
+    execfile(launcher, {'__name__': '__main__', '__file__': launcher})
+except SystemExit:
+    pass
+
+sys.stderr.write('\\n'.join(sys.modules.keys()))
+"""
+
+
+def get_env(paths=[ROOT]):
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join(
+        paths + [path for path in [env.get('PYTHONPATH')] if path])
+
+    return env
+
+
+def install_develop(root):
+    """
+    Installs a copy of the tree with "setup.py develop" under root.
+
+    The copy keeps the egg-info out of the tree. Returns the paths to
+    run the launcher with in PYTHONPATH (.pth files aren't read from
+    there, so that includes the copy), and the path to the post-review
+    launcher.
+    """
+    src = os.path.join(root, 'src')
+    install_dir = os.path.join(root, 'site')
+    script_dir = os.path.join(root, 'bin')
+    shutil.copytree(ROOT, src,
+                    ignore=shutil.ignore_patterns('.git', '*.pyc'))
+    os.mkdir(install_dir)
+
+    p = subprocess.Popen(
+        [sys.executable, 'setup.py', '-q', 'develop',
+         '--install-dir', install_dir, '--script-dir', script_dir],
+        cwd=src, env=get_env([install_dir]), stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+
+    if p.returncode != 0:
+        sys.stderr.write('setup.py develop failed:\n%s' % output)
+        sys.exit(1)
+
+    return [install_dir, src], os.path.join(script_dir, 'post-review')
+
+
+def time_startup(env, launcher):
+    """Returns the seconds taken by one run of post-review --help."""
+    start = time.time()
+    p = subprocess.Popen([sys.executable, launcher, '--help'], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+    elapsed = time.time() - start
+
+    if p.returncode != 0:
+        sys.stderr.write('post-review --help failed:\n%s' % output)
+        sys.exit(1)
+
+    return elapsed
+
+
+def get_imported_modules(env, launcher):
+    """Returns the names of the modules loaded by running a launcher."""
+    p = subprocess.Popen(
+        [sys.executable, '-c', LIST_MODULES_SCRIPT, launcher],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    return p.communicate()[1].split()
+
+
+def parse_options():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type='int', default=10,
+                      help='the number of times to start post-review')
+    parser.add_option('--max-time', type='float', default=0.5,
+                      help='the most seconds the fastest start may take')
+    parser.add_option('--launcher', default=SCRIPT,
+                      help='the post-review launcher to check')
+    parser.add_option('--develop', action='store_true', default=False,
+                      help='check the launcher installed by '
+                           '"setup.py develop"')
+
+    return parser.parse_args()
+
+
+def main():
+    options, args = parse_options()
+    launcher = options.launcher
+    env = get_env()
+    tmpdir = None
+
+    if options.develop:
+        tmpdir = tempfile.mkdtemp(prefix='rbtools-benchmark.')
+        paths, launcher = install_develop(tmpdir)
+        env = get_env(paths)
+
+    try:
+        failed = check_launcher(options, env, launcher)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+    if failed:
+        sys.exit(1)
+
+
+def check_launcher(options, env, launcher):
+    """Checks and times a launcher, returning whether it failed."""
+    failed = False
+
+    imported = [name for name in get_imported_modules(env, launcher)
+                if name.split('.')[0] in FORBIDDEN_MODULES]
+
+    if imported:
+        print '%s loads %s' % (launcher, ', '.join(sorted(imported)))
+        failed = True
+
+    times = [time_startup(env, launcher) for i in xrange(options.runs)]
+
+    print 'min %.3fs, avg %.3fs, max %.3fs' % \
+        (min(times), sum(times) / len(times), max(times))
+
+    if min(times) > options.max_time:
+        print 'Startup took longer than %.3fs' % options.max_time
+        failed = True
+
+    return failed
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import logging
+import os
+import time
+
+try:
+    from hashlib import sha1
+except ImportError:
+    # Python 2.4
+    from sha import new as sha1
+
+try:
+    from json import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from simplejson import dumps as json_dumps, loads as json_loads
+
+from rbtools.utils.filesystem import write_file_atomically
+
+
+class CachedResponse(object):
+    """A response body stored in the APICache, along with its validators."""
+    def __init__(self, url, body, etag=None, last_modified=None,
+                 expires=None):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def is_fresh(self):
+        """Returns whether the response can be used without revalidating."""
+        return self.expires is not None and time.time() < self.expires
+
+    def get_conditional_headers(self):
+        """Returns the headers used to revalidate the response."""
+        headers = {}
+
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+
+class APICache(object):
+    """A persistent cache of API responses.
+
+    Responses are stored on disk, one file per URL, if the server sent an
+    ETag, a Last-Modified date or a max-age for them. Cached responses are
+    revalidated with If-None-Match/If-Modified-Since, so an unchanged
+    resource only costs a 304, and a response still within its max-age
+    costs nothing.
+
+    The total size of the cache is bounded. When it grows too large, the
+    least recently used responses are removed.
+    """
+    DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def get(self, url):
+        """Returns the CachedResponse for a URL, or None if there isn't one."""
+        filename = self._get_filename(url)
+
+        try:
+            fp = open(filename, 'rb')
+
+            try:
+                metadata = json_loads(fp.readline())
+                body = fp.read()
+            finally:
+                fp.close()
+        except (IOError, ValueError):
+            return None
+
+        if metadata.get('url') != url:
+            return None
+
+        try:
+            # Mark the entry as recently used.
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        return CachedResponse(url, body,
+                              etag=metadata.get('etag'),
+                              last_modified=metadata.get('last_modified'),
+                              expires=metadata.get('expires'))
+
+    def set(self, url, headers, body):
+        """Stores a response body, given the response headers.
+
+        Responses that can't be revalidated, or that the server asked not to
+        store, are skipped.
+        """
+        cache_control = [
+            directive.strip().lower()
+            for directive in (headers.get('cache-control') or '').split(',')
+        ]
+
+        if 'no-store' in cache_control:
+            self.remove(url)
+            return
+
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+        expires = None
+
+        if 'no-cache' not in cache_control:
+            for directive in cache_control:
+                if directive.startswith('max-age='):
+                    try:
+                        expires = time.time() + int(directive[8:])
+                    except ValueError:
+                        pass
+
+        if not etag and not last_modified and expires is None:
+            return
+
+        metadata = json_dumps({
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'expires': expires,
+        })
+
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            write_file_atomically(self._get_filename(url),
+                                  metadata + '\n' + body)
+        except (IOError, OSError), e:
+            logging.debug('Unable to write to the API cache: %s' % e)
+            return
+
+        self._evict()
+
+    def revalidated(self, response, headers):
+        """Updates a cached response after the server returned a 304.
+
+        The 304 may carry new validators or a new max-age. Any validators
+        it leaves out are kept from the cached response.
+        """
+        self.set(response.url, {
+            'etag': headers.get('etag') or response.etag,
+            'last-modified': (headers.get('last-modified') or
+                              response.last_modified),
+            'cache-control': headers.get('cache-control'),
+        }, response.body)
+
+    def remove(self, url):
+        """Removes the cached response for a URL."""
+        try:
+            os.unlink(self._get_filename(url))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Removes all cached responses."""
+        for filename, mtime, size in self._get_entries():
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
+    def _get_filename(self, url):
+        return os.path.join(self.cache_dir, sha1(url).hexdigest())
+
+    def _get_entries(self):
+        entries = []
+
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+
+        for name in names:
+            if name.startswith('.'):
+                continue
+
+            filename = os.path.join(self.cache_dir, name)
+
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+
+            entries.append((filename, st.st_mtime, st.st_size))
+
+        return entries
+
+    def _evict(self):
+        entries = self._get_entries()
+        total_size = sum([size for filename, mtime, size in entries])
+
+        if total_size <= self.max_size:
+            return
+
+        entries.sort(key=lambda entry: entry[1])
+
+        for filename, mtime, size in entries:
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.unlink(filename)
+                total_size -= size
+            except OSError:
+                pass
@@ -0,0 +1,147 @@
+from urllib import urlencode
+
+from rbtools.utils.workers import WorkerPool
+
+
+class ConcurrentAPIClient(object):
+    """Runs Review Board API operations concurrently.
+
+    This wraps a ReviewBoardServer and runs its operations on a bounded
+    pool of threads. Each operation returns a Future right away, so several
+    requests can be in flight together, and the caller collects the results
+    when it needs them:
+
+        client = ConcurrentAPIClient(server)
+        review_request = client.get_review_request(42)
+        info = client.get_repository_info(1)
+        client.update_draft(review_request.result(), fields, publish=True)
+
+    The requests go through the server's connection pool, cache and cookie
+    jar, so everything it's configured with still applies. At most
+    max_workers requests run at once, which defaults to the server's
+    max_concurrent_requests.
+    """
+    def __init__(self, server, max_workers=None):
+        self.server = server
+
+        if max_workers is None:
+            max_workers = server.max_concurrent_requests
+
+        self.pool = WorkerPool(max_workers)
+
+    def close(self):
+        """Lets the worker threads exit once queued operations are done."""
+        self.pool.shutdown()
+
+    def submit(self, func, *args, **kwargs):
+        """Runs any function in the pool, returning a Future."""
+        return self.pool.submit(func, *args, **kwargs)
+
+    def api_get(self, path):
+        return self.submit(self.server.api_get, path)
+
+    def api_post(self, path, fields=None, files=None):
+        return self.submit(self.server.api_post, path, fields, files)
+
+    def api_put(self, path, fields=None):
+        return self.submit(self.server.api_put, path, fields)
+
+    def api_delete(self, path):
+        return self.submit(self.server.api_delete, path)
+
+    def get_review_request(self, rid):
+        return self.submit(self.server.get_review_request, rid)
+
+    def get_repository_info(self, rid):
+        return self.submit(self.server.get_repository_info, rid)
+
+    def upload_diff(self, review_request, diff_content, parent_diff_content):
+        return self.submit(self.server.upload_diff, review_request,
+                           diff_content, parent_diff_content)
+
+    def update_draft(self, review_request, fields, publish=False):
+        return self.submit(self.server.update_draft, review_request, fields,
+                           publish)
+
+    def publish(self, review_request):
+        return self.submit(self.server.publish, review_request)
+
+    def get_many(self, paths):
+        """
+        Fetches several API resources at once.
+
+        Returns the responses in the same order as paths. If any request
+        fails, its exception is raised once the requests before it have
+        been collected.
+        """
+        futures = [self.api_get(path) for path in paths]
+
+        return [future.result() for future in futures]
+
+    def get_repositories(self):
+        """Returns the list of repositories on the server.
+
+        See get_list for how the pages are fetched.
+        """
+        if self.server.deprecated_api:
+            return self.server.api_get('api/json/repositories/')['repositories']
+
+        return self.get_list(
+            self.server.root_resource['links']['repositories']['href'],
+            'repositories')
+
+    def get_list(self, href, key, page_size=None):
+        """
+        Returns every item of a paged list resource.
+
+        The first page is fetched on its own to learn the total number of
+        items. The rest of the pages are then requested all at once, using
+        start and max-results, instead of following the next links one at
+        a time. If the server doesn't report a total, the next links are
+        followed instead.
+        """
+        query = {}
+
+        if page_size:
+            query['max-results'] = page_size
+
+        rsp = self.server.api_get(self._add_query(href, query))
+        items = rsp[key]
+        total = rsp.get('total_results')
+        links = rsp.get('links', {})
+
+        if 'next' not in links:
+            return items
+
+        if total is None or not items:
+            while 'next' in links:
+                rsp = self.server.api_get(links['next']['href'])
+                items.extend(rsp[key])
+                links = rsp.get('links', {})
+
+            return items
+
+        page_size = len(items)
+        paths = [
+            self._add_query(href, {
+                'start': start,
+                'max-results': page_size,
+            })
+            for start in xrange(page_size, total, page_size)
+        ]
+
+        for rsp in self.get_many(paths):
+            items.extend(rsp[key])
+
+        return items
+
+    def _add_query(self, href, query):
+        if not query:
+            return href
+
+        if '?' in href:
+            separator = '&'
+        else:
+            separator = '?'
+
+        return href + separator + urlencode(sorted(query.items()))
@@ -0,0 +1,51 @@
+import gzip
+import os
+import tempfile
+import zlib
+
+from rbtools.utils import filesystem
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def gzip_to_tempfile(src):
+    """Gzips a string or file-like object into a temporary file.
+
+    The compressed data is written out in chunks, so compressing a large
+    diff or request body doesn't need a second copy of it in memory. The
+    returned file is rewound and is deleted once it's closed.
+    """
+    tmp = tempfile.TemporaryFile(dir=filesystem.TEMP_DIR)
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=tmp)
+
+    try:
+        if isinstance(src, basestring):
+            for i in xrange(0, len(src), CHUNK_SIZE):
+                gz.write(src[i:i + CHUNK_SIZE])
+        else:
+            src.seek(0)
+
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+
+                if not chunk:
+                    break
+
+                gz.write(chunk)
+    finally:
+        gz.close()
+
+    tmp.seek(0)
+
+    return tmp
+
+
+def get_file_size(fp):
+    """Returns the size of a file object."""
+    return os.fstat(fp.fileno()).st_size
+
+
+def gunzip(data):
+    """Decompresses gzip-encoded data."""
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
@@ -0,0 +1,465 @@
+import errno
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+import urllib2
+import zlib
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from rbtools.api.compression import gunzip
+from rbtools.api.errors import RequestTimeoutError
+from rbtools.api.retry import RetryPolicy
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of persistent HTTP(S) connections.
+
+    Connections are keyed on the scheme, host and any proxy tunnel they go
+    through. Once the response for a request has been fully read, the
+    connection is handed back to the pool so the next request to the same
+    server can skip the TCP and TLS handshakes.
+
+    Idle connections that the server has since closed are dropped, rather
+    than handed out.
+
+    If keepalive is disabled, every request gets a new connection that is
+    closed once the response has been read, which matches the old urllib2
+    behavior.
+    """
+    def __init__(self, keepalive=True, max_idle=4):
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+        self.connections_opened = 0
+        self.requests = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, connection_factory, reuse=True):
+        """Returns a (connection, reused) tuple for the given key.
+
+        An idle connection is handed out if one is available and reuse is
+        allowed. Otherwise, connection_factory is called to create a new one.
+        """
+        self._lock.acquire()
+
+        try:
+            self.requests += 1
+            idle = self._idle.get(key)
+
+            while reuse and idle:
+                conn = idle.pop()
+
+                if not self._is_dropped(conn):
+                    return conn, True
+
+                conn.close()
+
+            self.connections_opened += 1
+        finally:
+            self._lock.release()
+
+        return connection_factory(), False
+
+    def release(self, key, conn):
+        """Hands a connection back to the pool once its response is read."""
+        if self.keepalive:
+            self._lock.acquire()
+
+            try:
+                idle = self._idle.setdefault(key, [])
+
+                if len(idle) < self.max_idle:
+                    idle.append(conn)
+                    return
+            finally:
+                self._lock.release()
+
+        conn.close()
+
+    def _is_dropped(self, conn):
+        """Returns whether an idle connection was closed by the server.
+
+        Nothing should arrive on a connection between requests, so if it's
+        readable, the server has closed it (or sent something unexpected).
+        """
+        if conn.sock is None:
+            return True
+
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def close(self):
+        """Closes all idle connections."""
+        self._lock.acquire()
+
+        try:
+            for idle in self._idle.itervalues():
+                for conn in idle:
+                    conn.close()
+
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+
+class KeepAliveHandlerMixin(object):
+    """Implements urllib2's do_open on top of a ConnectionPool.
+
+    This mirrors urllib2.AbstractHTTPHandler.do_open, except that the
+    connection is taken from the pool and isn't forced to close after the
+    response.
+
+    If accept_gzip is set, the server is told that gzip-encoded responses
+    are accepted, and those are decoded before being handed back.
+
+    Request bodies of expect_continue_size bytes or more are sent with
+    "Expect: 100-continue". The body is only sent once the server accepts
+    the request headers, so a large upload that's going to be rejected
+    (for instance, with a 401 or 403) isn't sent in full first. Servers that
+    don't answer within EXPECT_CONTINUE_TIMEOUT seconds get the body anyway.
+
+    connect_timeout and read_timeout limit, in seconds, how long to wait for
+    a new connection to be opened and for the server to send or accept
+    data. Either can be None to wait indefinitely (or, for connect_timeout,
+    to use the request's timeout). A request that times out raises
+    RequestTimeoutError, and is never sent again.
+
+    If stats (an HTTPStats) is given, the timings and sizes of each request
+    are recorded in it.
+    """
+    EXPECT_CONTINUE_SIZE = 1024 * 1024
+    EXPECT_CONTINUE_TIMEOUT = 3
+
+    def __init__(self, pool, accept_gzip=False,
+                 expect_continue_size=EXPECT_CONTINUE_SIZE, stats=None,
+                 connect_timeout=None, read_timeout=None):
+        self.pool = pool
+        self.accept_gzip = accept_gzip
+        self.expect_continue_size = expect_continue_size
+        self.stats = stats
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def do_open(self, http_class, req):
+        host = req.get_host()
+
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        key = (req.get_type(), host, tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+
+        if not self.pool.keepalive:
+            headers['Connection'] = 'close'
+
+        if self.accept_gzip and 'Accept-encoding' not in headers:
+            headers['Accept-encoding'] = 'gzip'
+
+        tunnel_headers = {}
+
+        if tunnel_host and 'Proxy-authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = \
+                headers.pop('Proxy-authorization')
+
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        def connection_factory():
+            conn = http_class(host,
+                              timeout=self.connect_timeout or req.timeout)
+
+            if tunnel_host:
+                conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+
+            return conn
+
+        if self.stats is not None:
+            record = self.stats.start(req.get_method(), req.get_full_url(),
+                                      int(headers.get('Content-Length', 0)))
+        else:
+            record = None
+
+        conn, reused = self.pool.get(key, connection_factory)
+
+        try:
+            r = self._send(conn, req, headers, reused, record)
+        except socket.timeout, e:
+            conn.close()
+            raise RequestTimeoutError(e)
+        except (socket.error, httplib.HTTPException), e:
+            conn.close()
+
+            if (not reused or
+                req.get_method() not in RetryPolicy.IDEMPOTENT_METHODS or
+                not self._is_idle_close(e)):
+                raise urllib2.URLError(e)
+
+            # The server closed the idle connection on us before the request
+            # got to it. Try once more on a fresh one.
+            logging.debug('Persistent connection to %s was closed (%s), '
+                          'reconnecting' % (host, e))
+            conn, reused = self.pool.get(key, connection_factory,
+                                         reuse=False)
+
+            try:
+                r = self._send(conn, req, headers, reused, record)
+            except socket.timeout, e:
+                conn.close()
+                raise RequestTimeoutError(e)
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                raise urllib2.URLError(e)
+
+        if record is not None:
+            record['status'] = r.status
+            record['reused'] = reused
+            record['ttfb'] = time.time() - record['started']
+
+        if r.getheader('content-encoding', '').lower() == 'gzip':
+            data = self._read(conn, r)
+            self._release(key, conn, r)
+            self._finish_record(record, len(data))
+
+            try:
+                fp = StringIO(gunzip(data))
+            except zlib.error, e:
+                raise urllib2.URLError('Unable to decode gzip-encoded '
+                                       'response: %s' % e)
+
+            del r.msg['content-encoding']
+            logging.debug('Decompressed response from %d to %d bytes'
+                          % (len(data), len(fp.getvalue())))
+        elif r.status >= 300:
+            # Error bodies are small. Read them now so the connection can be
+            # reused by any auth retries before the caller gets to them.
+            fp = StringIO(self._read(conn, r))
+            self._release(key, conn, r)
+            self._finish_record(record, len(fp.getvalue()))
+        else:
+            fp = self._make_body_reader(key, conn, r, record)
+
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        resp.connection_reused = reused
+
+        return resp
+
+    def _is_idle_close(self, error):
+        """
+        Returns whether error means a reused connection had been closed by
+        the server before any of the response came back.
+
+        Only then is it known that the request wasn't handled. A timeout
+        doesn't count, as the server may still be working on the request.
+        """
+        if isinstance(error, httplib.BadStatusLine):
+            # httplib reports an empty status line as "''".
+            return error.line in ('', "''")
+
+        return (isinstance(error, socket.error) and
+                not isinstance(error, socket.timeout) and
+                error.errno in (errno.ECONNRESET, errno.EPIPE))
+
+    def _send(self, conn, req, headers, reused, record):
+        if not reused:
+            self._connect(conn, record)
+
+        data = req.get_data()
+
+        if hasattr(data, 'seek'):
+            # File-like bodies have to be rewound in case this request is
+            # being retried.
+            data.seek(0)
+
+        if (data is not None and self.expect_continue_size is not None and
+            int(headers.get('Content-Length', 0)) >=
+            self.expect_continue_size):
+            r = self._send_expect_continue(conn, req, headers, data)
+
+            if r is not None:
+                return r
+
+            # The server didn't understand the expectation. Send the
+            # request again the normal way.
+            conn.close()
+            self._connect(conn, None)
+
+        conn.request(req.get_method(), req.get_selector(), data, headers)
+
+        return self._get_response(conn)
+
+    def _send_expect_continue(self, conn, req, headers, data):
+        """Sends a request, holding back the body until the server agrees.
+
+        Returns None if the server rejected the expectation with a 417.
+        """
+        method = req.get_method()
+        header_names = [name.lower() for name in headers]
+        conn.putrequest(method, req.get_selector(),
+                        skip_host='host' in header_names,
+                        skip_accept_encoding='accept-encoding' in header_names)
+
+        for name, value in headers.iteritems():
+            conn.putheader(name, value)
+
+        conn.putheader('Expect', '100-continue')
+        conn.endheaders()
+
+        readable = select.select([conn.sock], [], [],
+                                 self.EXPECT_CONTINUE_TIMEOUT)[0]
+
+        if readable:
+            # Read the interim (or final) status line without buffering, so
+            # nothing past it is consumed.
+            status_reader = conn.response_class(conn.sock, method=method)
+            version, status, reason = status_reader._read_status()
+
+            if status != httplib.CONTINUE:
+                # The server answered without wanting the body. Hand back
+                # that response. The connection can't be used again, as the
+                # request was never completed.
+                logging.debug('Server responded with HTTP %d before the '
+                              'request body was sent' % status)
+                status_reader.close()
+
+                if status == httplib.EXPECTATION_FAILED:
+                    return None
+
+                r = conn.response_class(conn.sock, method=method)
+                r._read_status = lambda: (version, status, reason)
+                r.begin()
+                r.will_close = True
+
+                return r
+
+            # Skip the rest of the 100 Continue response.
+            while status_reader.fp.readline().strip():
+                pass
+
+            status_reader.close()
+
+        conn.send(data)
+
+        return self._get_response(conn)
+
+    def _connect(self, conn, record):
+        """
+        Opens a connection.
+
+        This is done up front, rather than by httplib on the first send, so
+        that it can be timed and the read timeout can be set once it's
+        open.
+
+        Nagle's algorithm is turned off. httplib sends the headers and a
+        file-like body in separate writes, and on a reused connection the
+        body would otherwise wait for the server to acknowledge the headers,
+        which it may delay by tens of milliseconds.
+        """
+        start = time.time()
+        conn.connect()
+
+        if record is not None:
+            record['connect'] = time.time() - start
+
+        try:
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error:
+            pass
+
+        if self.read_timeout is not None or self.connect_timeout is not None:
+            conn.sock.settimeout(self.read_timeout)
+
+    def _get_response(self, conn):
+        try:
+            return conn.getresponse(buffering=True)
+        except TypeError:
+            # Python < 2.7 doesn't support the buffering argument.
+            return conn.getresponse()
+
+    def _read(self, conn, r, amt=None):
+        """
+        Reads from a response body.
+
+        If the read times out or fails, the connection is closed, so it's
+        never handed out again. The error is raised as a RequestTimeoutError
+        or URLError, like those from sending the request.
+        """
+        try:
+            return r.read(amt)
+        except socket.timeout, e:
+            conn.close()
+            raise RequestTimeoutError(e)
+        except (socket.error, httplib.HTTPException), e:
+            conn.close()
+            raise urllib2.URLError(e)
+
+    def _make_body_reader(self, key, conn, r, record):
+        released = []
+
+        def recv(amt):
+            try:
+                data = self._read(conn, r, amt)
+            except urllib2.URLError:
+                self._finish_record(record)
+                raise
+
+            if record is not None:
+                record['response_bytes'] += len(data)
+
+            if r.isclosed() and not released:
+                released.append(True)
+                self._release(key, conn, r)
+                self._finish_record(record)
+
+            return data
+
+        r.recv = recv
+
+        return socket._fileobject(r, close=True)
+
+    def _finish_record(self, record, response_bytes=None):
+        if record is not None:
+            if response_bytes is not None:
+                record['response_bytes'] = response_bytes
+
+            record['total'] = time.time() - record['started']
+
+    def _release(self, key, conn, r):
+        if r.will_close:
+            conn.close()
+        else:
+            self.pool.release(key, conn)
+
+
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, urllib2.HTTPHandler):
+    def __init__(self, pool, **kwargs):
+        urllib2.HTTPHandler.__init__(self)
+        KeepAliveHandlerMixin.__init__(self, pool, **kwargs)
+
+    def http_open(self, req):
+        return self.do_open(httplib.HTTPConnection, req)
+
+
+if hasattr(httplib, 'HTTPS'):
+    class KeepAliveHTTPSHandler(KeepAliveHandlerMixin, urllib2.HTTPSHandler):
+        def __init__(self, pool, **kwargs):
+            urllib2.HTTPSHandler.__init__(self)
+            KeepAliveHandlerMixin.__init__(self, pool, **kwargs)
+
+        def https_open(self, req):
+            return self.do_open(httplib.HTTPSConnection, req)
+else:
+    KeepAliveHTTPSHandler = None
@@ -0,0 +1,111 @@
+import cookielib
+import os
+import tempfile
+
+from rbtools.utils.filesystem import FileLock, replace_file
+
+
+class SessionCookieJar(cookielib.MozillaCookieJar):
+    """A cookie jar that's only written out when its cookies change.
+
+    Cookies are kept in memory while requests are made, and flush() writes
+    them to the cookie file once, if anything changed since they were
+    loaded or last written.
+
+    The file is written to a temporary file and renamed into place while
+    holding a lock on a neighboring lock file, so several processes sharing
+    a cookie file can't corrupt it. Under that lock, the cookies this jar
+    changed are merged into the ones currently in the file, so cookies
+    saved by other processes in the meantime aren't lost.
+    """
+    def __init__(self, filename=None):
+        cookielib.MozillaCookieJar.__init__(self, filename)
+        self._saved_state = self._get_state()
+
+    def load(self, *args, **kwargs):
+        cookielib.MozillaCookieJar.load(self, *args, **kwargs)
+        self._saved_state = self._get_state()
+
+    def is_dirty(self):
+        """Returns whether the cookies changed since they were saved."""
+        return self._get_state() != self._saved_state
+
+    def flush(self):
+        """
+        Writes the cookies to the cookie file if they've changed.
+
+        Returns whether the file was written.
+        """
+        if not self.filename or not self.is_dirty():
+            return False
+
+        state = self._get_state()
+
+        lock = FileLock(self.filename + '.lock')
+        lock.acquire()
+
+        try:
+            merged = self._merge_saved(state)
+            fd, tmpfile = tempfile.mkstemp(
+                dir=os.path.dirname(self.filename) or '.',
+                prefix='.tmp')
+            os.close(fd)
+
+            try:
+                merged.save(tmpfile)
+                replace_file(tmpfile, self.filename)
+            except:
+                try:
+                    os.unlink(tmpfile)
+                except OSError:
+                    pass
+
+                raise
+        finally:
+            lock.release()
+
+        self._saved_state = state
+
+        return True
+
+    def _merge_saved(self, state):
+        """
+        Returns a jar with the cookie file's current cookies, updated with
+        the ones this jar changed since it was loaded or last saved.
+
+        This must be called while holding the lock.
+        """
+        merged = cookielib.MozillaCookieJar()
+
+        try:
+            merged.load(self.filename, ignore_expires=True)
+        except (cookielib.LoadError, IOError):
+            # There's no file yet, or it's unreadable and will be replaced.
+            pass
+
+        for key in self._saved_state:
+            if key not in state:
+                try:
+                    merged.clear(*key)
+                except KeyError:
+                    pass
+
+        for cookie in self:
+            key = (cookie.domain, cookie.path, cookie.name)
+
+            if state[key] != self._saved_state.get(key):
+                merged.set_cookie(cookie)
+
+        return merged
+
+    def _get_state(self):
+        self._cookies_lock.acquire()
+
+        try:
+            return dict(
+                ((cookie.domain, cookie.path, cookie.name),
+                 (cookie.value, cookie.expires))
+                for cookie in self
+            )
+        finally:
+            self._cookies_lock.release()
@@ -1,3 +1,6 @@
+import urllib2
+
+
 class APIError(Exception):
     def __init__(self, http_status, error_code, rsp=None, *args, **kwargs):
         Exception.__init__(self, *args, **kwargs)
@@ -15,3 +18,11 @@ class APIError(Exception):
             return '%s (%s)' % (self.rsp['err']['msg'], code_str)
         else:
             return code_str
+
+
+class RequestTimeoutError(urllib2.URLError):
+    """Raised when the server doesn't respond within the timeout.
+
+    The request may still be handled by the server, so it's only safe to
+    send it again if it's idempotent.
+    """
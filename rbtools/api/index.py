@@ -0,0 +1,8 @@
+from rbtools.utils.index import JSONIndex
+
+
+class ServerIndex(JSONIndex):
+    """A small persistent index of entries per Review Board server.
+
+    Sections are keyed on the server URL.
+    """
@@ -0,0 +1,120 @@
+import binascii
+import os
+
+
+class MultipartBody(object):
+    """A multipart/form-data request body that is read in chunks.
+
+    The body is made up of the encoded field and part headers plus the
+    file contents, which may be strings or file objects. Nothing is
+    concatenated up front, so the whole body never has to be held in memory,
+    and the Content-Length is known before anything is sent.
+
+    Each file is a dictionary with 'filename' and 'content' keys, and an
+    optional 'content_type'.
+
+    This is a file-like object that httplib can send directly. It can be
+    rewound with seek(0) so that a request can be retried.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fields=None, files=None):
+        # os.urandom is much cheaper than mimetools.choose_boundary, which
+        # looks up the hostname.
+        self.boundary = binascii.hexlify(os.urandom(16))
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self._parts = []
+
+        fields = fields or {}
+        files = files or {}
+
+        for key in fields:
+            self._parts.append(
+                '--%s\r\n'
+                'Content-Disposition: form-data; name="%s"\r\n'
+                '\r\n'
+                '%s\r\n'
+                % (self.boundary, key, str(fields[key])))
+
+        for key in files:
+            part_headers = ('--%s\r\n'
+                            'Content-Disposition: form-data; name="%s"; '
+                            'filename="%s"\r\n'
+                            % (self.boundary, key, files[key]['filename']))
+
+            if 'content_type' in files[key]:
+                part_headers += ('Content-Type: %s\r\n'
+                                 % files[key]['content_type'])
+
+            self._parts.append(part_headers + '\r\n')
+            self._parts.append(files[key]['content'])
+            self._parts.append('\r\n')
+
+        self._parts.append('--%s--\r\n\r\n' % self.boundary)
+
+        self._sizes = [self._get_part_size(part) for part in self._parts]
+        self._length = sum(self._sizes)
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def seek(self, offset, whence=0):
+        """Rewinds the body. Only seeking to the start is supported."""
+        if offset != 0 or whence != 0:
+            raise IOError('MultipartBody can only be rewound to the start')
+
+        self._part_index = 0
+        self._part_offset = 0
+
+        for part in self._parts:
+            if not isinstance(part, basestring):
+                part.seek(0)
+
+    def tell(self):
+        return (sum(self._sizes[:self._part_index]) + self._part_offset)
+
+    def read(self, size=-1):
+        """Reads up to size bytes from the body.
+
+        If size is negative, the rest of the body is returned.
+        """
+        if size is None or size < 0:
+            size = self._length
+
+        chunks = []
+
+        while size > 0 and self._part_index < len(self._parts):
+            part = self._parts[self._part_index]
+
+            if isinstance(part, basestring):
+                chunk = part[self._part_offset:self._part_offset + size]
+            else:
+                chunk = part.read(min(size, self.CHUNK_SIZE))
+
+            if chunk:
+                chunks.append(chunk)
+                size -= len(chunk)
+                self._part_offset += len(chunk)
+
+            if (not chunk or
+                self._part_offset >= self._sizes[self._part_index]):
+                self._part_index += 1
+                self._part_offset = 0
+
+        return ''.join(chunks)
+
+    def close(self):
+        for part in self._parts:
+            if not isinstance(part, basestring):
+                part.close()
+
+    def _get_part_size(self, part):
+        if isinstance(part, basestring):
+            return len(part)
+
+        try:
+            return os.fstat(part.fileno()).st_size
+        except (AttributeError, OSError):
+            part.seek(0, 2)
+            return part.tell()
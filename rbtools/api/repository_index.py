@@ -0,0 +1,29 @@
+from rbtools.utils.index import JSONIndex
+
+
+class RepositoryIndex(JSONIndex):
+    """A persistent index of server repositories by repository UUID.
+
+    Matching a local repository to one on the server means fetching the
+    info for every candidate repository, which is slow on servers with many
+    repositories. Once a match is found, it's recorded here, keyed on the
+    server URL and the repository UUID (or VOB family UUID), so later runs
+    can skip the scan.
+
+    Entries are plain dictionaries of whatever the caller needs to rebuild
+    its RepositoryInfo.
+    """
+    def remove_path(self, server_url, path):
+        """Removes all entries for a server that point to a repository path.
+
+        This is used when the server reports that the path isn't a valid
+        repository anymore.
+        """
+        def update(index):
+            entries = index.get(server_url, {})
+
+            for uuid, entry in entries.items():
+                if entry.get('path') == path:
+                    del entries[uuid]
+
+        self._update(update)
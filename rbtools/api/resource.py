@@ -0,0 +1,163 @@
+import threading
+from urllib import urlencode
+
+
+class Resource(object):
+    """A Review Board API resource that's only fetched when it's needed.
+
+    A resource knows its URL and, once it has been fetched (or was built
+    from a payload that was already at hand, such as an item of a list),
+    its fields. Linked resources are reached through get_link, which
+    returns the same Resource object for the same URL for the rest of the
+    run, so walking the same links again doesn't cost any requests.
+
+    key is the name of the payload's field holding the resource, such as
+    'repository' or 'review_request'. It's None for the API root, whose
+    payload is the resource itself.
+    """
+    def __init__(self, graph, url, key=None, fields=None):
+        self.graph = graph
+        self.url = url
+        self.key = key
+        self._fields = fields
+
+    def _get_fields(self):
+        if self._fields is None:
+            rsp = self.graph.server.api_get(self.url)
+
+            if self.key:
+                self._fields = rsp[self.key]
+            else:
+                self._fields = rsp
+
+        return self._fields
+
+    fields = property(_get_fields)
+
+    def _get_links(self):
+        return self.fields['links']
+
+    links = property(_get_links)
+
+    def is_loaded(self):
+        """Returns whether the fields of the resource are known."""
+        return self._fields is not None
+
+    def get_link(self, name, key=None, **query):
+        """
+        Returns the resource a link points to.
+
+        Query arguments can be given to ask for expanded or partial
+        payloads, on servers that allow it (for instance, expand or
+        only_fields).
+        """
+        return self.graph.get(self.links[name]['href'], key, **query)
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+
+class ResourceGraph(object):
+    """The resources of a Review Board server fetched during a run.
+
+    Each URL maps to a single Resource, so anything fetched once is reused
+    by every caller that walks to it. Writing to a resource forgets it,
+    along with the resources above and below it, since their payloads may
+    have changed with it.
+    """
+    def __init__(self, server):
+        self.server = server
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, key=None, fields=None, **query):
+        """
+        Returns the Resource for a URL.
+
+        If fields are given and the resource wasn't loaded yet, they're
+        used as its payload, saving the request.
+
+        Query arguments are added to the URL, with underscores in their
+        names turned into dashes (so only_fields becomes only-fields).
+        Lists of values are joined with commas.
+        """
+        url = self._make_url(url, query)
+
+        self._lock.acquire()
+
+        try:
+            resource = self._resources.get(url)
+
+            if resource is None:
+                resource = Resource(self, url, key, fields)
+                self._resources[url] = resource
+            elif fields is not None and not resource.is_loaded():
+                resource._fields = fields
+        finally:
+            self._lock.release()
+
+        return resource
+
+    def add(self, fields, key):
+        """
+        Records a resource payload that's already at hand, such as an item
+        of a list or the result of a POST.
+
+        Returns the Resource, or None if the payload doesn't link to itself.
+        """
+        try:
+            url = fields['links']['self']['href']
+        except KeyError:
+            return None
+
+        return self.get(url, key, fields)
+
+    def forget(self, url):
+        """Forgets a resource and the resources above and below it."""
+        url = self.server._make_url(url)
+        root_url = self.server._make_url('api/')
+
+        self._lock.acquire()
+
+        try:
+            for resource_url in self._resources.keys():
+                path = resource_url.split('?')[0]
+
+                if (path != root_url and
+                    (path.startswith(url) or url.startswith(path))):
+                    del self._resources[resource_url]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Forgets all resources."""
+        self._lock.acquire()
+
+        try:
+            self._resources = {}
+        finally:
+            self._lock.release()
+
+    def _make_url(self, url, query):
+        url = self.server._make_url(url)
+
+        if query:
+            args = []
+
+            for name, value in sorted(query.items()):
+                if isinstance(value, (list, tuple)):
+                    value = ','.join(value)
+
+                args.append((name.replace('_', '-'), value))
+
+            if '?' in url:
+                url += '&'
+            else:
+                url += '?'
+
+            url += urlencode(args)
+
+        return url
@@ -0,0 +1,101 @@
+import errno
+import httplib
+import logging
+import random
+import socket
+import time
+import urllib2
+
+from rbtools.api.errors import RequestTimeoutError
+
+
+class RetryPolicy(object):
+    """Decides when a failed HTTP request is tried again, and when.
+
+    Requests that can safely be sent twice (GET, PUT and DELETE) are retried
+    when the connection fails, is reset or times out, and when the server
+    answers with one of RETRY_STATUSES, which usually mean a proxy or load
+    balancer couldn't reach a working server.
+
+    500 isn't one of them. Review Board reports some API errors (such as
+    210, when a repository's info can't be fetched) with a 500, and those
+    come back the same on every try.
+
+    Other requests (POSTs) may already have been acted on when those
+    happen, so they're only retried when it's certain they weren't: when
+    the connection was refused, or the server answered 503 Service
+    Unavailable. In particular, they're never retried after a timeout, as
+    the server may still be working on them.
+
+    Each retry waits longer than the last, doubling from backoff seconds up
+    to max_backoff, with random jitter so that many clients failing at once
+    don't all come back at once. A Retry-After header from the server is
+    honored if it asks for a longer wait.
+    """
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def call(self, method, func, *args, **kwargs):
+        """
+        Calls func, which performs a request using the given HTTP method,
+        retrying it as the policy allows.
+
+        The exception from the last attempt is raised if all attempts fail.
+        """
+        attempt = 0
+
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except (urllib2.URLError, socket.error, httplib.HTTPException), e:
+                if (attempt >= self.max_retries or
+                    not self.should_retry(method, e)):
+                    raise
+
+                delay = self.get_delay(attempt, e)
+                logging.debug('%s request failed (%s). Retrying in %.1f '
+                              'seconds' % (method, e, delay))
+                time.sleep(delay)
+                attempt += 1
+
+    def should_retry(self, method, error):
+        """Returns whether a request that failed with error can be retried."""
+        idempotent = method in self.IDEMPOTENT_METHODS
+
+        if isinstance(error, urllib2.HTTPError):
+            return (error.code in self.RETRY_STATUSES and
+                    (idempotent or error.code == 503))
+
+        if isinstance(error, RequestTimeoutError):
+            return idempotent
+
+        if isinstance(error, urllib2.URLError):
+            error = error.reason
+
+        if (isinstance(error, socket.error) and
+            getattr(error, 'errno', None) == errno.ECONNREFUSED):
+            # Nothing was sent.
+            return True
+
+        return idempotent and isinstance(error, (socket.error,
+                                                 httplib.HTTPException))
+
+    def get_delay(self, attempt, error=None):
+        """Returns the number of seconds to wait before the next attempt."""
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        delay = random.uniform(delay / 2.0, delay)
+
+        if isinstance(error, urllib2.HTTPError):
+            try:
+                retry_after = int(error.info().get('Retry-After', 0))
+            except (TypeError, ValueError):
+                retry_after = 0
+
+            delay = max(delay, min(retry_after, self.max_backoff))
+
+        return delay
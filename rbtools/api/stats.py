@@ -0,0 +1,159 @@
+import re
+import threading
+import time
+from urlparse import urlparse
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+ID_SEGMENT_RE = re.compile(r'/\d+(?=/|$)')
+
+
+def get_url_template(url):
+    """
+    Returns the path of a URL with the IDs in it replaced by <id>.
+
+    This groups requests for the same kind of resource together, such as
+    /api/review-requests/<id>/draft/. The query string is left out.
+    """
+    return ID_SEGMENT_RE.sub('/<id>', urlparse(url)[2])
+
+
+class HTTPStats(object):
+    """Timings and sizes of the HTTP requests made during a run.
+
+    Each request is recorded as a dictionary with these keys:
+
+        method:         The HTTP method.
+        url:            The URL template (see get_url_template).
+        status:         The HTTP status code of the response.
+        reused:         Whether a kept-alive connection was reused.
+        request_bytes:  The size of the request body.
+        response_bytes: The size of the response body, as transferred
+                        (before any gzip decoding).
+        connect:        The seconds taken to open a new connection. This
+                        covers the DNS lookup, TCP connect and TLS
+                        handshake. It's None for reused connections.
+        ttfb:           The seconds until the response headers arrived.
+        total:          The seconds until the response body was read. This
+                        is None if the body was never read to the end.
+
+    Times are measured from when the request was started.
+    """
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def start(self, method, url, request_bytes):
+        """Starts recording a request, returning its record."""
+        record = {
+            'method': method,
+            'url': get_url_template(url),
+            'status': None,
+            'reused': False,
+            'request_bytes': request_bytes,
+            'response_bytes': 0,
+            'connect': None,
+            'ttfb': None,
+            'total': None,
+            'started': time.time(),
+        }
+
+        self._lock.acquire()
+
+        try:
+            self.requests.append(record)
+        finally:
+            self._lock.release()
+
+        return record
+
+    def get_totals(self):
+        """Returns a dictionary summing up all recorded requests."""
+        requests = [record for record in self.requests
+                    if record['status'] is not None]
+
+        if requests:
+            started = min([record['started'] for record in requests])
+            finished = max([record['started'] + (record['total'] or
+                                                 record['ttfb'])
+                            for record in requests])
+            elapsed = finished - started
+        else:
+            elapsed = 0
+
+        return {
+            'requests': len(requests),
+            'connections': len([record for record in requests
+                                if not record['reused']]),
+            'request_bytes': sum([record['request_bytes']
+                                  for record in requests]),
+            'response_bytes': sum([record['response_bytes']
+                                   for record in requests]),
+            'connect': sum([record['connect'] or 0
+                            for record in requests]),
+            'elapsed': elapsed,
+        }
+
+    def format_table(self):
+        """Returns a table of the requests and their totals, for printing."""
+        lines = ['%-6s %-44s %6s %10s %10s %9s %9s %9s %6s' %
+                 ('Method', 'URL', 'Status', 'Sent', 'Received',
+                  'Connect', 'TTFB', 'Total', 'Reused')]
+
+        for record in self.requests:
+            if record['status'] is None:
+                continue
+
+            lines.append('%-6s %-44s %6d %10d %10d %9s %9s %9s %6s' % (
+                record['method'],
+                record['url'],
+                record['status'],
+                record['request_bytes'],
+                record['response_bytes'],
+                self._format_time(record['connect']),
+                self._format_time(record['ttfb']),
+                self._format_time(record['total']),
+                record['reused'] and 'yes' or 'no'))
+
+        totals = self.get_totals()
+        lines.append('%d request(s) over %d connection(s), %d bytes sent, '
+                     '%d bytes received, %s spent connecting, '
+                     '%s elapsed' % (
+                         totals['requests'],
+                         totals['connections'],
+                         totals['request_bytes'],
+                         totals['response_bytes'],
+                         self._format_time(totals['connect']),
+                         self._format_time(totals['elapsed'])))
+
+        return '\n'.join(lines)
+
+    def save(self, filename, **extra):
+        """
+        Writes the requests and totals to a file as JSON.
+
+        Any keyword arguments are added to the top level of the document.
+        """
+        data = dict(extra)
+        data.update({
+            'requests': [record for record in self.requests
+                         if record['status'] is not None],
+            'totals': self.get_totals(),
+        })
+
+        fp = open(filename, 'w')
+
+        try:
+            json.dump(data, fp, indent=2, sort_keys=True)
+        finally:
+            fp.close()
+
+    def _format_time(self, seconds):
+        if seconds is None:
+            return '-'
+
+        return '%.1fms' % (seconds * 1000)
@@ -1,12 +1,23 @@
 import logging
+import os
 import sys
+import time
 
-from rbtools.utils.process import die
+from rbtools.api.errors import APIError
+from rbtools.clients.markers import ClientMarkers, PERFORCE_MARKERS, \
+                                    SCMCLIENT_MARKERS
+from rbtools.utils.filesystem import find_tree, walk_parents
+from rbtools.utils.process import ProcessGroup, die, set_process_group
 
 
-# The clients are lazy loaded via load_scmclients()
+# The clients are lazy loaded via load_scmclients(), or, when checkout
+# markers are found, only those clients are loaded by load_marked_clients().
 SCMCLIENTS = None
 
+# How long to wait for abandoned SCM probes to exit once their commands
+# have been killed.
+PROBE_GRACE_PERIOD = 2
+
 
 class SCMClient(object):
     """
@@ -14,6 +25,15 @@ class SCMClient(object):
     and generating diffs.
     """
 
+    # The checkout markers of this tool, a ClientMarkers from
+    # rbtools.clients.markers.
+    markers = None
+
+    # Attributes set by get_repository_info that the rest of the client
+    # depends on. They're saved along with the repository info in the
+    # detection cache.
+    cache_attributes = []
+
     def __init__(self, user_config=None, configs=[], options=None):
         self.user_config = user_config
         self.configs = configs
@@ -22,6 +42,68 @@ class SCMClient(object):
     def get_repository_info(self):
         return None
 
+    def has_marker(self, path):
+        """
+        Returns whether a directory holds a file marking a checkout managed
+        by this tool.
+
+        This lets scan_usable_client guess which tool to try without
+        running any commands.
+        """
+        return self.markers is not None and self.markers.has_marker(path)
+
+    def activate(self):
+        """
+        Prepares the client for use, once it's been chosen.
+
+        get_repository_info may run at the same time as other clients'
+        probes, so anything that affects the whole process (such as
+        changing the working directory) is done here instead.
+        """
+        pass
+
+    def check_tools(self):
+        """
+        Checks that the other tools the client needs are installed, exiting
+        if they aren't.
+
+        get_repository_info calls this once it has found a repository. It's
+        also called when the repository comes from the detection cache, as
+        the tools may have been removed after it was detected.
+        """
+        pass
+
+    def get_cache_files(self, root):
+        """
+        Returns the files that a cached detection in the checkout at root
+        depends on.
+
+        The cached repository info is used only while none of these have
+        been modified, created or removed. By default, these are the
+        checkout markers.
+        """
+        if self.markers is None:
+            return []
+
+        return [os.path.join(root, filename)
+                for filename in self.markers.marker_files]
+
+    def get_cache_state(self):
+        """Returns the cache_attributes set by get_repository_info."""
+        state = {}
+
+        for name in self.cache_attributes:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+
+        return state
+
+    def set_cache_state(self, state):
+        """Restores the state saved by get_cache_state."""
+        for name in self.cache_attributes:
+            if name in state:
+                setattr(self, name, state[name])
+
     def check_options(self):
         pass
 
@@ -69,20 +151,12 @@ class SCMClient(object):
             if not isinstance(trees, dict):
                 die("Warning: 'TREES' in config file is not a dict!")
 
-            # If repository_info is a list, check if any one entry is in trees.
-            path = None
-
-            if isinstance(repository_info.path, list):
-                for path in repository_info.path:
-                    if path in trees:
-                        break
-                else:
-                    path = None
-            elif repository_info.path in trees:
-                path = repository_info.path
+            # repository_info.path may be a list, and an entry for a parent
+            # of the repository path also matches.
+            tree = find_tree(trees, repository_info.path)
 
-            if path and 'REVIEWBOARD_URL' in trees[path]:
-                return trees[path]['REVIEWBOARD_URL']
+            if tree and 'REVIEWBOARD_URL' in tree:
+                return tree['REVIEWBOARD_URL']
 
         return None
 
@@ -118,43 +192,289 @@ class RepositoryInfo(object):
         """
         return self
 
+    def _iter_server_repository_info(self, server, tool):
+        """
+        Iterates over (repository, info) pairs for the server's repositories
+        of the given tool.
+
+        The info for several repositories is fetched at once, up to the
+        server's max_concurrent_requests. Once the caller stops iterating,
+        no more info is requested.
+        """
+        from rbtools.utils.workers import imap_ordered
+
+        for repository, info in imap_ordered(
+                lambda repository: self._get_repository_info(server,
+                                                             repository),
+                server.iter_repositories(tool=tool),
+                server.max_concurrent_requests):
+            if info:
+                yield repository, info
+
+    def _get_indexed_repository(self, server, uuid):
+        """
+        Returns the entry recorded in the server's repository index for a
+        repository UUID, or None if there isn't one.
+        """
+        if server.repository_index:
+            return server.repository_index.get(server.url, uuid)
+
+        return None
+
+    def _index_repository(self, server, uuid, entry):
+        """Records a matched repository in the server's repository index."""
+        if server.repository_index:
+            server.repository_index.set(server.url, uuid, entry)
+
+    def _get_repository_info(self, server, repository):
+        try:
+            return server.get_repository_info(repository['id'])
+        except APIError, e:
+            # If the server couldn't fetch the repository info, it will return
+            # code 210. Ignore those.
+            # Other more serious errors should still be raised, though.
+            if e.error_code == 210:
+                return None
+
+            raise e
+
 
 def load_scmclients(options):
     global SCMCLIENTS
 
-    from rbtools.clients.clearcase import ClearCaseClient
-    from rbtools.clients.cvs import CVSClient
-    from rbtools.clients.git import GitClient
-    from rbtools.clients.mercurial import MercurialClient
-    from rbtools.clients.perforce import PerforceClient
-    from rbtools.clients.plastic import PlasticClient
-    from rbtools.clients.svn import SVNClient
+    SCMCLIENTS = [markers.load_client(options)
+                  for markers in SCMCLIENT_MARKERS]
+
+
+def load_marked_clients(path, options):
+    """
+    Returns the nearest of path and its parents that has checkout markers,
+    along with clients for the markers that are there.
+
+    Unless the clients are already loaded, only the modules of the clients
+    whose markers are found are imported.
+    """
+    if SCMCLIENTS is not None:
+        return find_checkout_root(path, SCMCLIENTS)
+
+    root, found = find_checkout_root(path, SCMCLIENT_MARKERS)
 
-    SCMCLIENTS = [
-        CVSClient(options=options),
-        ClearCaseClient(options=options),
-        GitClient(options=options),
-        MercurialClient(options=options),
-        PerforceClient(options=options),
-        PlasticClient(options=options),
-        SVNClient(options=options),
-    ]
+    return root, [markers.load_client(options) for markers in found]
 
 
-def scan_usable_client(options):
-    from rbtools.clients.perforce import PerforceClient
+def find_checkout_root(path, clients):
+    """
+    Returns the nearest of path and its parents that has checkout markers,
+    along with the clients whose markers are there.
+
+    If no directory has any markers, this returns (None, []).
+    """
+    for path in walk_parents(os.path.abspath(path)):
+        found = [client for client in clients if client.has_marker(path)]
 
+        if found:
+            logging.debug('Found checkout markers for %s in %s' %
+                          (', '.join([_get_client_name(client)
+                                      for client in found]), path))
+            return path, found
+
+    return None, []
+
+
+def _get_client_name(client):
+    """Returns the class name of a client, or of the client for markers."""
+    if isinstance(client, ClientMarkers):
+        return client.class_name
+
+    return client.__class__.__name__
+
+
+def probe_clients(clients, timeout=None):
+    """
+    Runs the get_repository_info probes of several clients at once.
+
+    Returns a (tool, repository_info) tuple for the first client, in the
+    order given, that finds a repository, or (None, None). This is the same
+    client that probing them one at a time would choose. Output written by
+    the probes is held back, and only that of the probes that would have
+    run one at a time is shown. This includes what they log through the
+    root logger's handlers. An exception raised by one of those probes is
+    raised here.
+
+    A probe that hasn't finished within timeout seconds is counted as
+    finding nothing, with a warning. Once the winner is known, the commands
+    still run by the other probes are killed.
+    """
+    if len(clients) <= 1:
+        for tool in clients:
+            repository_info = tool.get_repository_info()
+
+            if repository_info:
+                return tool, repository_info
+
+        return None, None
+
+    from rbtools.utils.workers import ThreadLocalOutput, WorkerPool
+
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+    stdout = ThreadLocalOutput(old_stdout)
+    stderr = ThreadLocalOutput(old_stderr)
+    outputs = {}
+    probes = []
+    _redirect_log_handlers({old_stdout: stdout, old_stderr: stderr})
+
+    def probe(tool, group):
+        set_process_group(group)
+        stdout.capture()
+        stderr.capture()
+
+        try:
+            return tool.get_repository_info()
+        finally:
+            set_process_group(None)
+            outputs[tool] = (stdout.release(), stderr.release())
+
+    sys.stdout = stdout
+    sys.stderr = stderr
+    pool = WorkerPool(len(clients))
+
+    try:
+        for tool in clients:
+            group = ProcessGroup()
+            probes.append((tool, group, pool.submit(probe, tool, group)))
+
+        if timeout:
+            deadline = time.time() + timeout
+
+        for tool, group, future in probes:
+            if timeout:
+                finished = future.wait(max(0, deadline - time.time()))
+            else:
+                finished = future.wait()
+
+            if not finished:
+                old_stderr.write('Warning: Gave up on probing for %s after '
+                                 '%s seconds. Use --scm-probe-timeout=0 to '
+                                 'wait for it.\n'
+                                 % (tool.__class__.__name__, timeout))
+                continue
+
+            out, err = outputs.pop(tool)
+            old_stdout.write(out)
+            old_stderr.write(err)
+
+            repository_info = future.result()
+
+            if repository_info:
+                return tool, repository_info
+
+        return None, None
+    finally:
+        pending = [(group, future) for tool, group, future in probes
+                   if not future.done()]
+
+        for group, future in pending:
+            group.kill()
+
+        # Give the abandoned probes a moment to wind down before putting
+        # the output streams back, so that nothing they print leaks out.
+        grace_deadline = time.time() + PROBE_GRACE_PERIOD
+
+        for group, future in pending:
+            future.wait(max(0, grace_deadline - time.time()))
+
+        sys.stdout = old_stdout
+        sys.stderr = old_stderr
+        _redirect_log_handlers({stdout: old_stdout, stderr: old_stderr})
+        pool.shutdown()
+
+
+def _redirect_log_handlers(streams):
+    """
+    Points the root logger's stream handlers that write to one of the keys
+    of streams at the matching value.
+
+    Handlers set up before sys.stdout or sys.stderr are replaced keep
+    writing to the old streams otherwise.
+    """
+    for handler in logging.getLogger().handlers:
+        stream = getattr(handler, 'stream', None)
+
+        if stream in streams:
+            handler.acquire()
+
+            try:
+                handler.stream = streams[stream]
+            finally:
+                handler.release()
+
+
+def scan_usable_client(options, detection_cache=None):
+    """
+    Finds the client for the repository of the current directory.
+
+    Returns a (repository_info, tool) tuple, or exits if there's no
+    repository. If a DetectionCache is given, a repository already
+    detected in this directory is used without probing (unless
+    options.redetect_repository is set), and newly detected ones are
+    recorded in it.
+    """
     repository_info = None
     tool = None
 
-    if SCMCLIENTS is None:
-        load_scmclients(options)
+    # Try to find the SCM Client we're going to be working with. Probing
+    # a client runs its tools, which can be slow (or even contact a
+    # server), so first try the clients whose checkout markers are found
+    # on disk. If none of them work out, try the rest in the usual order.
+    # Only the clients that are tried are loaded.
+    #
+    # Each set of clients is probed in parallel, with the winner picked
+    # in order. What the marked clients find is cached for the checkout
+    # root. The rest (such as Perforce without a P4CONFIG file) have no
+    # root to go by, so theirs is cached for the current directory.
+    #
+    # A repository URL doesn't need a checkout, so there's nothing to look
+    # for or cache in that case.
+    cwd = os.getcwd()
+    timeout = options.scm_probe_timeout or None
+
+    def get_client_sets():
+        if options.repository_url:
+            candidates = []
+            other_root = None
+        else:
+            root, candidates = load_marked_clients(cwd, options)
+            other_root = cwd
+            yield root, candidates
+
+        # The rest of the clients are only loaded if they're needed.
+        if SCMCLIENTS is None:
+            load_scmclients(options)
 
-    # Try to find the SCM Client we're going to be working with.
-    for tool in SCMCLIENTS:
-        repository_info = tool.get_repository_info()
+        marked = [client.markers for client in candidates]
+        yield other_root, [client for client in SCMCLIENTS
+                           if client.markers not in marked]
+
+    for root, client_set in get_client_sets():
+        if not client_set:
+            continue
+
+        if detection_cache and root and not options.redetect_repository:
+            tool, repository_info = detection_cache.load(root, cwd,
+                                                         client_set, options)
+
+            if repository_info:
+                tool.check_tools()
+                break
+
+        tool, repository_info = probe_clients(client_set, timeout)
 
         if repository_info:
+            if detection_cache and root:
+                detection_cache.store(root, cwd, tool, repository_info,
+                                      options)
+
             break
 
     if not repository_info:
@@ -178,9 +498,11 @@ def scan_usable_client(options):
         sys.exit(1)
 
     if ((options.p4_client or options.p4_port) and
-        not isinstance(tool, PerforceClient)):
+        tool.markers is not PERFORCE_MARKERS):
         sys.stderr.write("The --p4-client and --p4-port options are not valid "
                          "for the current SCM client.\n")
         sys.exit(1)
 
+    tool.activate()
+
     return (repository_info, tool)
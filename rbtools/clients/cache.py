@@ -0,0 +1,153 @@
+import logging
+import os
+import sys
+
+from rbtools.utils.index import JSONIndex
+
+
+# Options and environment variables that change what detection finds. An
+# entry is only used if they're the same as when it was recorded.
+DETECTION_OPTIONS = ('tracking', 'parent_branch', 'p4_client', 'p4_port',
+                     'xmerge')
+DETECTION_ENVIRON = ('GIT_DIR', 'HGRCPATH', 'P4CONFIG', 'P4CLIENT', 'P4PORT',
+                     'P4USER', 'P4ENVIRO', 'CLEARCASE_ROOT')
+
+
+class DetectionCache(JSONIndex):
+    """A persistent cache of the repositories detected in checkouts.
+
+    Finding the repository for a checkout means running the SCM tools,
+    and sometimes contacting a server, but the answer rarely changes. Once
+    a client has found a repository, the client type, the RepositoryInfo
+    and the client's state (see SCMClient.cache_attributes) are recorded
+    here, keyed on the checkout root and the directory within it, so later
+    runs in the same place can skip detection. Clients found without
+    checkout markers use the directory itself as the root.
+
+    An entry is thrown away once any of the files the client named in
+    get_cache_files() has been modified, created or removed.
+    """
+    def load(self, root, cwd, clients, options):
+        """
+        Returns a (tool, repository_info) tuple from the cached entry for a
+        directory in a checkout, or (None, None).
+
+        The tool is one of the given clients, restored to its state at the
+        time of detection.
+        """
+        entry = self.get(root, self._get_key(root, cwd))
+
+        if not entry:
+            return None, None
+
+        for tool in clients:
+            if tool.__class__.__name__ == entry.get('client'):
+                break
+        else:
+            return None, None
+
+        if entry.get('conditions') != self._get_conditions(options):
+            logging.debug('Options or environment changed since %s was '
+                          'detected in %s' % (entry['client'], root))
+            return None, None
+
+        files = entry.get('files', {})
+
+        for filename, mtime in files.iteritems():
+            if get_mtime(filename) != mtime:
+                logging.debug('%s changed since %s was detected in %s'
+                              % (filename, entry['client'], root))
+                return None, None
+
+        repository_info = _load_repository_info(entry.get('info'))
+
+        if not repository_info:
+            return None, None
+
+        tool.set_cache_state(_to_str(entry.get('state', {})))
+        logging.debug('Using the cached %s repository info for %s'
+                      % (entry['client'], root))
+
+        return tool, repository_info
+
+    def store(self, root, cwd, tool, repository_info, options):
+        """Records the repository a client detected in a checkout."""
+        files = {}
+
+        for filename in tool.get_cache_files(root):
+            files[filename] = get_mtime(filename)
+
+        self.set(root, self._get_key(root, cwd), {
+            'client': tool.__class__.__name__,
+            'conditions': self._get_conditions(options),
+            'files': files,
+            'info': {
+                'class': '%s.%s' % (repository_info.__class__.__module__,
+                                    repository_info.__class__.__name__),
+                'attrs': repository_info.__dict__,
+            },
+            'state': tool.get_cache_state(),
+        })
+
+    def _get_key(self, root, cwd):
+        # cwd is root or one of its subdirectories.
+        return cwd[len(root):].lstrip(os.sep) or '.'
+
+    def _get_conditions(self, options):
+        conditions = {}
+
+        for name in DETECTION_OPTIONS:
+            conditions[name] = getattr(options, name, None)
+
+        for name in DETECTION_ENVIRON:
+            conditions['$' + name] = os.environ.get(name)
+
+        # Compare the way they'd come back from the JSON file.
+        return _to_str(conditions)
+
+
+def get_mtime(filename):
+    """Returns the modification time of a file, or None if it's missing."""
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+
+def _load_repository_info(data):
+    """Rebuilds a RepositoryInfo recorded by DetectionCache.store."""
+    try:
+        module_name, class_name = data['class'].rsplit('.', 1)
+        attrs = data['attrs']
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+    if module_name.split('.')[:2] != ['rbtools', 'clients']:
+        return None
+
+    try:
+        __import__(module_name)
+        cls = getattr(sys.modules[module_name], class_name)
+    except (ImportError, AttributeError):
+        return None
+
+    repository_info = cls.__new__(cls)
+    repository_info.__dict__.update(_to_str(attrs))
+
+    return repository_info
+
+
+def _to_str(value):
+    """
+    Turns the unicode strings that come back from the JSON file into plain
+    strings, as the clients produced them.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_to_str(item) for item in value]
+    elif isinstance(value, dict):
+        return dict([(_to_str(key), _to_str(item))
+                     for key, item in value.iteritems()])
+
+    return value
@@ -4,8 +4,8 @@ import re
 import sys
 import zlib
 
-from rbtools.api.errors import APIError
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.clients.markers import CLEARCASE_MARKERS
 from rbtools.utils.checks import check_gnu_diff, check_gnu_patch, check_install
 from rbtools.utils.filesystem import make_tempfile, read_text_file
 from rbtools.utils.process import die, execute
@@ -28,6 +28,12 @@ class ClearCaseClient(SCMClient):
     viewtype = None
     HLINK_MERGE = re.compile(r'"Merge@.*?" <- ".*"')
 
+    # Snapshot views have a view.dat (.view.dat on Unix) in their top
+    # directory.
+    markers = CLEARCASE_MARKERS
+
+    cache_attributes = ['viewtype']
+
     def __init__(self, **kwargs):
         super(ClearCaseClient, self).__init__(**kwargs)
 
@@ -52,14 +58,9 @@ class ClearCaseClient(SCMClient):
         if viewname.startswith('** NONE'):
             return None
 
-        # Now that we know it's ClearCase, make sure we have GNU diff
-        # installed, and error out if we don't.
-        check_gnu_diff()
-
-        # When the exclude merge option is enabled, make sure we have
-        # GNU patch installed.
-        if self.options.xmerge:
-            check_gnu_patch()
+        # Now that we know it's ClearCase, make sure we have the tools we
+        # need installed, and error out if we don't.
+        self.check_tools()
 
         property_lines = execute(["cleartool", "lsview", "-full",
                                   "-properties", "-cview"],
@@ -101,6 +102,14 @@ class ClearCaseClient(SCMClient):
                               vobstag=vobstag,
                               supports_parent_diffs=False)
 
+    def check_tools(self):
+        check_gnu_diff()
+
+        # When the exclude merge option is enabled, make sure we have
+        # GNU patch installed.
+        if self.options.xmerge:
+            check_gnu_patch()
+
     def check_options(self):
         if ((self.options.revision_range or self.options.tracking)
             and self.viewtype != "dynamic"):
@@ -475,18 +484,23 @@ class ClearCaseRepositoryInfo(RepositoryInfo):
         uuid = self._get_vobs_uuid(self.vobstag)
         logging.debug("Repository's %s uuid is %r" % (self.vobstag, uuid))
 
-        repositories = server.get_repositories()
-        for repository in repositories:
-            if repository['tool'] != 'ClearCase':
-                continue
+        entry = self._get_indexed_repository(server, uuid)
 
-            info = self._get_repository_info(server, repository)
+        if entry:
+            logging.debug('Using indexed repository path %s for uuid:%s'
+                          % (entry['path'], uuid))
+            return ClearCaseRepositoryInfo(entry['path'], entry['path'], uuid)
 
-            if not info or uuid != info['uuid']:
+        for repository, info in self._iter_server_repository_info(
+                server, 'ClearCase'):
+            if uuid != info['uuid']:
                 continue
 
             logging.debug('Matching repository uuid:%s with path:%s' % (uuid,
                           info['repopath']))
+            self._index_repository(server, uuid, {
+                'path': info['repopath'],
+            })
             return ClearCaseRepositoryInfo(info['repopath'],
                     info['repopath'], uuid)
 
@@ -509,14 +523,3 @@ class ClearCaseRepositoryInfo(RepositoryInfo):
             if line.startswith('Vob family uuid:'):
                 return  line.split(' ')[-1].rstrip()
 
-    def _get_repository_info(self, server, repository):
-        try:
-            return server.get_repository_info(repository['id'])
-        except APIError, e:
-            # If the server couldn't fetch the repository info, it will return
-            # code 210. Ignore those.
-            # Other more serious errors should still be raised, though.
-            if e.error_code == 210:
-                return None
-
-            raise e
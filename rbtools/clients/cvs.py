@@ -3,6 +3,7 @@ import os
 import socket
 
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.clients.markers import CVS_MARKERS
 from rbtools.utils.checks import check_install
 from rbtools.utils.process import execute
 
@@ -12,6 +13,8 @@ class CVSClient(SCMClient):
     A wrapper around the cvs tool that fetches repository
     information and generates compatible diffs.
     """
+    markers = CVS_MARKERS
+
     def __init__(self, **kwargs):
         super(CVSClient, self).__init__(**kwargs)
 
@@ -3,8 +3,9 @@ import re
 import sys
 
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.clients.markers import GIT_MARKERS
 from rbtools.clients.svn import SVNClient, SVNRepositoryInfo
-from rbtools.utils.checks import check_install
+from rbtools.utils.checks import check_install, get_tool_output
 from rbtools.utils.process import die, execute
 
 
@@ -14,11 +15,29 @@ class GitClient(SCMClient):
     compatible diffs. This will attempt to generate a diff suitable for the
     remote repository, whether git, SVN or Perforce.
     """
+    # .git is a file in submodules and linked work trees.
+    markers = GIT_MARKERS
+
+    cache_attributes = ['git', 'git_dir', 'bare', 'top_level', 'head_ref',
+                        'type', 'upstream_branch']
+
     def __init__(self, **kwargs):
         super(GitClient, self).__init__(**kwargs)
         # Store the 'correct' way to invoke git, just plain old 'git' by
         # default.
         self.git = 'git'
+        self.git_dir = None
+        self.top_level = None
+
+    def activate(self):
+        if self.top_level:
+            os.chdir(self.top_level)
+
+    def get_cache_files(self, root):
+        # HEAD changes when switching branches, and the config holds the
+        # remotes and tracking branches.
+        return [os.path.join(self.git_dir, filename)
+                for filename in ('HEAD', 'config', 'svn')]
 
     def _strip_heads_prefix(self, ref):
         """ Strips prefix from ref name, if possible """
@@ -26,8 +45,9 @@ class GitClient(SCMClient):
 
     def get_repository_info(self):
         if not check_install('git --help'):
-            # CreateProcess (launched via subprocess, used by check_install)
-            # does not automatically append .cmd for things it finds in PATH.
+            # CreateProcess (launched via subprocess, and mimicked by
+            # check_install) does not automatically append .cmd for things
+            # it finds in PATH.
             # If we're on Windows, and this works, save it for further use.
             if (sys.platform.startswith('win') and
                 check_install('git.cmd --help')):
@@ -40,12 +60,17 @@ class GitClient(SCMClient):
 
         if git_dir.startswith("fatal:") or not os.path.isdir(git_dir):
             return None
+        self.git_dir = os.path.abspath(git_dir)
         self.bare = execute([self.git, "config",
                              "core.bare"]).strip() == 'true'
 
         # post-review in directories other than the top level of
-        # of a work-tree would result in broken diffs on the server
-        if not self.bare:
+        # of a work-tree would result in broken diffs on the server, so
+        # activate() moves there. Until then, commands that depend on the
+        # directory are run there explicitly.
+        if self.bare:
+            self.top_level = None
+        else:
             git_top = execute([self.git, "rev-parse", "--show-toplevel"],
                               ignore_errors=True).rstrip("\n")
 
@@ -54,7 +79,7 @@ class GitClient(SCMClient):
             if git_top.startswith("fatal:") or not os.path.isdir(git_dir):
                 git_top = git_dir
 
-            os.chdir(os.path.abspath(git_top))
+            self.top_level = os.path.abspath(git_top)
 
         self.head_ref = execute([self.git, 'symbolic-ref', '-q',
                                  'HEAD'], ignore_errors=True).strip()
@@ -68,7 +93,8 @@ class GitClient(SCMClient):
 
         if (not self.options.repository_url and
             os.path.isdir(git_svn_dir) and len(os.listdir(git_svn_dir)) > 0):
-            data = execute([self.git, "svn", "info"], ignore_errors=True)
+            data = execute([self.git, "svn", "info"], ignore_errors=True,
+                           cwd=self.top_level)
 
             m = re.search(r'^Repository Root: (.+)$', data, re.M)
 
@@ -89,7 +115,8 @@ class GitClient(SCMClient):
                             self.upstream_branch = self.options.parent_branch
                         else:
                             data = execute([self.git, "svn", "rebase", "-n"],
-                                           ignore_errors=True)
+                                           ignore_errors=True,
+                                           cwd=self.top_level)
                             m = re.search(r'^Remote Branch:\s*(.+)$', data,
                                           re.M)
 
@@ -110,8 +137,7 @@ class GitClient(SCMClient):
                 # 'git svn info'.  If we fail because of an older git install,
                 # here, figure out what version of git is installed and give
                 # the user a hint about what to do next.
-                version = execute([self.git, "svn", "--version"],
-                                  ignore_errors=True)
+                version = self._get_git_svn_version()
                 version_parts = re.search('version (\d+)\.(\d+)\.(\d+)',
                                           version)
                 svn_remote = execute([self.git, "config", "--get",
@@ -189,6 +215,21 @@ class GitClient(SCMClient):
                               ignore_errors=True).rstrip("\n")
         return (upstream_branch, origin_url)
 
+    def _get_git_svn_version(self):
+        """Returns the output of "git svn --version", or '' if it fails."""
+        # "git svn" runs git-svn from git's exec path, so that's what the
+        # output depends on, rather than git itself.
+        exec_path = (os.environ.get('GIT_EXEC_PATH') or
+                     (get_tool_output(self.git, ['--exec-path']) or '').strip())
+
+        if exec_path:
+            program = os.path.join(exec_path, 'git-svn')
+        else:
+            program = None
+
+        return get_tool_output(self.git, ['svn', '--version'],
+                               program=program) or ''
+
     def is_valid_version(self, actual, expected):
         """
         Takes two tuples, both in the form:
@@ -0,0 +1,91 @@
+import os
+import sys
+
+
+class ClientMarkers(object):
+    """The checkout markers of an SCM client.
+
+    marker_files are files or directories that mark a checkout managed by
+    the client, found in the checkout's top directory (or any of its
+    directories). Checking for them doesn't spawn processes or use the
+    network, and doesn't import the client's module, so it can be done for
+    every client before loading any of them.
+    """
+    def __init__(self, module_name, class_name, marker_files=[]):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.marker_files = marker_files
+
+    def has_marker(self, path):
+        """Returns whether a directory holds one of the marker files."""
+        for filename in self.marker_files:
+            if os.path.exists(os.path.join(path, filename)):
+                return True
+
+        return False
+
+    def load_client(self, options):
+        """Imports the client's module and returns a new client."""
+        __import__(self.module_name)
+        cls = getattr(sys.modules[self.module_name], self.class_name)
+
+        return cls(options=options)
+
+
+class ClearCaseMarkers(ClientMarkers):
+    def has_marker(self, path):
+        # Dynamic views live on the MVFS, which is mounted under /view, or
+        # as the M: drive on Windows. Shells started with "cleartool setview"
+        # see the view's VOBs under /vobs instead.
+        if sys.platform.startswith('win'):
+            if os.path.splitdrive(path)[0].upper() == 'M:':
+                return True
+        elif (os.path.dirname(path) == '/view' or
+              (path == '/vobs' and 'CLEARCASE_ROOT' in os.environ)):
+            return True
+
+        return super(ClearCaseMarkers, self).has_marker(path)
+
+
+class GitMarkers(ClientMarkers):
+    def has_marker(self, path):
+        # GIT_DIR points git at a repository wherever it's run from.
+        return ('GIT_DIR' in os.environ or
+                super(GitMarkers, self).has_marker(path))
+
+
+class PerforceMarkers(ClientMarkers):
+    def has_marker(self, path):
+        # Workspaces are often set up with a P4CONFIG file in their top
+        # directory. Those configured in other ways (such as with "p4 set")
+        # are left to the full scan.
+        p4config = os.environ.get('P4CONFIG')
+
+        return (bool(p4config) and
+                os.path.exists(os.path.join(path, p4config)))
+
+
+CVS_MARKERS = ClientMarkers('rbtools.clients.cvs', 'CVSClient',
+                            [os.path.join('CVS', 'Root')])
+CLEARCASE_MARKERS = ClearCaseMarkers('rbtools.clients.clearcase',
+                                     'ClearCaseClient',
+                                     ['view.dat', '.view.dat'])
+GIT_MARKERS = GitMarkers('rbtools.clients.git', 'GitClient', ['.git'])
+MERCURIAL_MARKERS = ClientMarkers('rbtools.clients.mercurial',
+                                  'MercurialClient', ['.hg'])
+PERFORCE_MARKERS = PerforceMarkers('rbtools.clients.perforce',
+                                   'PerforceClient')
+PLASTIC_MARKERS = ClientMarkers('rbtools.clients.plastic', 'PlasticClient',
+                                ['.plastic'])
+SVN_MARKERS = ClientMarkers('rbtools.clients.svn', 'SVNClient', ['.svn'])
+
+# Every client, in the order they're tried.
+SCMCLIENT_MARKERS = [
+    CVS_MARKERS,
+    CLEARCASE_MARKERS,
+    GIT_MARKERS,
+    MERCURIAL_MARKERS,
+    PERFORCE_MARKERS,
+    PLASTIC_MARKERS,
+    SVN_MARKERS,
+]
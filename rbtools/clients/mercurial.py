@@ -3,6 +3,7 @@ import os
 import re
 
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.clients.markers import MERCURIAL_MARKERS
 from rbtools.clients.svn import SVNClient
 from rbtools.utils.checks import check_install
 from rbtools.utils.process import execute
@@ -14,6 +15,10 @@ class MercurialClient(SCMClient):
     information and generates compatible diffs.
     """
 
+    markers = MERCURIAL_MARKERS
+
+    cache_attributes = ['hgrc', '_type', '_hg_root', '_remote_path']
+
     def __init__(self, **kwargs):
         super(MercurialClient, self).__init__(**kwargs)
 
@@ -33,6 +38,16 @@ class MercurialClient(SCMClient):
         self._remote_path_candidates = ['reviewboard', 'origin', 'parent',
                                         'default']
 
+    def get_cache_files(self, root):
+        # The remote paths come from the repository's and the user's hgrc.
+        return [os.path.join(root, '.hg', 'hgrc'),
+                os.path.expanduser(os.path.join('~', '.hgrc')),
+                os.path.expanduser(os.path.join('~', 'mercurial.ini'))]
+
+    def set_cache_state(self, state):
+        super(MercurialClient, self).set_cache_state(state)
+        self._remote_path = tuple(self._remote_path)
+
     def get_repository_info(self):
         if not check_install('hg --help'):
             return None
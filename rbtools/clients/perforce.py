@@ -8,6 +8,7 @@ import subprocess
 import sys
 
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.clients.markers import PERFORCE_MARKERS
 from rbtools.utils.checks import check_gnu_diff, check_install
 from rbtools.utils.filesystem import make_tempfile
 from rbtools.utils.process import die, execute
@@ -21,9 +22,28 @@ class PerforceClient(SCMClient):
     DATE_RE = re.compile(r'(\w+)\s+(\w+)\s+(\d+)\s+(\d\d:\d\d:\d\d)\s+'
                           '(\d\d\d\d)')
 
+    markers = PERFORCE_MARKERS
+
+    cache_attributes = ['p4d_version']
+
     def __init__(self, **kwargs):
         super(PerforceClient, self).__init__(**kwargs)
 
+    def get_cache_files(self, root):
+        # Without a P4CONFIG file, the settings may come from "p4 set",
+        # which stores them in the P4ENVIRO file.
+        files = [os.environ.get('P4ENVIRO',
+                                os.path.expanduser('~/.p4enviro'))]
+
+        if os.environ.get('P4CONFIG'):
+            files.append(os.path.join(root, os.environ['P4CONFIG']))
+
+        return files
+
+    def set_cache_state(self, state):
+        super(PerforceClient, self).set_cache_state(state)
+        self.p4d_version = tuple(self.p4d_version)
+
     def get_repository_info(self):
         if not check_install('p4 help'):
             return None
@@ -57,10 +77,13 @@ class PerforceClient(SCMClient):
 
         # Now that we know it's Perforce, make sure we have GNU diff
         # installed, and error out if we don't.
-        check_gnu_diff()
+        self.check_tools()
 
         return RepositoryInfo(path=repository_path, supports_changesets=True)
 
+    def check_tools(self):
+        check_gnu_diff()
+
     def scan_for_server(self, repository_info):
         # Scan first for dot files, since it's faster and will cover the
         # user's $HOME/.reviewboardrc
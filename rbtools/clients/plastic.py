@@ -3,6 +3,7 @@ import os
 import re
 
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.clients.markers import PLASTIC_MARKERS
 from rbtools.utils.checks import check_install
 from rbtools.utils.filesystem import make_tempfile
 from rbtools.utils.process import die, execute
@@ -13,6 +14,10 @@ class PlasticClient(SCMClient):
     A wrapper around the cm Plastic tool that fetches repository
     information and generates compatible diffs
     """
+    markers = PLASTIC_MARKERS
+
+    cache_attributes = ['workspacedir']
+
     def __init__(self, **kwargs):
         super(PlasticClient, self).__init__(**kwargs)
 
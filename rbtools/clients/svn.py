@@ -3,8 +3,8 @@ import re
 import sys
 import urllib
 
-from rbtools.api.errors import APIError
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.clients.markers import SVN_MARKERS
 from rbtools.utils.checks import check_gnu_diff, check_install
 from rbtools.utils.filesystem import walk_parents
 from rbtools.utils.process import execute
@@ -20,9 +20,17 @@ class SVNClient(SCMClient):
     information and generates compatible diffs.
     """
 
+    markers = SVN_MARKERS
+
     def __init__(self, **kwargs):
         super(SVNClient, self).__init__(**kwargs)
 
+    def get_cache_files(self, root):
+        # Switching or relocating the working copy updates its metadata:
+        # wc.db in Subversion 1.7 and later, entries before that.
+        return [os.path.join(root, '.svn', filename)
+                for filename in ('wc.db', 'entries')]
+
     def get_repository_info(self):
         if not check_install('svn help'):
             return None
@@ -55,10 +63,13 @@ class SVNClient(SCMClient):
 
         # Now that we know it's SVN, make sure we have GNU diff installed,
         # and error out if we don't.
-        check_gnu_diff()
+        self.check_tools()
 
         return SVNRepositoryInfo(path, base_path, m.group(1))
 
+    def check_tools(self):
+        check_gnu_diff()
+
     def check_options(self):
         if (self.options.repository_url and
             not self.options.revision_range and
@@ -312,39 +323,37 @@ class SVNRepositoryInfo(RepositoryInfo):
         repository.) It does this by comparing repository UUIDs. If the
         repositories use the same path, you'll get back self, otherwise you'll
         get a different SVNRepositoryInfo object (with a different path).
+
+        Matches are recorded in the server's repository index, so later runs
+        don't have to search the server's repositories again.
         """
-        repositories = server.get_repositories()
+        entry = self._get_indexed_repository(server, self.uuid)
 
-        for repository in repositories:
-            if repository['tool'] != 'Subversion':
-                continue
+        if entry:
+            relpath = self._get_relative_path(self.base_path,
+                                              entry['repos_base_path'])
 
-            info = self._get_repository_info(server, repository)
+            if relpath:
+                return SVNRepositoryInfo(entry['path'], relpath, self.uuid)
 
-            if not info or self.uuid != info['uuid']:
+        for repository, info in self._iter_server_repository_info(
+                server, 'Subversion'):
+            if self.uuid != info['uuid']:
                 continue
 
             repos_base_path = info['url'][len(info['root_url']):]
             relpath = self._get_relative_path(self.base_path, repos_base_path)
             if relpath:
+                self._index_repository(server, self.uuid, {
+                    'path': info['url'],
+                    'repos_base_path': repos_base_path,
+                })
                 return SVNRepositoryInfo(info['url'], relpath, self.uuid)
 
         # We didn't find a matching repository on the server. We'll just return
         # self and hope for the best.
         return self
 
-    def _get_repository_info(self, server, repository):
-        try:
-            return server.get_repository_info(repository['id'])
-        except APIError, e:
-            # If the server couldn't fetch the repository info, it will return
-            # code 210. Ignore those.
-            # Other more serious errors should still be raised, though.
-            if e.error_code == 210:
-                return None
-
-            raise e
-
     def _get_relative_path(self, path, root):
         pathdirs = self._split_on_slash(path)
         rootdirs = self._split_on_slash(root)
@@ -1,3 +1,4 @@
+import logging
 import os
 import re
 import sys
@@ -5,9 +6,14 @@ import time
 from nose import SkipTest
 from nose.tools import raises
 from random import randint
+from StringIO import StringIO
 from textwrap import dedent
 
-from rbtools.clients import RepositoryInfo
+from rbtools import clients
+from rbtools.clients import RepositoryInfo, SCMClient, find_checkout_root, \
+                            probe_clients, scan_usable_client
+from rbtools.clients.cache import DetectionCache
+from rbtools.clients.markers import ClientMarkers
 from rbtools.clients.git import GitClient
 from rbtools.clients.mercurial import MercurialClient
 from rbtools.clients.perforce import PerforceClient
@@ -711,6 +717,249 @@ class PerforceClientTests(SCMClientTests):
         client.check_options()
 
 
+class MarkerClient(SCMClient):
+    cache_attributes = ['branch']
+
+    def __init__(self, marker, found, **kwargs):
+        super(MarkerClient, self).__init__(**kwargs)
+        self.markers = ClientMarkers(__name__, 'MarkerClient', [marker])
+        self.found = found
+        self.probed = False
+        self.tools_checked = False
+        self.branch = None
+
+    def get_repository_info(self):
+        self.probed = True
+
+        if self.found:
+            self.branch = 'trunk'
+            self.check_tools()
+            return SVNRepositoryInfo('/repo', '/trunk', 'uuid')
+
+        return None
+
+    def check_tools(self):
+        self.tools_checked = True
+
+
+class OtherMarkerClient(MarkerClient):
+    pass
+
+
+class MarkerTests(SCMClientTests):
+    def setUp(self):
+        super(MarkerTests, self).setUp()
+        self.options.change_only = False
+        self.options.parent_branch = None
+        self.options.p4_client = None
+        self.options.p4_port = None
+        self.saved_clients = clients.SCMCLIENTS
+
+        self.top_dir = self.chdir_tmp()
+        os.mkdir('.first')
+        os.makedirs(os.path.join('sub', 'dir'))
+        os.mkdir(os.path.join('sub', '.second'))
+
+    def tearDown(self):
+        clients.SCMCLIENTS = self.saved_clients
+
+    def test_find_checkout_root(self):
+        """Testing find_checkout_root finding the nearest markers"""
+        first = MarkerClient('.first', True)
+        second = MarkerClient('.second', True)
+        other = MarkerClient('.other', True)
+        client_list = [first, second, other]
+        sub_dir = os.path.join(self.top_dir, 'sub')
+
+        self.assertEqual(find_checkout_root(self.top_dir, client_list),
+                         (self.top_dir, [first]))
+        self.assertEqual(
+            find_checkout_root(os.path.join(sub_dir, 'dir'), client_list),
+            (sub_dir, [second]))
+        self.assertEqual(find_checkout_root(self.top_dir, [other]),
+                         (None, []))
+
+    def test_scan_usable_client_markers(self):
+        """Testing scan_usable_client only probing the marked client"""
+        other = MarkerClient('.other', True)
+        first = MarkerClient('.first', True)
+        clients.SCMCLIENTS = [other, first]
+
+        self.assertEqual(scan_usable_client(self.options)[1], first)
+        self.assertFalse(other.probed)
+
+    def test_scan_usable_client_fallback(self):
+        """Testing scan_usable_client falling back to probing every client"""
+        first = MarkerClient('.first', False)
+        other = MarkerClient('.other', True)
+        clients.SCMCLIENTS = [first, other]
+
+        self.assertEqual(scan_usable_client(self.options)[1], other)
+        self.assertTrue(first.probed)
+
+    def test_scan_usable_client_detection_cache(self):
+        """Testing scan_usable_client using the detection cache"""
+        cache_dir = os.path.join(self.top_dir, 'cache')
+        clients.SCMCLIENTS = [MarkerClient('.first', True)]
+        scan_usable_client(self.options, DetectionCache(cache_dir))
+
+        first = MarkerClient('.first', True)
+        clients.SCMCLIENTS = [first]
+        repository_info, tool = scan_usable_client(self.options,
+                                                   DetectionCache(cache_dir))
+
+        self.assertEqual(tool, first)
+        self.assertFalse(first.probed)
+        self.assertTrue(first.tools_checked)
+        self.assertEqual(first.branch, 'trunk')
+        self.assertTrue(isinstance(repository_info, SVNRepositoryInfo))
+        self.assertEqual(repository_info.path, '/repo')
+        self.assertEqual(repository_info.base_path, '/trunk')
+        self.assertEqual(repository_info.uuid, 'uuid')
+
+        self.options.redetect_repository = True
+        scan_usable_client(self.options, DetectionCache(cache_dir))
+        self.assertTrue(first.probed)
+
+    def test_scan_usable_client_detection_cache_fallback(self):
+        """Testing scan_usable_client caching clients found without markers"""
+        cache_dir = os.path.join(self.top_dir, 'cache')
+        clients.SCMCLIENTS = [MarkerClient('.first', False),
+                              OtherMarkerClient('.other', True)]
+        scan_usable_client(self.options, DetectionCache(cache_dir))
+
+        first = MarkerClient('.first', False)
+        other = OtherMarkerClient('.other', True)
+        clients.SCMCLIENTS = [first, other]
+        repository_info, tool = scan_usable_client(self.options,
+                                                   DetectionCache(cache_dir))
+
+        self.assertEqual(tool, other)
+        self.assertTrue(first.probed)
+        self.assertFalse(other.probed)
+        self.assertTrue(other.tools_checked)
+        self.assertEqual(repository_info.path, '/repo')
+
+        # The entry is for this directory, not the checkout it's in.
+        os.chdir(os.path.join('sub', 'dir'))
+        other = OtherMarkerClient('.other', True)
+        clients.SCMCLIENTS = [other]
+        scan_usable_client(self.options, DetectionCache(cache_dir))
+        self.assertTrue(other.probed)
+
+    def test_detection_cache_invalidation(self):
+        """Testing the detection cache being invalidated by changed files"""
+        cache = DetectionCache(os.path.join(self.top_dir, 'cache'))
+        first = MarkerClient('.first', True)
+        subdir = os.path.join(self.top_dir, 'sub')
+        cache.store(self.top_dir, subdir, first, first.get_repository_info(),
+                    self.options)
+
+        self.assertEqual(cache.load(self.top_dir, subdir, [first],
+                                    self.options)[0], first)
+        self.assertEqual(cache.load(self.top_dir, self.top_dir, [first],
+                                    self.options), (None, None))
+
+        self.options.tracking = 'origin/other'
+        self.assertEqual(cache.load(self.top_dir, subdir, [first],
+                                    self.options), (None, None))
+
+        self.options.tracking = None
+        os.utime('.first', (0, 0))
+        self.assertEqual(cache.load(self.top_dir, subdir, [first],
+                                    self.options), (None, None))
+
+
+class ProbeClient(SCMClient):
+    def __init__(self, path=None, delay=0, output='', log=None, **kwargs):
+        super(ProbeClient, self).__init__(**kwargs)
+        self.path = path
+        self.delay = delay
+        self.output = output
+        self.log = log
+
+    def get_repository_info(self):
+        if self.output:
+            sys.stdout.write(self.output)
+
+        if self.log:
+            logging.warning(self.log)
+
+        if self.delay:
+            execute([sys.executable, '-c',
+                     'import time; time.sleep(%s)' % self.delay])
+
+        if self.path:
+            return RepositoryInfo(path=self.path)
+
+        return None
+
+
+class ProbeClientsTests(SCMClientTests):
+    def setUp(self):
+        super(ProbeClientsTests, self).setUp()
+        self.saved_stdout = sys.stdout
+        self.saved_stderr = sys.stderr
+        sys.stdout = StringIO()
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.saved_stdout
+        sys.stderr = self.saved_stderr
+
+    def test_probe_clients_order(self):
+        """Testing probe_clients picking the winner in order"""
+        first = ProbeClient(path='/first', delay=0.5)
+        second = ProbeClient(path='/second')
+
+        tool, info = probe_clients([ProbeClient(output='failed\n'), first,
+                                    second, ProbeClient(output='unused\n')])
+        self.assertEqual(tool, first)
+        self.assertEqual(info.path, '/first')
+        self.assertEqual(sys.stdout.getvalue(), 'failed\n')
+
+    def test_probe_clients_log_order(self):
+        """Testing probe_clients holding back what losing probes log"""
+        # Like the handler logging.basicConfig sets up, this holds on to
+        # the stream it was given.
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.setLevel(logging.WARNING)
+        logging.getLogger().addHandler(handler)
+
+        try:
+            tool, info = probe_clients([
+                ProbeClient(log='failed'),
+                ProbeClient(path='/first', delay=0.5),
+                ProbeClient(log='unused'),
+            ])
+        finally:
+            logging.getLogger().removeHandler(handler)
+
+        self.assertEqual(info.path, '/first')
+        self.assertEqual(sys.stderr.getvalue(), 'failed\n')
+        self.assertEqual(handler.stream, sys.stderr)
+
+    def test_probe_clients_kills_losers(self):
+        """Testing probe_clients killing the commands of losing probes"""
+        start = time.time()
+        tool, info = probe_clients([ProbeClient(path='/first'),
+                                    ProbeClient(path='/second', delay=30)])
+        self.assertEqual(info.path, '/first')
+        self.assertTrue(time.time() - start < 10)
+
+    def test_probe_clients_timeout(self):
+        """Testing probe_clients giving up on slow probes"""
+        start = time.time()
+        tool, info = probe_clients([ProbeClient(path='/first', delay=30),
+                                    ProbeClient(path='/second')],
+                                   timeout=0.5)
+        self.assertEqual(info.path, '/second')
+        self.assertTrue(time.time() - start < 10)
+        self.assertTrue('Gave up on probing for ProbeClient' in
+                        sys.stderr.getvalue())
+
+
 FOO = """\
 ARMA virumque cano, Troiae qui primus ab oris
 Italiam, fato profugus, Laviniaque venit
@@ -1,25 +1,31 @@
 #!/usr/bin/env python
 import base64
-import cookielib
-import getpass
 import logging
-import mimetools
 import os
 import re
 import sys
+import threading
 import urllib2
 from optparse import OptionParser
-from pkg_resources import parse_version
+from urllib import urlencode
 from urlparse import urljoin, urlparse
 
 from rbtools import get_package_version, get_version_string
 from rbtools.api.errors import APIError
 from rbtools.clients import scan_usable_client
-from rbtools.clients.perforce import PerforceClient
-from rbtools.clients.plastic import PlasticClient
-from rbtools.utils.filesystem import get_config_value, load_config_files, \
+from rbtools.clients.cache import DetectionCache
+from rbtools.utils.checks import ToolCache, set_tool_cache
+from rbtools.utils.filesystem import get_cache_dir, get_config_value, \
+                                     get_home_path, load_config_files, \
                                      TEMP_DIR, diff_stats
 from rbtools.utils.process import die
+from rbtools.utils.version import parse_version
+
+try:
+    from hashlib import sha1
+except ImportError:
+    # Python 2.4
+    from sha import new as sha1
 
 try:
     # Specifically import json_loads, to work around some issues with
@@ -35,6 +41,9 @@ configs = []
 ADD_REPOSITORY_DOCS_URL = \
     'http://www.reviewboard.org/docs/manual/dev/admin/configuration/repositories/'
 
+# Uploads at least this large report their progress.
+PROGRESS_MIN_SIZE = 1024 * 1024
+
 
 class HTTPRequest(urllib2.Request):
     def __init__(self, url, body='', headers={}, method="PUT"):
@@ -46,16 +55,19 @@ class HTTPRequest(urllib2.Request):
 
 
 class PresetHTTPAuthHandler(urllib2.BaseHandler):
-    """urllib2 handler that conditionally presets the use of HTTP Basic Auth.
+    """urllib2 handler that presets the use of HTTP Basic Auth.
 
-    This is used when specifying --username= on the command line. It will
-    force an HTTP_AUTHORIZATION header with the user info, asking the user
-    for any missing info beforehand. It will then try this header for that
-    first request.
+    When specifying --username= on the command line, this will force an
+    HTTP_AUTHORIZATION header with the user info on the first request,
+    asking the user for any missing info beforehand.
 
-    It will only do this once.
+    After that, whenever the credentials are known (from the command line
+    or from answering an earlier 401), the header is sent with any request
+    to the server that doesn't already carry a session cookie. This saves
+    the round trip of a request that would only get a 401, along with the
+    upload of its body.
     """
-    handler_order = 480 # After Basic auth
+    handler_order = 510 # After the cookie processor
 
     def __init__(self, url, password_mgr):
         self.url = url
@@ -68,15 +80,29 @@ class PresetHTTPAuthHandler(urllib2.BaseHandler):
         self.used = False
 
     def http_request(self, request):
-        if options.username and not self.used:
+        auth_header = urllib2.HTTPBasicAuthHandler.auth_header
+
+        if (not request.get_full_url().startswith(self.url) or
+            request.get_header(auth_header) or
+            'rbsessionid=' in request.get_header('Cookie', '')):
+            return request
+
+        if ((options.username and not self.used) or
+            (self.password_mgr.rb_user is not None and
+             self.password_mgr.rb_pass is not None)):
             # Note that we call password_mgr.find_user_password to get the
             # username and password we're working with. This allows us to
             # prompt if, say, --username was specified but --password was not.
             username, password = \
                 self.password_mgr.find_user_password('Web API', self.url)
+
+            if username is None or password is None:
+                # Prompting isn't allowed on this thread.
+                return request
+
             raw = '%s:%s' % (username, password)
-            request.add_header(
-                urllib2.HTTPBasicAuthHandler.auth_header,
+            request.add_unredirected_header(
+                auth_header,
                 'Basic %s' % base64.b64encode(raw).strip())
             self.used = True
 
@@ -110,26 +136,30 @@ class ReviewBoardHTTPBasicAuthHandler(urllib2.HTTPBasicAuthHandler):
     This subclass only retries once to make sure we've attempted with a
     valid username and password. It will then fail so we can use
     tempt_fate's retry handler.
+
+    Requests are made from several threads at once, so each thread keeps
+    track of its own retries.
     """
     def __init__(self, *args, **kwargs):
         urllib2.HTTPBasicAuthHandler.__init__(self, *args, **kwargs)
-        self._retried = False
-        self._lasturl = ""
+        self._local = threading.local()
 
     def retry_http_basic_auth(self, *args, **kwargs):
-        if self._lasturl != args[0]:
-            self._retried = False
+        local = self._local
+
+        if getattr(local, 'lasturl', "") != args[0]:
+            local.retried = False
 
-        self._lasturl = args[0]
+        local.lasturl = args[0]
 
-        if not self._retried:
-            self._retried = True
+        if not local.retried:
+            local.retried = True
             self.retried = 0
             response = urllib2.HTTPBasicAuthHandler.retry_http_basic_auth(
                 self, *args, **kwargs)
 
             if response.code != 401:
-                self._retried = False
+                local.retried = False
 
             return response
         else:
@@ -152,45 +182,99 @@ class ReviewBoardHTTPPasswordMgr(urllib2.HTTPPasswordMgr):
         self.rb_url  = reviewboard_url
         self.rb_user = rb_user
         self.rb_pass = rb_pass
+        self._prompt_lock = threading.Lock()
+        self._local = threading.local()
 
-    def find_user_password(self, realm, uri):
-        if realm == 'Web API':
-            if self.rb_user is None or self.rb_pass is None:
-                if options.diff_filename == '-':
-                    die('HTTP authentication is required, but cannot be '
-                        'used with --diff-filename=-')
-
-                print "==> HTTP Authentication Required"
-                print 'Enter authorization information for "%s" at %s' % \
-                    (realm, urlparse(uri)[1])
+    def disable_prompts(self):
+        """
+        Prevents prompting for credentials from the calling thread.
 
-                if not self.rb_user:
-                    self.rb_user = raw_input('Username: ')
+        Missing credentials are returned as None instead.
+        """
+        self._local.prompts_disabled = True
 
-                if not self.rb_pass:
-                    self.rb_pass = getpass.getpass('Password: ')
+    def find_user_password(self, realm, uri):
+        if realm == 'Web API':
+            # Requests made from several threads must only prompt once.
+            self._prompt_lock.acquire()
 
-            return self.rb_user, self.rb_pass
+            try:
+                return self._find_web_api_user_password(realm, uri)
+            finally:
+                self._prompt_lock.release()
         else:
             # If this is an auth request for some other domain (since HTTP
             # handlers are global), fall back to standard password management.
             return urllib2.HTTPPasswordMgr.find_user_password(self, realm, uri)
 
+    def _find_web_api_user_password(self, realm, uri):
+        if self.rb_user is None or self.rb_pass is None:
+            if getattr(self._local, 'prompts_disabled', False):
+                return None, None
+
+            if options.diff_filename == '-':
+                die('HTTP authentication is required, but cannot be '
+                    'used with --diff-filename=-')
+
+            print "==> HTTP Authentication Required"
+            print 'Enter authorization information for "%s" at %s' % \
+                (realm, urlparse(uri)[1])
+
+            if not self.rb_user:
+                self.rb_user = raw_input('Username: ')
+
+            if not self.rb_pass:
+                import getpass
+                self.rb_pass = getpass.getpass('Password: ')
+
+        return self.rb_user, self.rb_pass
+
 
 class ReviewBoardServer(object):
     """
     An instance of a Review Board server.
+
+    If an APICache is provided, API GET responses are cached on disk and
+    revalidated with the server. Resources fetched through the resource
+    graph are remembered for the rest of the run. If a ServerIndex is
+    provided as upload_history, the diffs uploaded to each review request
+    are recorded in it. If a RepositoryIndex is provided, it's used
+    to remember which server repository matches the local one. If a
+    ServerIndex is provided as server_features, the upload compression
+    modes the server rejected are recorded in it, so they aren't tried
+    again.
     """
-    def __init__(self, url, info, cookie_file):
+    def __init__(self, url, info, cookie_file, cache=None,
+                 repository_index=None, upload_history=None,
+                 server_features=None):
+        from rbtools.api.connection import ConnectionPool, \
+                                           KeepAliveHTTPHandler, \
+                                           KeepAliveHTTPSHandler
+        from rbtools.api.cookies import SessionCookieJar
+        from rbtools.api.resource import ResourceGraph
+        from rbtools.api.retry import RetryPolicy
+        from rbtools.api.stats import HTTPStats
+
         self.url = url
         if self.url[-1] != '/':
             self.url += '/'
         self._info = info
         self._server_info = None
+        self._repository_lists = {}
         self.root_resource = None
         self.deprecated_api = False
+        self.api_checked = False
+        self.compress_uploads = options.compress_uploads
+        self.cache = cache
+        self.repository_index = repository_index
+        self.upload_history = upload_history
+        self.server_features = server_features
+        self.max_concurrent_requests = options.max_concurrent_requests
         self.cookie_file = cookie_file
-        self.cookie_jar  = cookielib.MozillaCookieJar(self.cookie_file)
+        self.cookie_jar  = SessionCookieJar(self.cookie_file)
+        self._prefetched = {}
+        self.resources = ResourceGraph(self)
+        self._prefetched_lock = threading.Lock()
 
         if self.cookie_file:
             try:
@@ -202,9 +286,32 @@ class ReviewBoardServer(object):
         password_mgr = ReviewBoardHTTPPasswordMgr(self.url,
                                                   options.username,
                                                   options.password)
+        self.password_mgr = password_mgr
         self.preset_auth_handler = PresetHTTPAuthHandler(self.url, password_mgr)
 
-        handlers = []
+        # All requests go through a pool of persistent connections, so that
+        # the many API calls made while posting don't each pay for a new
+        # TCP and SSL handshake.
+        self.connection_pool = ConnectionPool(
+            keepalive=not options.disable_keepalive)
+        self.http_stats = HTTPStats()
+        self.retry_policy = RetryPolicy(options.max_retries)
+
+        if options.disable_keepalive:
+            debug('Disabling HTTP(s) persistent connections')
+
+        handler_kwargs = {
+            'accept_gzip': not options.disable_response_compression,
+            'stats': self.http_stats,
+            'connect_timeout': options.connect_timeout or None,
+            'read_timeout': options.read_timeout or None,
+        }
+        handlers = [KeepAliveHTTPHandler(self.connection_pool,
+                                         **handler_kwargs)]
+
+        if KeepAliveHTTPSHandler:
+            handlers.append(KeepAliveHTTPSHandler(self.connection_pool,
+                                                  **handler_kwargs))
 
         if options.disable_proxy:
             debug('Disabling HTTP(s) proxy support')
@@ -222,19 +329,79 @@ class ReviewBoardServer(object):
         opener.addheaders = [('User-agent', 'RBTools/' + get_package_version())]
         urllib2.install_opener(opener)
 
-    def check_api_version(self):
-        """Checks the API version on the server to determine which to use."""
+    def get_connection_stats(self):
+        """
+        Returns a tuple of the number of HTTP requests made and the number
+        of connections that were opened to make them.
+        """
+        return (self.connection_pool.requests,
+                self.connection_pool.connections_opened)
+
+    def report_http_stats(self):
+        """
+        Prints a table of the HTTP requests made during the run and writes
+        them to a JSON file, if asked to by the options.
+        """
+        if options.http_stats:
+            sys.stderr.write(self.http_stats.format_table() + '\n')
+
+        if options.http_stats_file:
+            try:
+                self.http_stats.save(options.http_stats_file,
+                                     server=self.url,
+                                     rbtools_version=get_version_string())
+            except IOError, e:
+                sys.stderr.write('Unable to write HTTP stats to %s: %s\n'
+                                 % (options.http_stats_file, e))
+
+    def prefetch(self, review_request_id=None):
+        """
+        Checks the API version and fetches the review request to update
+        ahead of time.
+
+        This is meant to be run in the background while the diff is being
+        generated. The API version is only checked if check_api_version
+        hasn't already done it. If review_request_id is given, the review
+        request is fetched as well.
+
+        Responses are handed to the next http_get for the same URL. This
+        never prompts for credentials or fails the run. Returns whether the
+        API version was checked. If it wasn't (because the server asked for
+        credentials, or because of any other error), check_api_version has
+        to be called from the main thread, where it can prompt and report
+        errors at the same point as without prefetching.
+        """
+        self.password_mgr.disable_prompts()
+
         try:
-            root_resource = self.api_get('api/')
-            rsp = self.api_get(root_resource['links']['info']['href'])
+            if not self.api_checked:
+                self._check_api_version()
 
-            self.rb_version = rsp['info']['product']['package_version']
+            if review_request_id and not self.deprecated_api:
+                self._prefetch('%s%s/' % (
+                    self.root_resource['links']['review_requests']['href'],
+                    review_request_id))
+        except Exception, e:
+            debug('Stopped prefetching from the server: %s' % e)
+
+        return self.api_checked
+
+    def _prefetch(self, path):
+        rsp = self.http_get(path)
+
+        self._prefetched_lock.acquire()
+
+        try:
+            self._prefetched[self._make_url(path)] = rsp
+        finally:
+            self._prefetched_lock.release()
 
-            if parse_version(self.rb_version) >= parse_version('1.5.2'):
-                self.deprecated_api = False
-                self.root_resource = root_resource
-                debug('Using the new web API')
-                return True
+        return rsp
+
+    def check_api_version(self):
+        """Checks the API version on the server to determine which to use."""
+        try:
+            self._check_api_version()
         except APIError, e:
             if e.http_status not in (401, 404):
                 # We shouldn't reach this. If there's a permission denied
@@ -248,11 +415,33 @@ class ReviewBoardServer(object):
 
                 return False
 
-        # This is an older Review Board server with the old API.
-        self.deprecated_api = True
-        debug('Using the deprecated Review Board 1.0 web API')
+            # This is an older Review Board server with the old API.
+            self.deprecated_api = True
+            self.api_checked = True
+            debug('Using the deprecated Review Board 1.0 web API')
+
         return True
 
+    def _check_api_version(self):
+        """
+        Checks the API version, raising an APIError if the server couldn't
+        be asked.
+        """
+        root_resource = self.api_get('api/')
+        rsp = self.api_get(root_resource['links']['info']['href'])
+
+        self.rb_version = rsp['info']['product']['package_version']
+
+        if parse_version(self.rb_version) >= parse_version('1.5.2'):
+            self.deprecated_api = False
+            self.root_resource = root_resource
+            debug('Using the new web API')
+        else:
+            self.deprecated_api = True
+            debug('Using the deprecated Review Board 1.0 web API')
+
+        self.api_checked = True
+
     def login(self, force=False):
         """
         Logs in to a Review Board server, prompting the user for login
@@ -281,6 +470,7 @@ class ReviewBoardServer(object):
                 username = raw_input('Username: ')
 
             if not options.password:
+                import getpass
                 password = getpass.getpass('Password: ')
             else:
                 password = options.password
@@ -348,17 +538,15 @@ class ReviewBoardServer(object):
         # If repository_path is a list, find a name in the list that's
         # registered on the server.
         if isinstance(self.info.path, list):
-            repositories = self.get_repositories()
-
-            debug("Repositories on Server: %s" % repositories)
             debug("Server Aliases: %s" % self.info.path)
 
-            for repository in repositories:
-                if repository['path'] in self.info.path:
-                    self.info.path = repository['path']
-                    break
+            for repository in self.iter_repositories(path=self.info.path):
+                self.info.path = repository['path']
+                break
 
             if isinstance(self.info.path, list):
+                repositories = self.get_repositories()
+
                 sys.stderr.write('\n')
                 sys.stderr.write('There was an error creating this review '
                                  'request.\n')
@@ -419,6 +607,11 @@ class ReviewBoardServer(object):
                     self.update_review_request_from_changenum(
                         changenum, rsp['review_request'])
             elif e.error_code == 206: # Invalid repository
+                if self.repository_index:
+                    # Don't keep matching the local repository to a path
+                    # the server doesn't know about.
+                    self.repository_index.remove_path(self.url, repository)
+
                 sys.stderr.write('\n')
                 sys.stderr.write('There was an error creating this review '
                                  'request.\n')
@@ -438,6 +631,8 @@ class ReviewBoardServer(object):
         else:
             debug("Review request created")
 
+        self.resources.add(rsp['review_request'], 'review_request')
+
         return rsp['review_request']
 
     def update_review_request_from_changenum(self, changenum, review_request):
@@ -468,53 +663,156 @@ class ReviewBoardServer(object):
                 field: value,
             })
 
+    def update_draft(self, review_request, fields, publish=False):
+        """
+        Sets all the given fields on the draft of a review request, and
+        optionally publishes it.
+
+        With the new API, this is done in a single request. The deprecated
+        1.0 API requires a request per field, and another to publish.
+        """
+        if self.deprecated_api:
+            for field, value in fields.iteritems():
+                self.set_review_request_field(review_request, field, value)
+
+            if publish:
+                self.publish(review_request)
+        else:
+            data = dict(fields)
+
+            if publish:
+                debug("Publishing")
+                data['public'] = 1
+
+            debug("Updating draft for review request '%s': %s" %
+                  (review_request['id'], data))
+            self.api_put(review_request['links']['draft']['href'], data)
+
     def get_review_request(self, rid):
         """
         Returns the review request with the specified ID.
         """
         if self.deprecated_api:
-            url = 'api/json/reviewrequests/%s/' % rid
-        else:
-            url = '%s%s/' % (
-                self.root_resource['links']['review_requests']['href'], rid)
+            rsp = self.api_get('api/json/reviewrequests/%s/' % rid)
 
-        rsp = self.api_get(url)
+            return rsp['review_request']
 
-        return rsp['review_request']
+        return self.resources.get(
+            '%s%s/' % (self.root_resource['links']['review_requests']['href'],
+                       rid),
+            'review_request').fields
 
-    def get_repositories(self):
+    def get_repositories(self, tool=None, path=None):
         """
         Returns the list of repositories on this server.
+
+        See iter_repositories for the meaning of tool and path.
+        """
+        return list(self.iter_repositories(tool, path))
+
+    def iter_repositories(self, tool=None, path=None):
+        """
+        Iterates over the repositories on this server.
+
+        Pages of the repository list are only fetched as they're needed, so
+        callers that stop at the first match don't page through the whole
+        list.
+
+        tool and path can be a string or a list of strings. If given, only
+        repositories with a matching tool or path are returned, and servers
+        that support it are asked to do the filtering, so only candidates
+        are transferred.
+
+        Fetched pages are remembered for the lifetime of this object.
         """
+        tools = self._make_filter_list(tool)
+        paths = self._make_filter_list(path)
+        query = []
+
+        if tools:
+            query.append(('tool', ','.join(tools)))
+
+        if paths:
+            query.append(('path', ','.join(paths)))
+
+        for repository in self._iter_repository_list(query):
+            if ((not tools or repository['tool'] in tools) and
+                (not paths or repository['path'] in paths)):
+                yield repository
+
+    def _make_filter_list(self, value):
+        if value is None or isinstance(value, list):
+            return value
+
+        return [value]
+
+    def _iter_repository_list(self, query):
         if self.deprecated_api:
-            rsp = self.api_get('api/json/repositories/')
-            repositories = rsp['repositories']
+            # The 1.0 API returns all repositories at once and can't filter.
+            key = ''
         else:
-            rsp = self.api_get(
-                self.root_resource['links']['repositories']['href'])
-            repositories = rsp['repositories']
+            key = urlencode(query)
+
+        # If the full list was already fetched, any filtered list can be
+        # taken from it.
+        memo = self._repository_lists.get('')
+
+        if not memo or memo['next'] is not None:
+            memo = self._repository_lists.get(key)
+
+        if not memo:
+            if self.deprecated_api:
+                url = 'api/json/repositories/'
+            else:
+                url = self.root_resource['links']['repositories']['href']
+
+                if key:
+                    url += '?' + key
 
-            while 'next' in rsp['links']:
-                rsp = self.api_get(rsp['links']['next']['href'])
-                repositories.extend(rsp['repositories'])
+            memo = self._repository_lists[key] = {
+                'repositories': [],
+                'next': url,
+            }
+
+        repositories = memo['repositories']
+        i = 0
+
+        while True:
+            while i < len(repositories):
+                yield repositories[i]
+                i += 1
+
+            if memo['next'] is None:
+                break
+
+            rsp = self.api_get(memo['next'])
+            repositories.extend(rsp['repositories'])
 
-        return repositories
+            for repository in rsp['repositories']:
+                # The repository payloads come with their links, which
+                # saves fetching them again to follow those.
+                self.resources.add(repository, 'repository')
+
+            if 'next' in rsp.get('links', {}):
+                memo['next'] = rsp['links']['next']['href']
+            else:
+                memo['next'] = None
 
     def get_repository_info(self, rid):
         """
         Returns detailed information about a specific repository.
         """
         if self.deprecated_api:
-            url = 'api/json/repositories/%s/info/' % rid
-        else:
-            rsp = self.api_get(
-                '%s%s/' % (self.root_resource['links']['repositories']['href'],
-                           rid))
-            url = rsp['repository']['links']['info']['href']
+            rsp = self.api_get('api/json/repositories/%s/info/' % rid)
 
-        rsp = self.api_get(url)
+            return rsp['info']
 
-        return rsp['info']
+        repository = self.resources.get(
+            '%s%s/' % (self.root_resource['links']['repositories']['href'],
+                       rid),
+            'repository')
+
+        return repository.get_link('info', 'info').fields
 
     def save_draft(self, review_request):
         """
@@ -533,35 +831,167 @@ class ReviewBoardServer(object):
     def upload_diff(self, review_request, diff_content, parent_diff_content):
         """
         Uploads a diff to a Review Board server.
+
+        If upload compression is enabled, the diffs or the whole request are
+        sent gzip-compressed. Should the server reject the compressed upload
+        as something it can't decode (with HTTP 415, or API error 105 for an
+        unreadable diff), it's sent again uncompressed, and compression is
+        turned off for the rest of the run. The rejection is recorded in
+        server_features, so later runs upload uncompressed right away.
         """
         debug("Uploading diff, size: %d" % len(diff_content))
 
         if parent_diff_content:
             debug("Uploading parent diff, size: %d" % len(parent_diff_content))
 
+        compress = self.compress_uploads
+        feature_key = 'compress_uploads:%s' % compress
+
+        if (compress and self.server_features and
+            self.server_features.get(self.url, feature_key) is not None):
+            debug('The server is known not to accept %s compression. '
+                  'Uploading without compression.' % compress)
+            compress = None
+
+        try:
+            rsp = self._upload_diff(review_request, diff_content,
+                                    parent_diff_content, compress)
+        except APIError, e:
+            if not compress or not (e.http_status == 415 or
+                                    e.error_code == 105):
+                raise
+
+            debug('The server rejected the compressed diff upload (%s). '
+                  'Retrying without compression.' % e)
+
+            # Error 105 is also returned for diffs that can't be parsed, so
+            # compression is only known to be the problem once the diff is
+            # accepted without it.
+            try:
+                rsp = self._upload_diff(review_request, diff_content,
+                                        parent_diff_content, None)
+            except APIError:
+                raise e
+
+            self.compress_uploads = None
+
+            if self.server_features:
+                self.server_features.set(self.url, feature_key, {
+                    'supported': False,
+                })
+
+        revision = rsp.get('diff', {}).get('revision')
+
+        if self.upload_history and revision is not None:
+            self.upload_history.set(self.url, str(review_request['id']), {
+                'diff_hash': get_diff_hash(diff_content, parent_diff_content),
+                'revision': revision,
+            })
+
+    def is_diff_uploaded(self, review_request, diff_content,
+                         parent_diff_content):
+        """
+        Returns whether a diff is already the latest diff on a review request.
+
+        The diff is compared with the one recorded for the last upload to
+        the review request, and the server is checked to make sure that no
+        other diff has been uploaded since.
+
+        The server only lists published diffs. A diff uploaded to a draft
+        that hasn't been published yet gets the revision after the latest
+        listed one, so that revision is accepted while there's a draft.
+        """
+        if not self.upload_history or self.deprecated_api:
+            return False
+
+        entry = self.upload_history.get(self.url, str(review_request['id']))
+
+        if (not entry or
+            entry['diff_hash'] != get_diff_hash(diff_content,
+                                                parent_diff_content)):
+            return False
+
+        latest_revision = self.get_latest_diff_revision(review_request)
+
+        if entry['revision'] == latest_revision:
+            return True
+
+        return (entry['revision'] == (latest_revision or 0) + 1 and
+                self.has_draft(review_request))
+
+    def has_draft(self, review_request):
+        """Returns whether a review request has an unpublished draft."""
+        try:
+            self.api_get(review_request['links']['draft']['href'])
+        except APIError, e:
+            if e.http_status == 404:
+                return False
+
+            raise
+
+        return True
+
+    def get_latest_diff_revision(self, review_request):
+        """
+        Returns the revision of the latest diff on a review request, or None
+        if it has no diffs.
+        """
+        href = review_request['links']['diffs']['href']
+        rsp = self.api_get(href)
+        diffs = rsp['diffs']
+        total = rsp.get('total_results', len(diffs))
+
+        if total > len(diffs):
+            # Only the first page was returned. Get the last diff instead.
+            rsp = self.api_get('%s?start=%d' % (href, total - 1))
+            diffs = rsp['diffs']
+
+        if not diffs:
+            return None
+
+        return max([diff['revision'] for diff in diffs])
+
+    def _upload_diff(self, review_request, diff_content, parent_diff_content,
+                     compress):
         fields = {}
         files = {}
 
         if self.info.base_path:
             fields['basedir'] = self.info.base_path
 
-        files['path'] = {
-            'filename': 'diff',
-            'content': diff_content
-        }
+        files['path'] = self._make_diff_file('diff', diff_content, compress)
 
         if parent_diff_content:
-            files['parent_diff_path'] = {
-                'filename': 'parent_diff',
-                'content': parent_diff_content
-            }
+            files['parent_diff_path'] = \
+                self._make_diff_file('parent_diff', parent_diff_content,
+                                     compress)
 
         if self.deprecated_api:
-            self.api_post('api/json/reviewrequests/%s/diff/new/' %
-                          review_request['id'], fields, files)
+            path = 'api/json/reviewrequests/%s/diff/new/' % review_request['id']
         else:
-            self.api_post(review_request['links']['diffs']['href'],
-                          fields, files)
+            path = review_request['links']['diffs']['href']
+
+        return self.api_post(path, fields, files, compress=(compress == 'body'))
+
+    def _make_diff_file(self, filename, content, compress):
+        """Returns the file data for a diff in an upload."""
+        if compress != 'diffs':
+            return {
+                'filename': filename,
+                'content': content,
+            }
+
+        from rbtools.api.compression import get_file_size, gzip_to_tempfile
+
+        fp = gzip_to_tempfile(content)
+        debug('Compressed %s from %d to %d bytes' %
+              (filename, len(content), get_file_size(fp)))
+
+        return {
+            'filename': filename + '.gz',
+            'content': fp,
+            'content_type': 'application/x-gzip',
+        }
 
     def reopen(self, review_request):
         """
@@ -638,14 +1068,71 @@ class ReviewBoardServer(object):
         debug('HTTP GETting %s' % path)
 
         url = self._make_url(path)
-        rsp = urllib2.urlopen(url).read()
+        cached = None
+        headers = {}
+
+        self._prefetched_lock.acquire()
 
         try:
-            self.cookie_jar.save(self.cookie_file)
-        except IOError, e:
-            debug('Failed to write cookie file: %s' % e)
+            rsp = self._prefetched.pop(url, None)
+        finally:
+            self._prefetched_lock.release()
+
+        if rsp is not None:
+            debug('Using prefetched response for %s' % url)
+            return rsp
+
+        if self.cache:
+            cached = self.cache.get(url)
+
+            if cached:
+                if cached.is_fresh():
+                    debug('Using cached response for %s' % url)
+                    return cached.body
+
+                headers = cached.get_conditional_headers()
+
+        try:
+            r, rsp = self._open(urllib2.Request(url, headers=headers))
+        except urllib2.HTTPError, e:
+            if e.code != 304 or not cached:
+                raise
+
+            debug('Cached response for %s is still valid' % url)
+            self.cache.revalidated(cached, e.info())
+            rsp = cached.body
+        else:
+            if self.cache:
+                self.cache.set(url, r.info(), rsp)
+
         return rsp
 
+    def _open(self, request):
+        """
+        Sends a request, returning the response and its body.
+
+        Transient failures are retried as the retry policy allows.
+        """
+        def fetch():
+            r = urllib2.urlopen(request)
+
+            return r, r.read()
+
+        return self.retry_policy.call(request.get_method(), fetch)
+
+    def save_cookies(self):
+        """
+        Saves any new or changed cookies to the cookie file.
+
+        Cookies are kept in memory during the run, so this only needs to be
+        called once at the end.
+        """
+        try:
+            if self.cookie_jar.flush():
+                debug('Saved cookies to %s' % self.cookie_file)
+        except (IOError, OSError), e:
+            debug('Failed to write cookie file: %s' % e)
+
     def _make_url(self, path):
         """Given a path on the server returns a full http:// style url"""
         if path.startswith('http'):
@@ -672,10 +1159,12 @@ class ReviewBoardServer(object):
         except urllib2.HTTPError, e:
             self.process_error(e.code, e.read())
 
-    def http_post(self, path, fields, files=None):
+    def http_post(self, path, fields, files=None, compress=False):
         """
         Performs an HTTP POST on the specified path, storing any cookies that
         were set.
+
+        If compress is True, the request body is sent gzip-compressed.
         """
         if fields:
             debug_fields = fields.copy()
@@ -685,6 +1174,13 @@ class ReviewBoardServer(object):
         if 'password' in debug_fields:
             debug_fields["password"] = "**************"
         url = self._make_url(path)
+
+        if self.cache:
+            # The cached copy of this resource is now out of date.
+            self.cache.remove(url)
+
+        self.resources.forget(url)
+
         debug('HTTP POSTing to %s: %s' % (url, debug_fields))
 
         content_type, body = self._encode_multipart_formdata(fields, files)
@@ -693,14 +1189,43 @@ class ReviewBoardServer(object):
             'Content-Length': str(len(body))
         }
 
+        if compress:
+            from rbtools.api.compression import get_file_size, \
+                                                gzip_to_tempfile
+
+            size = len(body)
+            body = gzip_to_tempfile(body)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Content-Length'] = str(get_file_size(body))
+            debug('Compressed request body from %d to %s bytes' %
+                  (size, headers['Content-Length']))
+
+        size = int(headers['Content-Length'])
+        progress = None
+
+        if size >= PROGRESS_MIN_SIZE:
+            # Large uploads can take a while. Show that they're moving.
+            from rbtools.utils.progress import ProgressFile, UploadProgress
+
+            progress = UploadProgress('Uploading', size)
+            body = ProgressFile(body, progress)
+
         try:
             r = urllib2.Request(str(url), body, headers)
-            data = urllib2.urlopen(r).read()
+
             try:
-                self.cookie_jar.save(self.cookie_file)
-            except IOError, e:
-                debug('Failed to write cookie file: %s' % e)
-            return data
+                rsp = self._open(r)[1]
+            except:
+                # Don't leave a summary of an upload that didn't go through.
+                if progress:
+                    progress.abort()
+
+                raise
+
+            if progress:
+                progress.finish()
+
+            return rsp
         except urllib2.HTTPError, e:
             # Re-raise so callers can interpret it.
             raise e
@@ -719,6 +1244,13 @@ class ReviewBoardServer(object):
         were set.
         """
         url = self._make_url(path)
+
+        if self.cache:
+            # The cached copy of this resource is now out of date.
+            self.cache.remove(url)
+
+        self.resources.forget(url)
+
         debug('HTTP PUTting to %s: %s' % (url, fields))
 
         content_type, body = self._encode_multipart_formdata(fields, None)
@@ -729,12 +1261,7 @@ class ReviewBoardServer(object):
 
         try:
             r = HTTPRequest(str(url), body, headers, method='PUT')
-            data = urllib2.urlopen(r).read()
-            try:
-                self.cookie_jar.save(self.cookie_file)
-            except IOError, e:
-                debug('Failed to write cookie file: %s' % e)
-            return data
+            return self._open(r)[1]
         except urllib2.HTTPError, e:
             # Re-raise so callers can interpret it.
             raise e
@@ -753,16 +1280,18 @@ class ReviewBoardServer(object):
         were set.
         """
         url = self._make_url(path)
+
+        if self.cache:
+            # The cached copy of this resource is now out of date.
+            self.cache.remove(url)
+
+        self.resources.forget(url)
+
         debug('HTTP DELETing %s' % url)
 
         try:
             r = HTTPRequest(url, method='DELETE')
-            data = urllib2.urlopen(r).read()
-            try:
-                self.cookie_jar.save(self.cookie_file)
-            except IOError, e:
-                debug('Failed to write cookie file: %s' % e)
-            return data
+            return self._open(r)[1]
         except urllib2.HTTPError, e:
             # Re-raise so callers can interpret it.
             raise e
@@ -775,12 +1304,13 @@ class ReviewBoardServer(object):
             die("Unable to access %s. The host path may be invalid\n%s" % \
                 (url, e))
 
-    def api_post(self, path, fields=None, files=None):
+    def api_post(self, path, fields=None, files=None, compress=False):
         """
         Performs an API call using HTTP POST at the specified path.
         """
         try:
-            return self.process_json(self.http_post(path, fields, files))
+            return self.process_json(self.http_post(path, fields, files,
+                                                    compress))
         except urllib2.HTTPError, e:
             self.process_error(e.code, e.read())
 
@@ -805,34 +1335,15 @@ class ReviewBoardServer(object):
     def _encode_multipart_formdata(self, fields, files):
         """
         Encodes data for use in an HTTP POST.
-        """
-        BOUNDARY = mimetools.choose_boundary()
-        content = ""
-
-        fields = fields or {}
-        files = files or {}
-
-        for key in fields:
-            content += "--" + BOUNDARY + "\r\n"
-            content += "Content-Disposition: form-data; name=\"%s\"\r\n" % key
-            content += "\r\n"
-            content += str(fields[key]) + "\r\n"
 
-        for key in files:
-            filename = files[key]['filename']
-            value = files[key]['content']
-            content += "--" + BOUNDARY + "\r\n"
-            content += "Content-Disposition: form-data; name=\"%s\"; " % key
-            content += "filename=\"%s\"\r\n" % filename
-            content += "\r\n"
-            content += value + "\r\n"
-
-        content += "--" + BOUNDARY + "--\r\n"
-        content += "\r\n"
+        This returns the content type and a file-like body that is streamed
+        to the server in chunks, rather than being built up in memory.
+        """
+        from rbtools.api.multipart import MultipartBody
 
-        content_type = "multipart/form-data; boundary=%s" % BOUNDARY
+        body = MultipartBody(fields, files)
 
-        return content_type, content
+        return body.content_type, body
 
 
 def debug(s):
@@ -846,15 +1357,46 @@ def debug(s):
 debug = logging.debug
 
 
+def get_diff_hash(diff_content, parent_diff_content):
+    """Returns a hash identifying a diff and its parent diff."""
+    return sha1('%s\0%s' % (diff_content,
+                             parent_diff_content or '')).hexdigest()
+
+
+def call_logged_in(server, retries, func, *args, **kwargs):
+    """
+    Calls func, logging in again and calling it again if the server says
+    we're not logged in.
+
+    This is only tried retries times. We had an odd issue where the server
+    ended up a couple of years in the future. Login succeeded but the cookie
+    date was "odd", so use of the cookie appeared to fail forever.
+    """
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except APIError, e:
+            if e.error_code != 103 or retries <= 0: # 103: Not logged in
+                raise
+
+            retries -= 1
+            server.login(force=True)
+
+
 def tempt_fate(server, tool, changenum, diff_content=None,
                parent_diff_content=None, submit_as=None, retries=3):
     """
     Attempts to create a review request on a Review Board server and upload
     a diff. On success, the review request path is displayed.
+
+    If the session expires along the way, we log in again and carry on from
+    the step that failed.
     """
     try:
         if options.rid:
-            review_request = server.get_review_request(options.rid)
+            review_request = call_logged_in(server, retries,
+                                            server.get_review_request,
+                                            options.rid)
             status = review_request['status']
 
             if status == 'submitted':
@@ -862,92 +1404,97 @@ def tempt_fate(server, tool, changenum, diff_content=None,
                     "update it, please reopen the request using the web "
                     "interface and try again." % (options.rid, status))
         else:
-            review_request = server.new_review_request(changenum, submit_as)
-
-        if options.target_groups:
-            server.set_review_request_field(review_request, 'target_groups',
-                                            options.target_groups)
-
-        if options.target_people:
-            server.set_review_request_field(review_request, 'target_people',
-                                            options.target_people)
-
-        if options.summary:
-            server.set_review_request_field(review_request, 'summary',
-                                            options.summary)
-
-        if options.branch:
-            server.set_review_request_field(review_request, 'branch',
-                                            options.branch)
-
-        if options.bugs_closed:     # append to existing list
-            options.bugs_closed = options.bugs_closed.strip(", ")
-            bug_set = set(re.split("[, ]+", options.bugs_closed)) | \
-                      set(review_request['bugs_closed'])
-            options.bugs_closed = ",".join(bug_set)
-            server.set_review_request_field(review_request, 'bugs_closed',
-                                            options.bugs_closed)
-
-        if options.description:
-            server.set_review_request_field(review_request, 'description',
-                                            options.description)
-
-        if options.testing_done:
-            server.set_review_request_field(review_request, 'testing_done',
-                                            options.testing_done)
-
-        if options.change_description:
-            server.set_review_request_field(review_request, 'changedescription',
-                                            options.change_description)
+            review_request = call_logged_in(server, retries,
+                                            server.new_review_request,
+                                            changenum, submit_as)
     except APIError, e:
-        if e.error_code == 103: # Not logged in
-            retries = retries - 1
-
-            # We had an odd issue where the server ended up a couple of
-            # years in the future. Login succeeds but the cookie date was
-            # "odd" so use of the cookie appeared to fail and eventually
-            # ended up at max recursion depth :-(. Check for a maximum
-            # number of retries.
-            if retries >= 0:
-                server.login(force=True)
-                return tempt_fate(server, tool, changenum, diff_content,
-                                  parent_diff_content, submit_as,
-                                  retries=retries)
-
         if options.rid:
             die("Error getting review request %s: %s" % (options.rid, e))
         else:
             die("Error creating review request: %s" % e)
 
+    # The draft fields are collected here and sent along with the
+    # publish flag in a single request once the diff is uploaded.
+    draft_fields = {}
+
+    if options.target_groups:
+        draft_fields['target_groups'] = options.target_groups
+
+    if options.target_people:
+        draft_fields['target_people'] = options.target_people
+
+    if options.summary:
+        draft_fields['summary'] = options.summary
+
+    if options.branch:
+        draft_fields['branch'] = options.branch
+
+    if options.bugs_closed:     # append to existing list
+        options.bugs_closed = options.bugs_closed.strip(", ")
+        bug_set = set(re.split("[, ]+", options.bugs_closed)) | \
+                  set(review_request['bugs_closed'])
+        options.bugs_closed = ",".join(bug_set)
+        draft_fields['bugs_closed'] = options.bugs_closed
+
+    if options.description:
+        draft_fields['description'] = options.description
+
+    if options.testing_done:
+        draft_fields['testing_done'] = options.testing_done
+
+    if options.change_description:
+        draft_fields['changedescription'] = options.change_description
 
     if not server.info.supports_changesets or not options.change_only:
-        try:
-            server.upload_diff(review_request, diff_content,
+        if (options.skip_unchanged_diff and
+            server.is_diff_uploaded(review_request, diff_content,
+                                    parent_diff_content)):
+            print "The diff hasn't changed since it was last uploaded. " \
+                  "Skipping the upload."
+        else:
+            try:
+                call_logged_in(server, retries, server.upload_diff,
+                               review_request, diff_content,
                                parent_diff_content)
-        except APIError, e:
-            sys.stderr.write('\n')
-            sys.stderr.write('Error uploading diff\n')
-            sys.stderr.write('\n')
-
-            if e.error_code == 101 and e.http_status == 403:
-                die('You do not have permissions to modify this review request\n')
-            elif e.error_code == 105:
-                sys.stderr.write('The generated diff file was empty. This '
-                                 'usually means no files were\n')
-                sys.stderr.write('modified in this change.\n')
+            except APIError, e:
+                if draft_fields:
+                    # Still save the fields to the draft, as they were before
+                    # the upload was attempted.
+                    try:
+                        server.update_draft(review_request, draft_fields)
+                    except APIError:
+                        pass
+
                 sys.stderr.write('\n')
-                sys.stderr.write('Try running with --output-diff and --debug '
-                                 'for more information.\n')
+                sys.stderr.write('Error uploading diff\n')
                 sys.stderr.write('\n')
 
-            die("Your review request still exists, but the diff is not " +
-                "attached.")
+                if e.error_code == 101 and e.http_status == 403:
+                    die('You do not have permissions to modify this review '
+                        'request\n')
+                elif e.error_code == 105:
+                    sys.stderr.write('The generated diff file was empty. '
+                                     'This usually means no files were\n')
+                    sys.stderr.write('modified in this change.\n')
+                    sys.stderr.write('\n')
+                    sys.stderr.write('Try running with --output-diff and '
+                                     '--debug for more information.\n')
+                    sys.stderr.write('\n')
+
+                die("Your review request still exists, but the diff is "
+                    "not attached.")
 
     if options.reopen:
-        server.reopen(review_request)
+        call_logged_in(server, retries, server.reopen, review_request)
 
-    if options.publish:
-        server.publish(review_request)
+    if draft_fields or options.publish:
+        try:
+            call_logged_in(server, retries, server.update_draft,
+                           review_request, draft_fields,
+                           publish=options.publish)
+        except APIError, e:
+            die("Error updating review request %s: %s" %
+                (review_request['id'], e))
 
     request_url = 'r/' + str(review_request['id']) + '/'
     review_url = urljoin(server.url, request_url)
@@ -981,8 +1528,8 @@ def parse_options(args):
     parser.add_option("-n", "--output-diff",
                       dest="output_diff_only", action="store_true",
                       default=False,
-                      help="outputs a diff to the console and exits. "
-                           "Does not post")
+                      help="outputs a diff to the console and exits "
+                           "without contacting the server")
     parser.add_option("--server",
                       dest="server",
                       default=get_config_value(configs, 'REVIEWBOARD_URL'),
@@ -995,6 +1542,102 @@ def parse_options(args):
                                                    True),
                       help="prevents requests from going through a proxy "
                            "server")
+    parser.add_option("--disable-keepalive",
+                      action='store_true',
+                      dest='disable_keepalive',
+                      default=not get_config_value(configs, 'ENABLE_KEEPALIVE',
+                                                   True),
+                      help="opens a new connection to the server for every "
+                           "request instead of reusing one")
+    parser.add_option("--connect-timeout",
+                      dest="connect_timeout", type="float",
+                      default=get_config_value(configs, 'CONNECT_TIMEOUT', 30),
+                      metavar="SECONDS",
+                      help="how long to wait for a connection to the server "
+                           "to open (0 waits forever)")
+    parser.add_option("--read-timeout",
+                      dest="read_timeout", type="float",
+                      default=get_config_value(configs, 'READ_TIMEOUT', 300),
+                      metavar="SECONDS",
+                      help="how long to wait for the server to respond or "
+                           "accept more data (0 waits forever)")
+    parser.add_option("--max-retries",
+                      dest="max_retries", type="int",
+                      default=get_config_value(configs, 'MAX_RETRIES', 3),
+                      help="the number of times to retry requests that fail "
+                           "because of network or temporary server errors")
+    parser.add_option("--max-concurrent-requests",
+                      dest="max_concurrent_requests", type="int",
+                      default=get_config_value(configs,
+                                               'MAX_CONCURRENT_REQUESTS', 4),
+                      help="the maximum number of requests to make to the "
+                           "server at once when looking up repositories")
+    parser.add_option("--compress-uploads",
+                      dest="compress_uploads", type="choice",
+                      choices=["diffs", "body"],
+                      default=get_config_value(configs, 'COMPRESS_UPLOADS'),
+                      metavar="MODE",
+                      help="gzip-compresses uploaded diffs ('diffs') or the "
+                           "whole upload request ('body'), if the server "
+                           "accepts it")
+    parser.add_option("--disable-response-compression",
+                      action='store_true',
+                      dest='disable_response_compression',
+                      default=not get_config_value(
+                          configs, 'ENABLE_RESPONSE_COMPRESSION', True),
+                      help="prevents asking the server for gzip-compressed "
+                           "responses")
+    parser.add_option("--disable-cache",
+                      action='store_true',
+                      dest='disable_cache',
+                      default=not get_config_value(configs, 'ENABLE_CACHE',
+                                                   True),
+                      help="bypasses the local cache of server responses")
+    parser.add_option("--clear-cache",
+                      action='store_true',
+                      dest='clear_cache', default=False,
+                      help="clears the local cache of server responses, "
+                           "and of the features the server was found not to "
+                           "support, before running")
+    parser.add_option("--http-stats",
+                      action='store_true',
+                      dest='http_stats',
+                      default=get_config_value(configs, 'HTTP_STATS', False),
+                      help="prints the timings and sizes of the HTTP "
+                           "requests made to the server at the end of the "
+                           "run")
+    parser.add_option("--http-stats-file",
+                      dest='http_stats_file',
+                      default=get_config_value(configs, 'HTTP_STATS_FILE'),
+                      metavar="FILENAME",
+                      help="writes the timings and sizes of the HTTP "
+                           "requests made to the server to a JSON file")
+    parser.add_option("--rebuild-repository-index",
+                      action='store_true',
+                      dest='rebuild_repository_index', default=False,
+                      help="forgets which repository on the server matches "
+                           "this one and searches for it again")
+    parser.add_option("--redetect-repository",
+                      action='store_true',
+                      dest='redetect_repository',
+                      default=get_config_value(configs,
+                                               'REDETECT_REPOSITORY', False),
+                      help="detects the repository of this checkout again "
+                           "instead of using the cached result")
+    parser.add_option("--scm-probe-timeout",
+                      dest="scm_probe_timeout", type="float",
+                      default=get_config_value(configs, 'SCM_PROBE_TIMEOUT',
+                                               0),
+                      metavar="SECONDS",
+                      help="how long to wait for the tools of the supported "
+                           "source code management systems to find a "
+                           "checkout (the default, 0, waits forever)")
+    parser.add_option("--skip-unchanged-diff",
+                      dest="skip_unchanged_diff", action="store_true",
+                      default=get_config_value(configs, 'SKIP_UNCHANGED_DIFF',
+                                               False),
+                      help="doesn't upload the diff if it's the same as the "
+                           "last one uploaded to the review request")
     parser.add_option("--diff-only",
                       dest="diff_only", action="store_true", default=False,
                       help="uploads a new diff, but does not update "
@@ -1211,15 +1854,74 @@ def parse_options(args):
     return args
 
 
-def main():
-    origcwd = os.path.abspath(os.getcwd())
+def make_server(tool, repository_info, cookie_file, origcwd):
+    """
+    Finds the Review Board server for the repository and returns a
+    ReviewBoardServer for it, or exits if there isn't one.
+    """
+    import atexit
+
+    from rbtools.api.cache import APICache
+    from rbtools.api.index import ServerIndex
+    from rbtools.api.repository_index import RepositoryIndex
 
-    if 'APPDATA' in os.environ:
-        homepath = os.environ['APPDATA']
-    elif 'HOME' in os.environ:
-        homepath = os.environ["HOME"]
+    # Try to find a valid Review Board server to use.
+    if options.server:
+        server_url = options.server
     else:
-        homepath = ''
+        server_url = tool.scan_for_server(repository_info)
+
+    if not server_url:
+        print "Unable to find a Review Board server for this source code tree."
+        sys.exit(1)
+
+    cache = APICache(get_cache_dir('api'),
+                     get_config_value(configs, 'CACHE_SIZE',
+                                      APICache.DEFAULT_MAX_SIZE))
+
+    server_features = ServerIndex(get_cache_dir('features'))
+
+    if options.clear_cache:
+        debug('Clearing the API cache')
+        cache.clear()
+        server_features.clear()
+
+    if options.disable_cache:
+        cache = None
+
+    repository_index = RepositoryIndex(get_cache_dir('repositories'))
+    upload_history = ServerIndex(get_cache_dir('uploads'))
+    server = ReviewBoardServer(server_url, repository_info, cookie_file,
+                               cache, repository_index, upload_history,
+                               server_features)
+
+    if options.rebuild_repository_index:
+        debug('Rebuilding the repository index for %s' % server.url)
+        repository_index.clear(server.url)
+
+    # Cookies are only written out once, however the run ends.
+    atexit.register(server.save_cookies)
+
+    if options.http_stats or options.http_stats_file:
+        if options.http_stats_file:
+            options.http_stats_file = os.path.join(origcwd,
+                                                   options.http_stats_file)
+
+        atexit.register(server.report_http_stats)
+
+    return server
+
+
+def check_api_version(server):
+    """Checks the server's API version, exiting if it can't be accessed."""
+    # Handle the case where /api/ requires authorization (RBCommons).
+    if not server.check_api_version():
+        die("Unable to log in with the supplied username and password.")
+
+
+def main():
+    origcwd = os.path.abspath(os.getcwd())
+    homepath = get_home_path()
 
     # If we end up creating a cookie file, make sure it's only readable by the
     # user.
@@ -1227,35 +1929,46 @@ def main():
 
     # Load the config and cookie files
     cookie_file = os.path.join(homepath, ".post-review-cookies.txt")
-    user_config, globals()['configs'] = load_config_files(homepath)
+    user_config, globals()['configs'] = load_config_files(
+        homepath, get_cache_dir('config'))
 
     args = parse_options(sys.argv[1:])
 
     debug('RBTools %s' % get_version_string())
     debug('Home = %s' % homepath)
 
-    repository_info, tool = scan_usable_client(options)
+    set_tool_cache(ToolCache(get_cache_dir('tools')))
+
+    repository_info, tool = scan_usable_client(
+        options, DetectionCache(get_cache_dir('detection')))
     tool.user_config = user_config
     tool.configs = configs
 
     # Verify that options specific to an SCM Client have not been mis-used.
     tool.check_options()
 
-    # Try to find a valid Review Board server to use.
-    if options.server:
-        server_url = options.server
+    if options.output_diff_only:
+        # The diff is only printed, so there's no need to find or talk to
+        # the server.
+        server = None
     else:
-        server_url = tool.scan_for_server(repository_info)
+        server = make_server(tool, repository_info, cookie_file, origcwd)
 
-    if not server_url:
-        print "Unable to find a Review Board server for this source code tree."
-        sys.exit(1)
+        # With a session cookie, there's most likely no need to log in, so
+        # the API version is checked in the background while the diff is
+        # generated, which can take a long time. Otherwise it's checked
+        # first, since that's where any prompts for credentials happen.
+        if not server.has_valid_cookie():
+            check_api_version(server)
 
-    server = ReviewBoardServer(server_url, repository_info, cookie_file)
+    # Fetch what the server can tell us ahead of time in the background.
+    # The prefetch never prompts or fails the run.
+    if server and (options.rid or not server.api_checked):
+        from rbtools.utils.workers import BackgroundTask
 
-    # Handle the case where /api/ requires authorization (RBCommons).
-    if not server.check_api_version():
-        die("Unable to log in with the supplied username and password.")
+        prefetch = BackgroundTask(server.prefetch, options.rid).start()
+    else:
+        prefetch = None
 
     if repository_info.supports_changesets:
         changenum = tool.get_changenum(args)
@@ -1282,11 +1995,23 @@ def main():
     else:
         diff, parent_diff = tool.diff(args)
 
+    if prefetch:
+        prefetch.wait()
+
+        if not server.api_checked:
+            # The server asked for credentials, or there was an error. Check
+            # again where it can prompt and report the error.
+            check_api_version(server)
+
     if len(diff) == 0:
         die("There don't seem to be any diffs!")
 
-    if (isinstance(tool, PerforceClient) or
-        isinstance(tool, PlasticClient)) and changenum is not None:
+    if options.output_diff_only:
+        # The comma here isn't a typo, but rather suppresses the extra newline
+        print diff,
+        sys.exit(0)
+
+    if changenum is not None:
         changenum = tool.sanitize_changenum(changenum)
 
         # NOTE: In Review Board 1.5.2 through 1.5.3.1, the changenum support
@@ -1297,11 +2022,6 @@ def main():
                   'Falling back to the deprecated 1.0 API' % server.rb_version)
             server.deprecated_api = True
 
-    if options.output_diff_only:
-        # The comma here isn't a typo, but rather suppresses the extra newline
-        print diff,
-        sys.exit(0)
-
     # Print some basic diff's statistics (lines added/removed)
     (files, ins, dels) = diff_stats(diff)
     print '%d files changed, %d insertions(+), %d deletions(-)' % (files, ins, dels)
@@ -1313,6 +2033,9 @@ def main():
                             parent_diff_content=parent_diff,
                             submit_as=options.submit_as)
 
+    debug('Made %d HTTP request(s) using %d connection(s)' %
+          server.get_connection_stats())
+
     # Load the review up in the browser if requested to:
     if options.open_browser:
         try:
@@ -1,5 +1,18 @@
+import cgi
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import urllib
 import urllib2
+from BaseHTTPServer import BaseHTTPRequestHandler
+import setuptools
+from nose import SkipTest
 
 try:
     from cStringIO import StringIO
@@ -11,10 +24,21 @@ try:
 except ImportError:
     import simplejson as json
 
-from rbtools import postreview
+from rbtools import clients, postreview
+from rbtools.api.cache import APICache
+from rbtools.api.client import ConcurrentAPIClient
 from rbtools.api.errors import APIError
+from rbtools.api.index import ServerIndex
+from rbtools.api.repository_index import RepositoryIndex
+from rbtools.api.tests import HTTPServerTestBase
 from rbtools.clients import RepositoryInfo
+from rbtools.clients.clearcase import ClearCaseRepositoryInfo
+from rbtools.clients.svn import SVNRepositoryInfo
 from rbtools.postreview import ReviewBoardServer
+from rbtools.utils.process import execute
+from rbtools.utils.testbase import RBTestBase
+from rbtools.utils.testserver import FakeReviewBoardServer
+from rbtools.utils.workers import BackgroundTask
 
 
 class MockHttpUnitTest(unittest.TestCase):
@@ -61,6 +85,17 @@ class OptionsStub(object):
         self.password = None
         self.repository_url = None
         self.disable_proxy = False
+        self.disable_keepalive = False
+        self.disable_response_compression = False
+        self.compress_uploads = None
+        self.max_concurrent_requests = 4
+        self.http_stats = False
+        self.http_stats_file = None
+        self.connect_timeout = None
+        self.read_timeout = None
+        self.max_retries = 0
+        self.scm_probe_timeout = None
+        self.redetect_repository = False
 
 
 class ApiTests(MockHttpUnitTest):
@@ -192,3 +227,1099 @@ class DeprecatedApiTests(MockHttpUnitTest):
 
     def _make_http_error(self, url, code, body):
         return urllib2.HTTPError(url, code, body, {}, StringIO(body))
+
+
+class PresetHTTPAuthHandlerTests(unittest.TestCase):
+    def setUp(self):
+        postreview.options = OptionsStub()
+        self.password_mgr = postreview.ReviewBoardHTTPPasswordMgr(
+            'http://localhost:8080/')
+        self.handler = postreview.PresetHTTPAuthHandler(
+            'http://localhost:8080/', self.password_mgr)
+
+    def _get_auth_header(self, url, cookie=None):
+        request = urllib2.Request(url)
+
+        if cookie:
+            request.add_unredirected_header('Cookie', cookie)
+
+        return self.handler.http_request(request).get_header('Authorization')
+
+    def test_preemptive_auth(self):
+        """Testing PresetHTTPAuthHandler sending known credentials"""
+        url = 'http://localhost:8080/api/'
+        self.assertEqual(self._get_auth_header(url), None)
+
+        self.password_mgr.rb_user = 'user'
+        self.password_mgr.rb_pass = 'pass'
+
+        for i in range(2):
+            self.assertEqual(self._get_auth_header(url),
+                             'Basic dXNlcjpwYXNz')
+
+        self.assertEqual(self._get_auth_header(url, 'rbsessionid=abc'), None)
+        self.assertEqual(self._get_auth_header('http://example.com/'), None)
+
+
+class BasicAuthHandlerTests(unittest.TestCase):
+    def setUp(self):
+        self.handler = postreview.ReviewBoardHTTPBasicAuthHandler()
+        self.saved_retry = urllib2.HTTPBasicAuthHandler.retry_http_basic_auth
+        urllib2.HTTPBasicAuthHandler.retry_http_basic_auth = \
+            self._retry_http_basic_auth
+        self.main_thread = threading.currentThread()
+        self.entered = threading.Event()
+        self.finish = threading.Event()
+        self.status = 401
+
+    def tearDown(self):
+        self.finish.set()
+        urllib2.HTTPBasicAuthHandler.retry_http_basic_auth = \
+            self.saved_retry
+
+    def _retry_http_basic_auth(self, handler, host, req, realm):
+        if threading.currentThread() is not self.main_thread:
+            # Hold the other thread in the middle of its retry.
+            self.entered.set()
+            self.finish.wait(5)
+
+        return urllib2.addinfourl(StringIO(''), {}, host, self.status)
+
+    def _retry(self, url):
+        return self.handler.retry_http_basic_auth(url, None, 'Web API')
+
+    def test_retry_once(self):
+        """Testing ReviewBoardHTTPBasicAuthHandler retrying once per URL"""
+        url = 'http://localhost:8080/api/'
+        self.assertEqual(self._retry(url).code, 401)
+        self.assertEqual(self._retry(url), None)
+
+        self.status = 200
+        self.assertEqual(self._retry('http://localhost:8080/api/info/').code,
+                         200)
+        self.assertEqual(self._retry(url).code, 200)
+
+    def test_retry_threads(self):
+        """Testing ReviewBoardHTTPBasicAuthHandler retrying from threads"""
+        url = 'http://localhost:8080/api/repositories/1/info/'
+        thread = threading.Thread(target=self._retry, args=(url,))
+        thread.setDaemon(True)
+        thread.start()
+        self.entered.wait(5)
+        self.assertTrue(self.entered.isSet())
+
+        # The other thread's retry of the same URL doesn't count against
+        # this one.
+        self.assertEqual(self._retry(url).code, 401)
+
+        self.finish.set()
+        thread.join(5)
+
+
+class UploadDiffTests(MockHttpUnitTest):
+    EMPTY_DIFF_ERROR = {
+        'code': 105,
+        'msg': 'The diff file is empty',
+    }
+
+    def setUp(self):
+        super(UploadDiffTests, self).setUp()
+        self.review_request = {
+            'id': 1,
+            'links': {
+                'diffs': {
+                    'href': 'api/review-requests/1/diffs/',
+                },
+            },
+        }
+        self.uploads = []
+        self.reject_all = None
+
+    def _http_method(self, path, fields=None, files=None, compress=False):
+        self.uploads.append((files, compress))
+
+        if self.reject_all:
+            body = json.dumps({
+                'stat': 'fail',
+                'err': self.reject_all,
+            })
+            raise urllib2.HTTPError(path, 400, body, {}, StringIO(body))
+
+        if (compress or files['path']['filename'].endswith('.gz')) and \
+           self.reject_compressed:
+            body = json.dumps({
+                'stat': 'fail',
+                'err': self.reject_compressed,
+            })
+            raise urllib2.HTTPError(path, 400, body, {}, StringIO(body))
+
+        return json.dumps({'stat': 'ok'})
+
+    def test_upload_diff_compressed(self):
+        """Testing uploading a gzip-compressed diff"""
+        self.reject_compressed = False
+        self.server.compress_uploads = 'diffs'
+        self.server.upload_diff(self.review_request, 'diff', 'parent')
+
+        self.assertEqual(len(self.uploads), 1)
+        files, compress = self.uploads[0]
+        self.assertFalse(compress)
+        self.assertEqual(files['path']['filename'], 'diff.gz')
+        self.assertEqual(files['parent_diff_path']['filename'],
+                         'parent_diff.gz')
+
+    def test_upload_diff_compression_rejected(self):
+        """Testing falling back to uncompressed diff uploads"""
+        tmp_dir = tempfile.mkdtemp()
+        self.server.server_features = ServerIndex(tmp_dir)
+        self.reject_compressed = self.EMPTY_DIFF_ERROR
+        self.server.compress_uploads = 'body'
+
+        try:
+            self.server.upload_diff(self.review_request, 'diff', None)
+
+            self.assertEqual(len(self.uploads), 2)
+            self.assertTrue(self.uploads[0][1])
+            self.assertFalse(self.uploads[1][1])
+            self.assertEqual(self.uploads[1][0]['path']['content'], 'diff')
+            self.assertEqual(self.server.compress_uploads, None)
+
+            # The next run remembers that compression was rejected.
+            self.server.server_features = ServerIndex(tmp_dir)
+            self.server.compress_uploads = 'body'
+            self.server.upload_diff(self.review_request, 'diff', None)
+
+            self.assertEqual(len(self.uploads), 3)
+            self.assertFalse(self.uploads[2][1])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_upload_diff_invalid(self):
+        """Testing diff uploads rejected with and without compression"""
+        tmp_dir = tempfile.mkdtemp()
+        self.server.server_features = ServerIndex(tmp_dir)
+        self.reject_all = self.EMPTY_DIFF_ERROR
+        self.server.compress_uploads = 'body'
+
+        try:
+            try:
+                self.server.upload_diff(self.review_request, '', None)
+                self.fail('Expected an APIError')
+            except APIError, e:
+                self.assertEqual(e.error_code, 105)
+
+            self.assertEqual(len(self.uploads), 2)
+            self.assertFalse(self.uploads[1][1])
+            self.assertEqual(self.server.compress_uploads, 'body')
+            self.assertEqual(
+                ServerIndex(tmp_dir).get(self.server.url,
+                                         'compress_uploads:body'),
+                None)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_upload_diff_compressed_error(self):
+        """Testing other errors from compressed diff uploads"""
+        self.reject_compressed = {
+            'code': 210,
+            'msg': 'There was an error fetching extended information for '
+                   'this repository',
+        }
+        self.server.compress_uploads = 'diffs'
+
+        self.assertRaises(APIError, self.server.upload_diff,
+                          self.review_request, 'diff', None)
+        self.assertEqual(len(self.uploads), 1)
+        self.assertEqual(self.server.compress_uploads, 'diffs')
+
+
+class UploadHistoryTests(MockHttpUnitTest):
+    def setUp(self):
+        super(UploadHistoryTests, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server.upload_history = ServerIndex(self.tmp_dir)
+        self.review_request = {
+            'id': 1,
+            'links': {
+                'diffs': {
+                    'href': 'api/review-requests/1/diffs/',
+                },
+            },
+        }
+        self.http_response = {
+            'api/review-requests/1/diffs/': json.dumps({
+                'stat': 'ok',
+                'diff': {
+                    'revision': 2,
+                },
+                'diffs': [
+                    {'revision': 1},
+                    {'revision': 2},
+                ],
+                'total_results': 2,
+            }),
+        }
+
+    def tearDown(self):
+        super(UploadHistoryTests, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_is_diff_uploaded(self):
+        """Testing is_diff_uploaded after uploading the same diff"""
+        self.assertFalse(self.server.is_diff_uploaded(self.review_request,
+                                                      'diff', None))
+        self.server.upload_diff(self.review_request, 'diff', None)
+        self.assertTrue(self.server.is_diff_uploaded(self.review_request,
+                                                     'diff', None))
+        self.assertFalse(self.server.is_diff_uploaded(self.review_request,
+                                                      'diff', 'parent'))
+        self.assertFalse(self.server.is_diff_uploaded(self.review_request,
+                                                      'diff2', None))
+
+    def test_is_diff_uploaded_unpublished(self):
+        """Testing is_diff_uploaded with the diff on an unpublished draft"""
+        self.review_request['links']['draft'] = {
+            'href': 'api/review-requests/1/draft/',
+        }
+        self.http_response['api/review-requests/1/draft/'] = json.dumps({
+            'stat': 'ok',
+            'draft': {},
+        })
+        self.server.upload_diff(self.review_request, 'diff', None)
+
+        # Only the published diffs are listed.
+        self.http_response['api/review-requests/1/diffs/'] = json.dumps({
+            'stat': 'ok',
+            'diffs': [
+                {'revision': 1},
+            ],
+        })
+        self.assertTrue(self.server.is_diff_uploaded(self.review_request,
+                                                     'diff', None))
+
+        # Without the draft, the diff was discarded.
+        self.http_response['api/review-requests/1/draft/'] = \
+            APIError(404, 100)
+        self.assertFalse(self.server.is_diff_uploaded(self.review_request,
+                                                      'diff', None))
+
+    def test_is_diff_uploaded_newer_revision(self):
+        """Testing is_diff_uploaded with a newer diff on the server"""
+        self.server.upload_diff(self.review_request, 'diff', None)
+        self.http_response['api/review-requests/1/diffs/'] = json.dumps({
+            'stat': 'ok',
+            'diffs': [
+                {'revision': 1},
+                {'revision': 2},
+                {'revision': 3},
+            ],
+        })
+
+        self.assertFalse(self.server.is_diff_uploaded(self.review_request,
+                                                      'diff', None))
+
+
+class UpdateDraftTests(MockHttpUnitTest):
+    def setUp(self):
+        super(UpdateDraftTests, self).setUp()
+        self.saved_http_put = ReviewBoardServer.http_put
+        ReviewBoardServer.http_put = self._http_put
+        self.requests = []
+        self.review_request = {
+            'id': 1,
+            'links': {
+                'draft': {
+                    'href': 'api/review-requests/1/draft/',
+                },
+            },
+        }
+
+    def tearDown(self):
+        super(UpdateDraftTests, self).tearDown()
+        ReviewBoardServer.http_put = self.saved_http_put
+
+    def _http_put(self, path, fields):
+        self.requests.append(('PUT', path, fields))
+
+        return json.dumps({'stat': 'ok'})
+
+    def _http_method(self, path, fields=None, *args, **kwargs):
+        self.requests.append(('POST', path, fields))
+
+        return json.dumps({'stat': 'ok'})
+
+    def test_update_draft(self):
+        """Testing setting draft fields and publishing in one request"""
+        self.server.update_draft(self.review_request, {
+            'summary': 'Summary',
+            'testing_done': 'Tests',
+        }, publish=True)
+
+        self.assertEqual(self.requests, [
+            ('PUT', 'api/review-requests/1/draft/', {
+                'summary': 'Summary',
+                'testing_done': 'Tests',
+                'public': 1,
+            }),
+        ])
+
+    def test_update_draft_deprecated_api(self):
+        """Testing setting draft fields and publishing with the 1.0 API"""
+        self.server.deprecated_api = True
+        self.server.update_draft(self.review_request, {
+            'summary': 'Summary',
+        }, publish=True)
+
+        self.assertEqual(self.requests, [
+            ('POST', 'api/json/reviewrequests/1/draft/set/', {
+                'summary': 'Summary',
+            }),
+            ('POST', 'api/json/reviewrequests/1/publish/', None),
+        ])
+
+
+class RepositoryListTests(MockHttpUnitTest):
+    def setUp(self):
+        super(RepositoryListTests, self).setUp()
+        self.server.root_resource = {
+            'links': {
+                'repositories': {
+                    'href': 'api/repositories/',
+                },
+            },
+        }
+        self.requests = []
+        self.pages = []
+
+        for i in range(3):
+            rsp = {
+                'stat': 'ok',
+                'repositories': [
+                    {
+                        'id': i * 2 + 1,
+                        'tool': 'Git',
+                        'path': '/git/%d' % i,
+                    },
+                    {
+                        'id': i * 2 + 2,
+                        'tool': 'Subversion',
+                        'path': '/svn/%d' % i,
+                    },
+                ],
+                'links': {},
+            }
+
+            if i < 2:
+                rsp['links']['next'] = {
+                    'href': 'api/repositories/?start=%d' % ((i + 1) * 2),
+                }
+
+            self.pages.append(rsp)
+
+    def _http_method(self, path, *args, **kwargs):
+        self.requests.append(path)
+
+        if path.startswith('api/repositories/?start='):
+            page = int(path.split('=')[1]) / 2
+        else:
+            page = 0
+
+        return json.dumps(self.pages[page])
+
+    def test_iter_repositories_early_exit(self):
+        """Testing iter_repositories only fetching the pages needed"""
+        for repository in self.server.iter_repositories(path='/svn/1'):
+            break
+
+        self.assertEqual(repository['id'], 4)
+        self.assertEqual(self.requests, [
+            'api/repositories/?path=%2Fsvn%2F1',
+            'api/repositories/?start=2',
+        ])
+
+    def test_iter_repositories_filter(self):
+        """Testing iter_repositories filtering by tool"""
+        repositories = self.server.get_repositories(tool='Subversion')
+
+        self.assertEqual([repository['id'] for repository in repositories],
+                         [2, 4, 6])
+        self.assertEqual(self.requests[0], 'api/repositories/?tool=Subversion')
+
+    def test_iter_repositories_memoized(self):
+        """Testing iter_repositories reusing fetched pages"""
+        self.assertEqual(len(self.server.get_repositories()), 6)
+        self.assertEqual(len(self.requests), 3)
+
+        self.assertEqual(len(self.server.get_repositories(tool='Git')), 3)
+        self.assertEqual(len(self.server.get_repositories()), 6)
+        self.assertEqual(len(self.requests), 3)
+
+
+class ETagRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"1"':
+            self.statuses.append(304)
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.statuses.append(200)
+            body = json.dumps({'stat': 'ok'})
+            self.send_response(200)
+            self.send_header('ETag', '"1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class APICacheTests(HTTPServerTestBase):
+    request_handler = ETagRequestHandler
+
+    def setUp(self):
+        super(APICacheTests, self).setUp()
+        postreview.options = OptionsStub()
+        ETagRequestHandler.statuses = []
+        self.cache = APICache(os.path.join(self.get_user_home(), 'cache'))
+        self.cookie_file = os.path.join(self.get_user_home(), 'cookies.txt')
+
+    def test_api_get_revalidation(self):
+        """Testing api_get revalidating cached responses"""
+        for i in range(2):
+            server = ReviewBoardServer(self.url, RepositoryInfo(),
+                                       self.cookie_file, self.cache)
+            self.assertEqual(server.api_get('api/'), {'stat': 'ok'})
+            server.connection_pool.close()
+
+        self.assertEqual(ETagRequestHandler.statuses, [200, 304])
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    paths = []
+    resources = {
+        '/api/': {
+            'links': {
+                'info': {
+                    'href': '/api/info/',
+                },
+                'repositories': {
+                    'href': '/api/repositories/',
+                },
+                'review_requests': {
+                    'href': '/api/review-requests/',
+                },
+            },
+        },
+        '/api/info/': {
+            'info': {
+                'product': {
+                    'package_version': '1.6',
+                },
+            },
+        },
+        '/api/review-requests/5/': {
+            'review_request': {
+                'id': 5,
+            },
+        },
+    }
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        path, query = urllib.splitquery(self.path)
+
+        if path == '/api/repositories/':
+            rsp = self._get_repositories(cgi.parse_qs(query or ''))
+        elif re.match(r'^/api/repositories/\d+/info/$', path):
+            rsp = {
+                'info': {
+                    'uuid': path.split('/')[3],
+                },
+            }
+        elif path in self.resources:
+            rsp = self.resources[path].copy()
+        else:
+            self.send_error(404)
+            return
+
+        rsp['stat'] = 'ok'
+        body = json.dumps(rsp)
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+    def _get_repositories(self, query):
+        start = int(query.get('start', [0])[0])
+        max_results = int(query.get('max-results', [25])[0])
+        total = 60
+        rsp = {
+            'repositories': [
+                {
+                    'id': i,
+                    'links': {
+                        'self': {
+                            'href': '/api/repositories/%d/' % i,
+                        },
+                        'info': {
+                            'href': '/api/repositories/%d/info/' % i,
+                        },
+                    },
+                }
+                for i in range(start, min(start + max_results, total))
+            ],
+            'total_results': total,
+            'links': {},
+        }
+
+        if start + max_results < total:
+            rsp['links']['next'] = {
+                'href': '/api/repositories/?start=%d&max-results=%d'
+                        % (start + max_results, max_results),
+            }
+
+        return rsp
+
+
+class PrefetchTests(HTTPServerTestBase):
+    request_handler = APIRequestHandler
+
+    def setUp(self):
+        super(PrefetchTests, self).setUp()
+        postreview.options = OptionsStub()
+        APIRequestHandler.paths = []
+        self.server = ReviewBoardServer(
+            self.url, RepositoryInfo(),
+            os.path.join(self.get_user_home(), 'cookies.txt'))
+
+    def tearDown(self):
+        self.server.connection_pool.close()
+        super(PrefetchTests, self).tearDown()
+
+    def test_prefetch(self):
+        """Testing ReviewBoardServer.prefetch"""
+        self.assertTrue(self.server.check_api_version())
+        self.assertFalse(self.server.deprecated_api)
+        self.assertEqual(len(APIRequestHandler.paths), 2)
+
+        self.server.prefetch(5)
+        self.assertEqual(len(APIRequestHandler.paths), 3)
+
+        self.assertEqual(self.server.get_review_request(5), {'id': 5})
+        self.assertEqual(len(APIRequestHandler.paths), 3)
+        self.assertEqual(self.server.get_connection_stats(), (3, 1))
+
+    def test_prefetch_check_api_version(self):
+        """Testing ReviewBoardServer.prefetch checking the API version"""
+        self.assertTrue(self.server.prefetch())
+        self.assertTrue(self.server.api_checked)
+        self.assertFalse(self.server.deprecated_api)
+        self.assertEqual(APIRequestHandler.paths, ['/api/', '/api/info/'])
+
+        # The API version isn't checked again.
+        self.assertTrue(self.server.prefetch(5))
+        self.assertEqual(len(APIRequestHandler.paths), 3)
+
+
+class AuthRequiredRequestHandler(APIRequestHandler):
+    def do_GET(self):
+        if self.headers.get('Authorization'):
+            APIRequestHandler.do_GET(self)
+        else:
+            self.paths.append(self.path)
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="Web API"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+
+class PrefetchAuthTests(HTTPServerTestBase):
+    request_handler = AuthRequiredRequestHandler
+
+    def setUp(self):
+        super(PrefetchAuthTests, self).setUp()
+        postreview.options = OptionsStub()
+        APIRequestHandler.paths = []
+        self.server = ReviewBoardServer(
+            self.url, RepositoryInfo(),
+            os.path.join(self.get_user_home(), 'cookies.txt'))
+
+    def tearDown(self):
+        self.server.connection_pool.close()
+        super(PrefetchAuthTests, self).tearDown()
+
+    def test_prefetch_auth_required(self):
+        """Testing ReviewBoardServer.prefetch leaving logins to the caller"""
+        task = BackgroundTask(self.server.prefetch, 5).start()
+        self.assertTrue(task.wait())
+        self.assertFalse(task.result)
+        self.assertFalse(self.server.api_checked)
+        self.assertEqual(self.server.root_resource, None)
+
+        # The main thread checks again, with the credentials it has.
+        self.server.password_mgr.rb_user = 'admin'
+        self.server.password_mgr.rb_pass = 'admin'
+        self.assertTrue(self.server.check_api_version())
+        self.assertTrue(self.server.api_checked)
+        self.assertFalse(self.server.deprecated_api)
+
+
+class ConcurrentAPIClientTests(HTTPServerTestBase):
+    request_handler = APIRequestHandler
+
+    def setUp(self):
+        super(ConcurrentAPIClientTests, self).setUp()
+        postreview.options = OptionsStub()
+        APIRequestHandler.paths = []
+        self.server = ReviewBoardServer(
+            self.url, RepositoryInfo(),
+            os.path.join(self.get_user_home(), 'cookies.txt'))
+        self.server.check_api_version()
+        self.client = ConcurrentAPIClient(self.server)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.connection_pool.close()
+        super(ConcurrentAPIClientTests, self).tearDown()
+
+    def test_futures(self):
+        """Testing ConcurrentAPIClient operations returning futures"""
+        review_request = self.client.get_review_request(5)
+        missing = self.client.get_review_request(6)
+
+        self.assertEqual(review_request.result(), {'id': 5})
+        self.assertRaises(APIError, missing.result)
+
+    def test_get_many(self):
+        """Testing ConcurrentAPIClient.get_many"""
+        rsps = self.client.get_many(['api/info/', 'api/review-requests/5/'])
+
+        self.assertEqual(rsps[0]['info']['product']['package_version'],
+                         '1.6')
+        self.assertEqual(rsps[1]['review_request'], {'id': 5})
+
+    def test_get_repositories(self):
+        """Testing ConcurrentAPIClient.get_repositories fetching pages at once"""
+        APIRequestHandler.paths = []
+        repositories = self.client.get_repositories()
+
+        self.assertEqual([repository['id'] for repository in repositories],
+                         range(60))
+        self.assertEqual(sorted(APIRequestHandler.paths), [
+            '/api/repositories/',
+            '/api/repositories/?max-results=25&start=25',
+            '/api/repositories/?max-results=25&start=50',
+        ])
+
+
+class ResourceGraphTests(HTTPServerTestBase):
+    request_handler = APIRequestHandler
+
+    def setUp(self):
+        super(ResourceGraphTests, self).setUp()
+        postreview.options = OptionsStub()
+        self.server = ReviewBoardServer(
+            self.url, RepositoryInfo(),
+            os.path.join(self.get_user_home(), 'cookies.txt'))
+        self.server.check_api_version()
+        APIRequestHandler.paths = []
+
+    def tearDown(self):
+        self.server.connection_pool.close()
+        super(ResourceGraphTests, self).tearDown()
+
+    def test_get_review_request_memoized(self):
+        """Testing get_review_request reusing the fetched review request"""
+        for i in range(2):
+            self.assertEqual(self.server.get_review_request(5), {'id': 5})
+
+        self.assertEqual(APIRequestHandler.paths, ['/api/review-requests/5/'])
+
+        self.server.resources.forget(self.url + '/api/review-requests/5/draft/')
+        self.server.get_review_request(5)
+        self.assertEqual(len(APIRequestHandler.paths), 2)
+
+    def test_get_repository_info_from_list(self):
+        """Testing get_repository_info following links from the list"""
+        for repository in self.server.iter_repositories():
+            if repository['id'] == 3:
+                break
+
+        APIRequestHandler.paths = []
+        self.assertEqual(self.server.get_repository_info(3), {'uuid': '3'})
+        self.assertEqual(self.server.get_repository_info(3), {'uuid': '3'})
+        self.assertEqual(APIRequestHandler.paths,
+                         ['/api/repositories/3/info/'])
+
+
+class FakeServerTests(RBTestBase):
+    """End-to-end tests against the stand-in Review Board server."""
+    def setUp(self):
+        super(FakeServerTests, self).setUp()
+        postreview.options = OptionsStub()
+        postreview.options.username = 'admin'
+        postreview.options.password = 'admin'
+        postreview.options.diff_only = False
+        self.httpd = FakeReviewBoardServer(repository_count=30,
+                                           users={'admin': 'admin'},
+                                           page_size=10)
+        self.httpd.start()
+
+        repository_info = RepositoryInfo()
+        repository_info.path = 'svn://svn.example.com/repo7'
+        self.server = ReviewBoardServer(
+            self.httpd.url, repository_info,
+            os.path.join(self.get_user_home(), 'cookies.txt'))
+        self.server.check_api_version()
+
+    def tearDown(self):
+        self.server.connection_pool.close()
+        self.httpd.stop()
+
+    def test_handler_errors_quiet(self):
+        """Testing the fake server not printing handler errors by default"""
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            try:
+                raise socket.error(104, 'Connection reset by peer')
+            except socket.error:
+                self.httpd.handle_error(None, ('127.0.0.1', 0))
+
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+
+        self.assertEqual(output, '')
+
+    def test_failed_upload_progress(self):
+        """Testing failed uploads not reporting what was sent"""
+        review_request = self.server.new_review_request(None)
+        saved_min_size = postreview.PROGRESS_MIN_SIZE
+        saved_stderr = sys.stderr
+        postreview.PROGRESS_MIN_SIZE = 0
+        sys.stderr = StringIO()
+
+        try:
+            self.assertRaises(APIError, self.server.upload_diff,
+                              review_request, '', None)
+            self.server.upload_diff(review_request, 'diff content', None)
+            output = sys.stderr.getvalue()
+        finally:
+            postreview.PROGRESS_MIN_SIZE = saved_min_size
+            sys.stderr = saved_stderr
+
+        self.assertEqual(output.count('Uploading: sent '), 1)
+
+    def test_post(self):
+        """Testing posting a review request to the fake server"""
+        review_request = self.server.new_review_request(None)
+        self.server.upload_diff(review_request, 'diff content', None)
+        self.server.update_draft(review_request, {
+            'summary': 'My summary',
+        }, publish=True)
+
+        stored = self.httpd.review_requests[review_request['id']]
+        self.assertTrue(stored['public'])
+        self.assertEqual(stored['summary'], 'My summary')
+        self.assertEqual(stored['diffs'][0]['diff'], 'diff content')
+        self.assertEqual(self.httpd.stats['logins'], 1)
+        self.assertEqual(self.httpd.stats['connections'], 1)
+
+    def test_repository_pages(self):
+        """Testing listing repositories from the fake server"""
+        repositories = list(self.server.iter_repositories())
+        self.assertEqual(len(repositories), 30)
+        self.assertEqual(repositories[-1]['id'], 30)
+
+    def test_repository_info_error_not_retried(self):
+        """Testing that API error 210 is returned without retrying"""
+        self.httpd.repositories[0].pop('uuid')
+        postreview.options.max_retries = 3
+        server = ReviewBoardServer(
+            self.httpd.url, RepositoryInfo(),
+            os.path.join(self.get_user_home(), 'cookies2.txt'))
+
+        try:
+            server.check_api_version()
+            self.httpd.reset_stats()
+
+            try:
+                server.get_repository_info(self.httpd.repositories[0]['id'])
+                self.fail('APIError was not raised')
+            except APIError, e:
+                self.assertEqual(e.error_code, 210)
+
+            # One request for the repository, and one for its info.
+            self.assertEqual(self.httpd.stats['requests'], 2)
+        finally:
+            server.connection_pool.close()
+
+    def test_change_number_in_use(self):
+        """Testing reusing a review request with the same change number"""
+        review_request = self.server.new_review_request('123')
+        self.assertEqual(self.server.new_review_request('123')['id'],
+                         review_request['id'])
+
+    def test_invalid_repository(self):
+        """Testing posting to a repository unknown to the fake server"""
+        self.server.info.path = 'svn://svn.example.com/unknown'
+        old_stderr = sys.stderr
+        sys.stderr = StringIO()
+
+        try:
+            self.assertRaises(SystemExit, self.server.new_review_request,
+                              None)
+            self.assertTrue('svn://svn.example.com/unknown' in
+                            sys.stderr.getvalue())
+        finally:
+            sys.stderr = old_stderr
+
+    def test_invalid_repository_unindexed(self):
+        """Testing invalid repositories being removed from the index"""
+        index_dir = os.path.join(self.get_user_home(), 'repositories')
+        self.server.repository_index = RepositoryIndex(index_dir)
+        self.server.repository_index.set(self.server.url, 'uuid-1', {
+            'path': 'svn://svn.example.com/unknown',
+        })
+        self.server.repository_index.set(self.server.url, 'uuid-2', {
+            'path': 'svn://svn.example.com/repo7',
+        })
+        self.server.info.path = 'svn://svn.example.com/unknown'
+        old_stderr = sys.stderr
+        sys.stderr = StringIO()
+
+        try:
+            self.assertRaises(SystemExit, self.server.new_review_request,
+                              None)
+        finally:
+            sys.stderr = old_stderr
+
+        index = RepositoryIndex(index_dir)
+        self.assertEqual(index.get(self.server.url, 'uuid-1'), None)
+        self.assertEqual(index.get(self.server.url, 'uuid-2'), {
+            'path': 'svn://svn.example.com/repo7',
+        })
+
+    def test_svn_repository_indexed(self):
+        """Testing SVNRepositoryInfo using the repository index"""
+        self.server.repository_index = RepositoryIndex(
+            os.path.join(self.get_user_home(), 'repositories'))
+        repository = self.httpd.repositories[19]
+        info = SVNRepositoryInfo('http://mirror.example.com/repo20',
+                                 '/trunk', repository['uuid'])
+
+        found = info.find_server_repository_info(self.server)
+        self.assertEqual(found.path, repository['path'])
+        self.assertEqual(found.base_path, '/trunk')
+        self.assertEqual(
+            self.server.repository_index.get(self.server.url,
+                                             repository['uuid']),
+            {
+                'path': repository['path'],
+                'repos_base_path': '',
+            })
+
+        # The next lookup doesn't go through the server's repositories.
+        self.httpd.reset_stats()
+        found = info.find_server_repository_info(self.server)
+        self.assertEqual(found.path, repository['path'])
+        self.assertEqual(found.base_path, '/trunk')
+        self.assertEqual(self.httpd.stats['requests'], 0)
+
+    def test_clearcase_repository_indexed(self):
+        """Testing ClearCaseRepositoryInfo using the repository index"""
+        self.server.repository_index = RepositoryIndex(
+            os.path.join(self.get_user_home(), 'repositories'))
+        repository = self.httpd.repositories[-1]
+        repository['tool'] = 'ClearCase'
+        repository['path'] = '/vobs/project'
+        info = ClearCaseRepositoryInfo('/view/me/vobs/project',
+                                       '/view/me/vobs/project',
+                                       '/vobs/project')
+        info._get_vobs_uuid = lambda vobstag: repository['uuid']
+
+        found = info.find_server_repository_info(self.server)
+        self.assertEqual(found.path, '/vobs/project')
+        self.assertEqual(
+            self.server.repository_index.get(self.server.url,
+                                             repository['uuid']),
+            {'path': '/vobs/project'})
+
+        # The next lookup doesn't go through the server's repositories.
+        self.httpd.reset_stats()
+        found = info.find_server_repository_info(self.server)
+        self.assertEqual(found.path, '/vobs/project')
+        self.assertEqual(self.httpd.stats['requests'], 0)
+
+
+class CallLoggedInTests(unittest.TestCase):
+    def setUp(self):
+        self.logins = 0
+        self.calls = 0
+
+    def login(self, force=False):
+        self.logins += 1
+
+    def _call(self, failures):
+        self.calls += 1
+
+        if self.calls <= failures:
+            raise APIError(401, 103, {}, 'You are not logged in')
+
+        return 'ok'
+
+    def test_call_logged_in(self):
+        """Testing call_logged_in logging in again and retrying"""
+        self.assertEqual(postreview.call_logged_in(self, 3, self._call, 2),
+                         'ok')
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(self.logins, 2)
+
+    def test_call_logged_in_gives_up(self):
+        """Testing call_logged_in giving up after the retries"""
+        self.assertRaises(APIError, postreview.call_logged_in, self, 1,
+                          self._call, 5)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.logins, 1)
+
+
+class StartupTests(unittest.TestCase):
+    def test_no_slow_imports(self):
+        """Testing post-review not importing slow, rarely used modules"""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = os.environ.copy()
+        env['PYTHONPATH'] = root
+        p = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys; import rbtools.postreview; '
+             'print "\\n".join(sys.modules.keys())'],
+            env=env, stdout=subprocess.PIPE)
+        modules = p.communicate()[0].split()
+
+        self.assertTrue('rbtools.postreview' in modules)
+        self.assertFalse('pkg_resources' in modules)
+        self.assertFalse('getpass' in modules)
+
+    def test_installed_launcher(self):
+        """Testing the post-review launcher written by setup.py"""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script = os.path.join(root, 'scripts', 'post-review')
+        setup_args = {}
+        written = {}
+
+        class Installer(object):
+            def write_script(self, script_name, contents):
+                written[script_name] = contents
+
+        # Load setup.py without running setup(), to get at the installer
+        # it uses.
+        saved_setup = setuptools.setup
+        saved_cwd = os.getcwd()
+        setuptools.setup = lambda **kwargs: setup_args.update(kwargs)
+
+        try:
+            os.chdir(root)
+            setup_globals = {'__name__': '__main__',
+                             '__file__': os.path.join(root, 'setup.py')}
+            execfile(setup_globals['__file__'], setup_globals)
+        finally:
+            setuptools.setup = saved_setup
+            os.chdir(saved_cwd)
+
+        if sys.platform != 'win32':
+            self.assertEqual(setup_args['scripts'], ['scripts/post-review'])
+            self.assertEqual(setup_args['entry_points'], {})
+
+        installer = type('PlainInstaller',
+                         (setup_globals['PlainScriptsMixin'], Installer),
+                         {})()
+        fp = open(script, 'r')
+
+        try:
+            installer.install_script(None, 'post-review', fp.read())
+        finally:
+            fp.close()
+
+        contents = written['post-review']
+        self.assertTrue(contents.startswith('#!'))
+        self.assertTrue('from rbtools.postreview import main' in contents)
+        self.assertFalse(re.search(r'^\s*(from|import)\s+pkg_resources\b',
+                                   contents, re.M))
+
+
+class OutputDiffTests(RBTestBase):
+    """Tests for post-review -n."""
+    def setUp(self):
+        super(OutputDiffTests, self).setUp()
+
+        if not self.is_exe_in_path('git'):
+            raise SkipTest('git not found in path')
+
+        self.saved_clients = clients.SCMCLIENTS
+        self.saved_argv = sys.argv
+        self.saved_umask = os.umask(0022)
+
+        top_dir = self.chdir_tmp()
+        origin = os.path.join(top_dir, 'origin')
+        clone = os.path.join(top_dir, 'clone')
+        env = {
+            'GIT_AUTHOR_NAME': 'Tester',
+            'GIT_AUTHOR_EMAIL': 'tester@example.com',
+            'GIT_COMMITTER_NAME': 'Tester',
+            'GIT_COMMITTER_EMAIL': 'tester@example.com',
+        }
+
+        os.mkdir(origin)
+        os.chdir(origin)
+        execute(['git', 'init', '-q'])
+        self._write_file('README', 'Original\n')
+        execute(['git', 'add', 'README'])
+        execute(['git', 'commit', '-q', '-m', 'Initial'], env=env)
+
+        execute(['git', 'clone', '-q', origin, clone])
+        os.chdir(clone)
+        self._write_file('README', 'Changed\n')
+        execute(['git', 'commit', '-q', '-a', '-m', 'Change'], env=env)
+
+    def tearDown(self):
+        clients.SCMCLIENTS = self.saved_clients
+        sys.argv = self.saved_argv
+        os.umask(self.saved_umask)
+
+    def _write_file(self, filename, content):
+        fp = open(filename, 'w')
+        fp.write(content)
+        fp.close()
+
+    def test_output_diff_offline(self):
+        """Testing post-review -n without a server"""
+        clients.SCMCLIENTS = None
+        sys.argv = ['post-review', '-n']
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            try:
+                postreview.main()
+            except SystemExit, e:
+                self.assertFalse(e.code)
+
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+
+        self.assertTrue('-Original' in output)
+        self.assertTrue('+Changed' in output)
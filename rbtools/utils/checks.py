@@ -1,40 +1,165 @@
+import logging
 import os
-import subprocess
 import sys
+import threading
 
+from rbtools.utils.index import JSONIndex
 from rbtools.utils.process import die, execute
 
 
 GNU_DIFF_WIN32_URL = 'http://gnuwin32.sourceforge.net/packages/diffutils.htm'
 GNU_PATCH_WIN32_URL = 'http://gnuwin32.sourceforge.net/packages/patch.htm'
 
+# The persistent ToolCache, if one has been set with set_tool_cache.
+_tool_cache = None
+
+# The outputs of tools run during this process, by (program, args).
+_tool_outputs = {}
+_tool_lock = threading.Lock()
+
+
+class ToolCache(JSONIndex):
+    """A persistent cache of the output of tool version commands.
+
+    Checking what a tool can do (whether diff is GNU diff, or which
+    version of git-svn is installed) means running it, but the answer only
+    changes when the tool is replaced. Outputs are stored keyed on the
+    executable's path and the arguments, along with the executable's
+    modification time and size. An output is used only while those still
+    match.
+    """
+    def get_output(self, path, args):
+        """Returns the cached output of a command, or None."""
+        entry = self.get(path, ' '.join(args))
+
+        if entry and entry.get('stat') == self._get_stat(path):
+            return entry.get('output')
+
+        return None
+
+    def set_output(self, path, args, output):
+        """Records the output of a command."""
+        self.set(path, ' '.join(args), {
+            'stat': self._get_stat(path),
+            'output': output,
+        })
+
+    def _get_stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        return [st.st_mtime, st.st_size]
+
+
+def set_tool_cache(cache):
+    """Sets the ToolCache used by get_tool_output, or None for no cache."""
+    global _tool_cache
+
+    _tool_cache = cache
+
+
+def find_executable(name):
+    """
+    Returns the full path to an executable in the search path, or None if
+    there isn't one.
+
+    On Windows, ".exe" is added to names without an extension, since that's
+    all that CreateProcess (used by subprocess) adds. Other kinds of
+    programs, such as batch files, must be named in full.
+    """
+    if sys.platform.startswith('win') and not os.path.splitext(name)[1]:
+        name += '.exe'
+
+    if os.path.dirname(name):
+        dirs = ['']
+    else:
+        dirs = os.environ.get('PATH', os.defpath).split(os.pathsep)
+
+    for dirname in dirs:
+        path = os.path.join(dirname, name)
+
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return os.path.abspath(path)
+
+    return None
+
 
 def check_install(command):
     """
-    Try executing an external command and return a boolean indicating whether
-    that command is installed or not.  The 'command' argument should be
-    something that executes quickly, without hitting the network (for
-    instance, 'svn help' or 'git --version').
+    Returns whether the program run by an external command is installed.
+
+    The 'command' argument is a command line (for instance, 'svn help' or
+    'git --version'). Only the program name is used: it's looked up in the
+    search path rather than run.
     """
+    return find_executable(command.split(' ')[0]) is not None
+
+
+def get_tool_output(name, args, program=None):
+    """
+    Returns the output of running an installed tool with the given
+    arguments, or None if the tool isn't installed or the command fails.
+
+    This is meant for commands that report what the tool is, such as
+    "--version". The output is cached for as long as the executable is
+    unchanged, so the tool usually isn't run at all. If the command runs
+    another program that produces the output (such as "git svn" running
+    git-svn), program is that program's path, and the output is cached
+    for as long as it's unchanged instead. Failed commands aren't cached.
+    """
+    path = find_executable(name)
+
+    if not path:
+        return None
+
+    program = program or path
+    key = (program, tuple(args))
+
+    _tool_lock.acquire()
+
     try:
-        subprocess.Popen(command.split(' '),
-                         stdin=subprocess.PIPE,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-        return True
-    except OSError:
-        return False
+        if key in _tool_outputs:
+            return _tool_outputs[key]
 
+        if _tool_cache:
+            output = _tool_cache.get_output(program, args)
 
-def check_gnu_diff():
-    """Checks if GNU diff is installed, and informs the user if it's not."""
-    has_gnu_diff = False
+            if output is not None:
+                logging.debug('Using the cached output of %s %s'
+                              % (path, ' '.join(args)))
+                _tool_outputs[key] = output
+                return output
+    finally:
+        _tool_lock.release()
 
     try:
-        result = execute(['diff', '--version'], ignore_errors=True)
-        has_gnu_diff = 'GNU diffutils' in result
+        output = execute([path] + list(args), ignore_errors=True,
+                         none_on_ignored_error=True)
     except OSError:
-        pass
+        return None
+
+    if output is None:
+        return None
+
+    _tool_lock.acquire()
+
+    try:
+        _tool_outputs[key] = output
+
+        if _tool_cache:
+            _tool_cache.set_output(program, args, output)
+    finally:
+        _tool_lock.release()
+
+    return output
+
+
+def check_gnu_diff():
+    """Checks if GNU diff is installed, and informs the user if it's not."""
+    result = get_tool_output('diff', ['--version'])
+    has_gnu_diff = result is not None and 'GNU diffutils' in result
 
     if not has_gnu_diff:
         sys.stderr.write('\n')
@@ -54,18 +179,13 @@ def check_gnu_patch():
     """Checks if GNU patch is installed, and informs the user if it's not."""
     has_gnu_patch = False
 
-    try:
-        result = execute(['patch', '--version'], ignore_errors=True)
-        has_gnu_patch = 'Free Software Foundation' in result
-    except OSError:
-        pass
+    # SunOS has gpatch
+    for name in ('patch', 'gpatch'):
+        result = get_tool_output(name, ['--version'])
 
-    try:
-        # SunOS has gpatch
-        result = execute(['gpatch', '--version'], ignore_errors=True)
-        has_gnu_patch = 'Free Software Foundation' in result
-    except OSError:
-        pass
+        if result is not None and 'Free Software Foundation' in result:
+            has_gnu_patch = True
+            break
 
     if not has_gnu_patch:
         sys.stderr.write('\n')
@@ -1,15 +1,46 @@
+import imp
+import logging
+import marshal
 import os
 import tempfile
 import re
 
+try:
+    from hashlib import sha1
+except ImportError:
+    # Python 2.4
+    from sha import new as sha1
+
+try:
+    from json import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from simplejson import dumps as json_dumps, loads as json_loads
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
 from rbtools.utils.process import die
 
 
 TEMP_DIR = None
 CONFIG_FILE = '.reviewboardrc'
+CACHE_DIR = '.rbtools-cache'
 
 tempfiles = []
 
+# Strips the last component off a path in TREES.
+TREE_PARENT_RE = re.compile(r'[/\\][^/\\]*$')
+
+# Tables of TREES keys, by the id of the TREES dictionary.
+_tree_indexes = {}
+
 
 def cleanup_tempfiles():
     for tmpfile in tempfiles:
@@ -19,7 +50,43 @@ def cleanup_tempfiles():
             pass
 
 
+def get_home_path():
+    """Returns the path to the user's home directory."""
+    if 'APPDATA' in os.environ:
+        return os.environ['APPDATA']
+    elif 'HOME' in os.environ:
+        return os.environ["HOME"]
+    else:
+        return ''
+
+
+def get_cache_dir(name):
+    """Returns the path to a named cache directory in the user's home."""
+    return os.path.join(get_home_path(), CACHE_DIR, name)
+
+
+class ConfigList(list):
+    """
+    The configs loaded from the .reviewboardrc files of a directory and its
+    parents, nearest first.
+
+    Besides the list, which is walked in order for TREES, a merged table
+    of all settings is kept, so get_config_value is a single lookup. As
+    with the list, a setting in a nearer file overrides the same setting in
+    a farther one.
+    """
+    def __init__(self, configs=[]):
+        list.__init__(self, configs)
+        self.merged = {}
+
+        for config in reversed(self):
+            self.merged.update(config)
+
+
 def get_config_value(configs, name, default=None):
+    if isinstance(configs, ConfigList):
+        return configs.merged.get(name, default)
+
     for c in configs:
         if name in c:
             return c[name]
@@ -27,25 +94,28 @@ def get_config_value(configs, name, default=None):
     return default
 
 
-def load_config_files(homepath):
-    """Loads data from .reviewboardrc files."""
+def load_config_files(homepath, cache_dir=None):
+    """Loads data from .reviewboardrc files.
+
+    Returns the config in homepath (or None) and a ConfigList of those in
+    the current directory and its parents. If cache_dir is given, the
+    compiled files are cached there (see compile_config_file).
+    """
     def _load_config(path):
+        filename = os.path.join(path, CONFIG_FILE)
+
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+
         config = {
             'TREES': {},
         }
 
-        filename = os.path.join(path, CONFIG_FILE)
-
-        if os.path.exists(filename):
-            try:
-                execfile(filename, config)
-            except SyntaxError, e:
-                die('Syntax error in config file: %s\n'
-                    'Line %i offset %i\n' % (filename, e.lineno, e.offset))
-
-            return config
+        exec compile_config_file(filename, st, cache_dir) in config
 
-        return None
+        return config
 
     configs = []
 
@@ -55,7 +125,132 @@ def load_config_files(homepath):
         if config:
             configs.append(config)
 
-    return _load_config(homepath), configs
+    return _load_config(homepath), ConfigList(configs)
+
+
+def compile_config_file(filename, st=None, cache_dir=None):
+    """
+    Returns the compiled code of a config file.
+
+    Config files are Python, and are compiled on every run. If cache_dir is
+    given, the code is cached there, like a .pyc, and reused while the
+    file's modification time and size, and the Python version, stay the
+    same.
+    """
+    if st is None:
+        st = os.stat(filename)
+
+    header = {
+        'filename': filename,
+        'mtime': st.st_mtime,
+        'size': st.st_size,
+        'magic': imp.get_magic().encode('hex'),
+    }
+
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, sha1(filename).hexdigest())
+
+        try:
+            fp = open(cache_file, 'rb')
+
+            try:
+                if json_loads(fp.readline()) == header:
+                    return marshal.loads(fp.read())
+            finally:
+                fp.close()
+        except (IOError, ValueError, EOFError, TypeError):
+            pass
+
+    fp = open(filename, 'rU')
+
+    try:
+        source = fp.read()
+    finally:
+        fp.close()
+
+    try:
+        code = compile(source, filename, 'exec')
+    except SyntaxError, e:
+        die('Syntax error in config file: %s\n'
+            'Line %i offset %i\n' % (filename, e.lineno, e.offset))
+
+    if cache_dir:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            write_file_atomically(cache_file,
+                                  json_dumps(header) + '\n' +
+                                  marshal.dumps(code))
+        except (IOError, OSError), e:
+            logging.debug('Unable to write %s: %s' % (cache_file, e))
+
+    return code
+
+
+def find_tree(trees, paths):
+    """
+    Returns the TREES entry for a repository path, or None.
+
+    paths is a path or a list of paths for the same repository. An entry
+    for the path itself is preferred, followed by an entry for the nearest
+    parent path. Among the paths in a list, the one with the most specific
+    entry wins, and the earliest of those on a tie.
+    """
+    if not isinstance(paths, list):
+        paths = [paths]
+
+    index = _get_tree_index(trees)
+    best_key = None
+
+    for path in paths:
+        if not isinstance(path, basestring):
+            continue
+
+        path = path.rstrip('/\\')
+
+        while path:
+            if path in index:
+                if best_key is None or len(path) > len(best_key):
+                    best_key = path
+
+                break
+
+            parent = TREE_PARENT_RE.sub('', path)
+
+            if parent == path:
+                break
+
+            path = parent
+
+    if best_key is None:
+        return None
+
+    return trees[index[best_key]]
+
+
+def _get_tree_index(trees):
+    """
+    Returns a table of TREES keys, without trailing slashes, to the keys
+    themselves.
+
+    The table is built once per TREES dictionary.
+    """
+    cached = _tree_indexes.get(id(trees))
+
+    # The dictionary is kept with its table, so the id can't be reused.
+    if cached and cached[0] is trees:
+        return cached[1]
+
+    index = {}
+
+    for key in trees:
+        if isinstance(key, basestring):
+            index.setdefault(key.rstrip('/\\') or key, key)
+
+    _tree_indexes[id(trees)] = (trees, index)
+
+    return index
 
 
 def make_tempfile(content=None):
@@ -73,6 +268,79 @@ def make_tempfile(content=None):
     return tmpfile
 
 
+def write_file_atomically(filename, content):
+    """
+    Writes content to a file by way of a temporary file in the same
+    directory, which is then renamed into place. Readers never see a
+    partially written file.
+    """
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                                   prefix='.tmp')
+
+    try:
+        fp = os.fdopen(fd, 'wb')
+
+        try:
+            fp.write(content)
+        finally:
+            fp.close()
+
+        replace_file(tmpfile, filename)
+    except:
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            pass
+
+        raise
+
+
+def replace_file(src, dest):
+    """Renames src to dest, replacing dest if it exists."""
+    if os.name == 'nt' and os.path.exists(dest):
+        # Windows can't rename over an existing file.
+        os.unlink(dest)
+
+    os.rename(src, dest)
+
+
+class FileLock(object):
+    """
+    An exclusive lock on a lock file, used to serialize access to a file
+    between processes.
+
+    The lock file itself is left in place after the lock is released.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._fp = None
+
+    def acquire(self):
+        self._fp = open(self.filename, 'a')
+
+        try:
+            if fcntl:
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX)
+            elif msvcrt:
+                self._fp.seek(0)
+                msvcrt.locking(self._fp.fileno(), msvcrt.LK_LOCK, 1)
+        except:
+            self._fp.close()
+            self._fp = None
+            raise
+
+    def release(self):
+        try:
+            if fcntl:
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+            elif msvcrt:
+                self._fp.seek(0)
+                msvcrt.locking(self._fp.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._fp.close()
+            self._fp = None
+
+
 def walk_parents(path):
     """
     Walks up the tree to the root directory.
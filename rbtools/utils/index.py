@@ -0,0 +1,99 @@
+import logging
+import os
+
+try:
+    from json import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from simplejson import dumps as json_dumps, loads as json_loads
+
+from rbtools.utils.filesystem import FileLock, write_file_atomically
+
+
+class JSONIndex(object):
+    """A small persistent index of entries, stored in a JSON file.
+
+    Entries are plain dictionaries, keyed on a section name and a string
+    key, and are stored together in a JSON file in index_dir. What the
+    sections are is up to the subclass.
+
+    Changes are written while holding a lock on a neighboring lock file.
+    Under that lock, the file is read again and only this process's change
+    is applied to it, so entries written by other processes in the
+    meantime aren't lost.
+    """
+    INDEX_FILENAME = 'index.json'
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.filename = os.path.join(index_dir, self.INDEX_FILENAME)
+        self._index = None
+
+    def get(self, section, key):
+        """Returns the entry for a key, or None."""
+        return self._load().get(section, {}).get(key)
+
+    def set(self, section, key, entry):
+        """Records the entry for a key."""
+        def update(index):
+            index.setdefault(section, {})[key] = entry
+
+        self._update(update)
+
+    def clear(self, section=None):
+        """Removes the entries in a section, or in all sections."""
+        def update(index):
+            if section is None:
+                index.clear()
+            else:
+                index.pop(section, None)
+
+        self._update(update)
+
+    def _load(self):
+        if self._index is None:
+            self._index = self._read()
+
+        return self._index
+
+    def _read(self):
+        try:
+            fp = open(self.filename, 'r')
+
+            try:
+                index = json_loads(fp.read())
+            finally:
+                fp.close()
+        except (IOError, ValueError):
+            return {}
+
+        if not isinstance(index, dict):
+            return {}
+
+        return index
+
+    def _update(self, func):
+        """
+        Changes the index by calling func on it, and writes it out.
+
+        func is called on the entries currently in the file, while holding
+        the lock. If the file can't be written, the change is still made to
+        the entries in memory.
+        """
+        try:
+            if not os.path.isdir(self.index_dir):
+                os.makedirs(self.index_dir)
+
+            lock = FileLock(self.filename + '.lock')
+            lock.acquire()
+
+            try:
+                index = self._read()
+                func(index)
+                write_file_atomically(self.filename, json_dumps(index))
+            finally:
+                lock.release()
+
+            self._index = index
+        except (IOError, OSError), e:
+            logging.debug('Unable to write %s: %s' % (self.filename, e))
+            func(self._load())
@@ -2,6 +2,10 @@ import logging
 import os
 import subprocess
 import sys
+import threading
+
+
+_local = threading.local()
 
 
 def die(msg=None):
@@ -19,6 +23,73 @@ def die(msg=None):
     sys.exit(1)
 
 
+class ProcessGroup(object):
+    """
+    The child processes started by threads working on the same task.
+
+    A thread joins a group with set_process_group(). The processes it starts
+    through execute() are then tracked by the group, so the task can be
+    abandoned: kill() kills the processes that are running, and any that
+    are started afterward. Commands killed this way never cause die() to be
+    called.
+    """
+    def __init__(self):
+        self.killed = False
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def add(self, p):
+        self._lock.acquire()
+
+        try:
+            if not self.killed:
+                self._processes.add(p)
+                return
+        finally:
+            self._lock.release()
+
+        self._kill_process(p)
+
+    def remove(self, p):
+        self._lock.acquire()
+
+        try:
+            self._processes.discard(p)
+        finally:
+            self._lock.release()
+
+    def kill(self):
+        """Kills the group's processes."""
+        self._lock.acquire()
+
+        try:
+            self.killed = True
+            processes = list(self._processes)
+            self._processes.clear()
+        finally:
+            self._lock.release()
+
+        for p in processes:
+            self._kill_process(p)
+
+    def _kill_process(self, p):
+        try:
+            p.kill()
+        except OSError:
+            # It has already exited.
+            pass
+
+
+def get_process_group():
+    """Returns the ProcessGroup of the current thread, or None."""
+    return getattr(_local, 'process_group', None)
+
+
+def set_process_group(group):
+    """Sets the ProcessGroup that tracks the current thread's processes."""
+    _local.process_group = group
+
+
 def execute(command,
             env=None,
             split_lines=False,
@@ -26,9 +97,12 @@ def execute(command,
             extra_ignore_errors=(),
             translate_newlines=True,
             with_errors=True,
-            none_on_ignored_error=False):
+            none_on_ignored_error=False,
+            cwd=None):
     """
     Utility function to execute a command and return the output.
+
+    If cwd is given, the command is run in that directory.
     """
     if isinstance(command, list):
         logging.debug('Running: ' + subprocess.list2cmdline(command))
@@ -55,7 +129,8 @@ def execute(command,
                              stderr=errors_output,
                              shell=False,
                              universal_newlines=translate_newlines,
-                             env=env)
+                             env=env,
+                             cwd=cwd)
     else:
         p = subprocess.Popen(command,
                              stdin=subprocess.PIPE,
@@ -64,15 +139,29 @@ def execute(command,
                              shell=False,
                              close_fds=True,
                              universal_newlines=translate_newlines,
-                             env=env)
-    if split_lines:
-        data = p.stdout.readlines()
-    else:
-        data = p.stdout.read()
+                             env=env,
+                             cwd=cwd)
+
+    group = get_process_group()
+
+    if group:
+        group.add(p)
+
+    try:
+        if split_lines:
+            data = p.stdout.readlines()
+        else:
+            data = p.stdout.read()
 
-    rc = p.wait()
+        rc = p.wait()
+    finally:
+        if group:
+            group.remove(p)
 
-    if rc and not ignore_errors and rc not in extra_ignore_errors:
+    if group and group.killed:
+        # The result isn't wanted anymore.
+        logging.debug('Command was killed: %s' % (command,))
+    elif rc and not ignore_errors and rc not in extra_ignore_errors:
         die('Failed to execute command: %s\n%s' % (command, data))
     elif rc:
         logging.debug('Command exited with rc %s: %s\n%s---'
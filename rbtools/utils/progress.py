@@ -0,0 +1,175 @@
+import sys
+import time
+
+
+def format_size(size):
+    """Returns a byte count as a short, human-readable string."""
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+
+        size /= 1024.0
+
+    if unit == 'bytes':
+        return '%d bytes' % size
+
+    return '%.1f %s' % (size, unit)
+
+
+def format_duration(seconds):
+    """Returns a number of seconds as H:MM:SS or M:SS."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+    return '%d:%02d' % (minutes, seconds)
+
+
+class UploadProgress(object):
+    """Reports the progress of an upload.
+
+    On a terminal, a status line with the bytes sent, the rate and the
+    estimated time left is redrawn at most every UPDATE_INTERVAL seconds.
+    Otherwise, nothing is shown until the upload finishes.
+
+    Either way, finish() prints the amount sent, the time taken and the
+    throughput once the upload succeeds. If it fails, abort() replaces the
+    status line instead.
+    """
+    UPDATE_INTERVAL = 0.2
+
+    def __init__(self, label, size, stream=None, interactive=None):
+        self.label = label
+        self.size = size
+        self.stream = stream or sys.stderr
+
+        if interactive is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            interactive = isatty is not None and isatty()
+
+        self.interactive = interactive
+        self.restart()
+
+    def restart(self):
+        """Starts counting from the beginning, such as for a retry."""
+        self.sent = 0
+        self.start_time = None
+        self.end_time = None
+        self._last_update = 0
+
+    def update(self, sent):
+        """Records that sent bytes in total have been sent so far."""
+        now = time.time()
+
+        if self.start_time is None:
+            self.start_time = now
+
+        self.sent = sent
+
+        if sent >= self.size and self.end_time is None:
+            self.end_time = now
+
+        if (self.interactive and
+            (now - self._last_update >= self.UPDATE_INTERVAL or
+             sent >= self.size)):
+            self._last_update = now
+            self._write('\r%s\033[K' % self.get_status())
+
+    def get_status(self):
+        """Returns a line describing the progress so far."""
+        elapsed = self._get_elapsed()
+
+        if self.size:
+            percent = 100 * self.sent / self.size
+        else:
+            percent = 100
+
+        status = '%s: %s of %s (%d%%)' % (
+            self.label, format_size(self.sent), format_size(self.size),
+            percent)
+
+        if elapsed > 0 and self.sent:
+            rate = self.sent / elapsed
+            status += ', %s/s' % format_size(rate)
+
+            if self.sent < self.size:
+                status += ', %s left' % format_duration(
+                    (self.size - self.sent) / rate)
+
+        return status
+
+    def get_throughput(self):
+        """Returns the average bytes per second sent, or None if unknown."""
+        elapsed = self._get_elapsed()
+
+        if elapsed > 0:
+            return self.sent / elapsed
+
+        return None
+
+    def finish(self):
+        """Prints the final figures for the upload."""
+        elapsed = self._get_elapsed()
+        throughput = self.get_throughput()
+        summary = '%s: sent %s in %.1f seconds' % (
+            self.label, format_size(self.sent), elapsed)
+
+        if throughput is not None:
+            summary += ' (%s/s)' % format_size(throughput)
+
+        if self.interactive:
+            summary = '\r' + summary + '\033[K'
+
+        self._write(summary + '\n')
+
+    def abort(self):
+        """Reports that the upload failed, if any progress was shown."""
+        if self.interactive:
+            self._write('\r%s: aborted after %s of %s\033[K\n' % (
+                self.label, format_size(self.sent), format_size(self.size)))
+
+    def _get_elapsed(self):
+        if self.start_time is None:
+            return 0
+
+        return (self.end_time or time.time()) - self.start_time
+
+    def _write(self, s):
+        self.stream.write(s)
+        self.stream.flush()
+
+
+class ProgressFile(object):
+    """A file-like request body that reports how much of it has been read.
+
+    httplib sends file-like bodies by reading them in blocks, so the amount
+    read is the amount handed to the socket. Rewinding the body (for a
+    retry) restarts the progress.
+    """
+    def __init__(self, fp, progress):
+        self.fp = fp
+        self.progress = progress
+        self._read = 0
+
+    def __len__(self):
+        return self.progress.size
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self._read += len(data)
+        self.progress.update(self._read)
+
+        return data
+
+    def seek(self, offset, whence=0):
+        self.fp.seek(offset, whence)
+        self._read = self.fp.tell()
+        self.progress.restart()
+
+    def tell(self):
+        return self.fp.tell()
+
+    def close(self):
+        self.fp.close()
@@ -3,9 +3,18 @@
 Any new modules created under rbtools/api should be tested here."""
 import os
 import re
+import shutil
 import sys
+import threading
+import time
 
-from rbtools.utils import checks, filesystem, process
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from rbtools.utils import checks, filesystem, process, progress, version, \
+                          workers
 from rbtools.utils.testbase import RBTestBase
 
 
@@ -15,6 +24,159 @@ class UtilitiesTest(RBTestBase):
         self.assertTrue(checks.check_install(sys.executable + ' --version'))
         self.assertFalse(checks.check_install(self.gen_uuid()))
 
+    def test_find_executable(self):
+        """Test 'find_executable' looking up programs in the search path."""
+        self.assertEqual(checks.find_executable(sys.executable),
+                         os.path.abspath(sys.executable))
+        self.assertEqual(checks.find_executable(self.gen_uuid()), None)
+
+    def test_get_tool_output(self):
+        """Test 'get_tool_output' caching the output until the tool changes."""
+        tool_dir = self.create_tmp_dir()
+        tool = os.path.join(tool_dir, 'tool')
+        runs = os.path.join(tool_dir, 'runs')
+        fp = open(tool, 'w')
+        fp.write('#!/bin/sh\necho run >> %s\necho Tool 1.0\n' % runs)
+        fp.close()
+        os.chmod(tool, 0755)
+
+        def count_runs():
+            fp = open(runs, 'r')
+
+            try:
+                return len(fp.readlines())
+            finally:
+                fp.close()
+
+        cache = checks.ToolCache(os.path.join(tool_dir, 'cache'))
+        checks.set_tool_cache(cache)
+
+        try:
+            self.assertEqual(checks.get_tool_output(tool, ['--version']),
+                             'Tool 1.0\n')
+            self.assertEqual(count_runs(), 1)
+
+            # A new process only has the persistent cache to go on.
+            checks._tool_outputs.clear()
+            self.assertEqual(checks.get_tool_output(tool, ['--version']),
+                             'Tool 1.0\n')
+            self.assertEqual(count_runs(), 1)
+
+            checks._tool_outputs.clear()
+            os.utime(tool, (0, 0))
+            checks.get_tool_output(tool, ['--version'])
+            self.assertEqual(count_runs(), 2)
+
+            self.assertEqual(checks.get_tool_output(self.gen_uuid(), []),
+                             None)
+        finally:
+            checks.set_tool_cache(None)
+            checks._tool_outputs.clear()
+            shutil.rmtree(tool_dir)
+
+    def test_get_tool_output_program(self):
+        """Test 'get_tool_output' caching on the program that runs."""
+        tool_dir = self.create_tmp_dir()
+        tool = os.path.join(tool_dir, 'tool')
+        helper = os.path.join(tool_dir, 'tool-helper')
+        fp = open(tool, 'w')
+        fp.write('#!/bin/sh\nexec %s "$@"\n' % helper)
+        fp.close()
+        os.chmod(tool, 0755)
+
+        cache = checks.ToolCache(os.path.join(tool_dir, 'cache'))
+        checks.set_tool_cache(cache)
+
+        try:
+            # Failures aren't cached.
+            self.assertEqual(checks.get_tool_output(tool, ['--version'],
+                                                    program=helper),
+                             None)
+
+            fp = open(helper, 'w')
+            fp.write('#!/bin/sh\necho Helper 1.0\n')
+            fp.close()
+            os.chmod(helper, 0755)
+            self.assertEqual(checks.get_tool_output(tool, ['--version'],
+                                                    program=helper),
+                             'Helper 1.0\n')
+
+            # Replacing the program, but not the tool, runs it again.
+            fp = open(helper, 'w')
+            fp.write('#!/bin/sh\necho Helper 2.0\n')
+            fp.close()
+            os.utime(helper, (0, 0))
+            checks._tool_outputs.clear()
+            self.assertEqual(checks.get_tool_output(tool, ['--version'],
+                                                    program=helper),
+                             'Helper 2.0\n')
+        finally:
+            checks.set_tool_cache(None)
+            checks._tool_outputs.clear()
+            shutil.rmtree(tool_dir)
+
+    def test_parse_version(self):
+        """Test 'parse_version' ordering versions."""
+        versions = ['1.0', '1.5.2', '1.5.3.1', '1.6alpha1', '1.6beta2',
+                    '1.6rc1', '1.6', '1.6.1', '1.7dev', '1.7', '10.0']
+
+        self.assertEqual(sorted(reversed(versions), key=version.parse_version),
+                         versions)
+        self.assertEqual(version.parse_version('1.6'),
+                         version.parse_version('1.6.0'))
+
+    def test_load_config_files(self):
+        """Test 'load_config_files' merging and caching config files."""
+        top_dir = self.chdir_tmp()
+        cache_dir = os.path.join(top_dir, 'cache')
+        sub_dir = os.path.join(top_dir, 'sub')
+        os.mkdir(sub_dir)
+
+        def write_config(path, content):
+            fp = open(os.path.join(path, filesystem.CONFIG_FILE), 'w')
+            fp.write(content)
+            fp.close()
+
+        write_config(top_dir, 'A = "top"\nB = "top"\n')
+        write_config(sub_dir, 'A = "sub"\n')
+        os.chdir(sub_dir)
+
+        configs = filesystem.load_config_files(top_dir, cache_dir)[1]
+        self.assertEqual(len(configs), 2)
+        self.assertEqual(filesystem.get_config_value(configs, 'A'), 'sub')
+        self.assertEqual(filesystem.get_config_value(configs, 'B'), 'top')
+        self.assertEqual(filesystem.get_config_value(configs, 'C', 1), 1)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        # Cached code is only used while the file is unchanged.
+        write_config(sub_dir, 'A = "changed"\n')
+        os.utime(os.path.join(sub_dir, filesystem.CONFIG_FILE), (0, 0))
+        configs = filesystem.load_config_files(top_dir, cache_dir)[1]
+        self.assertEqual(filesystem.get_config_value(configs, 'A'),
+                         'changed')
+
+    def test_find_tree(self):
+        """Test 'find_tree' matching the nearest TREES entry."""
+        trees = {
+            'http://svn.example.com/repo/': {'name': 'repo'},
+            'http://svn.example.com/repo/project': {'name': 'project'},
+            'perforce:1666': {'name': 'perforce'},
+        }
+
+        self.assertEqual(
+            filesystem.find_tree(trees, 'http://svn.example.com/repo'),
+            {'name': 'repo'})
+        self.assertEqual(
+            filesystem.find_tree(trees,
+                                 'http://svn.example.com/repo/project/sub'),
+            {'name': 'project'})
+        self.assertEqual(
+            filesystem.find_tree(trees, ['other:1666', 'perforce:1666']),
+            {'name': 'perforce'})
+        self.assertEqual(
+            filesystem.find_tree(trees, 'http://svn.example.com/repo2'),
+            None)
+
     def test_make_tempfile(self):
         """Test 'make_tempfile' method."""
         fname = filesystem.make_tempfile()
@@ -31,3 +193,147 @@ class UtilitiesTest(RBTestBase):
     def test_die(self):
         """Test 'die' method."""
         self.assertRaises(SystemExit, process.die)
+
+
+class WorkersTest(RBTestBase):
+    def test_imap_ordered(self):
+        """Test 'imap_ordered' returning results in order."""
+        def func(i):
+            # Make the earlier items finish last.
+            time.sleep((10 - i) * 0.01)
+            return i * 2
+
+        self.assertEqual(list(workers.imap_ordered(func, range(10))),
+                         [(i, i * 2) for i in range(10)])
+
+    def test_imap_ordered_bounded(self):
+        """Test 'imap_ordered' limiting concurrent calls."""
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def func(i):
+            lock.acquire()
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            lock.release()
+
+            time.sleep(0.01)
+
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+
+        list(workers.imap_ordered(func, range(20), max_workers=3))
+        self.assertTrue(1 < max_running[0] <= 3)
+
+    def test_imap_ordered_early_exit(self):
+        """Test 'imap_ordered' not consuming items after being closed."""
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        results = workers.imap_ordered(lambda i: i, items(), max_workers=4)
+        self.assertEqual(results.next(), (0, 0))
+        results.close()
+
+        self.assertTrue(len(consumed) <= 5)
+
+    def test_imap_ordered_exception(self):
+        """Test 'imap_ordered' raising exceptions from the workers."""
+        def func(i):
+            if i == 3:
+                raise ValueError(i)
+
+            return i
+
+        results = workers.imap_ordered(func, range(10))
+
+        for i in range(3):
+            self.assertEqual(results.next(), (i, i))
+
+        self.assertRaises(ValueError, results.next)
+
+    def test_imap_ordered_die(self):
+        """Test 'imap_ordered' raising SystemExit from workers that die."""
+        def func(i):
+            if i == 3:
+                process.die()
+
+            return i
+
+        def consume():
+            try:
+                list(workers.imap_ordered(func, range(10)))
+            except SystemExit:
+                raised.append(True)
+
+        # Workers that didn't report SystemExit left imap_ordered waiting
+        # forever, so consume the results in a thread that can be given up
+        # on.
+        raised = []
+        thread = threading.Thread(target=consume)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(10)
+
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(raised, [True])
+
+
+class ProgressTest(RBTestBase):
+    def test_format_size(self):
+        """Test 'format_size' method."""
+        self.assertEqual(progress.format_size(100), '100 bytes')
+        self.assertEqual(progress.format_size(1536), '1.5 KB')
+        self.assertEqual(progress.format_size(5 * 1024 * 1024), '5.0 MB')
+
+    def test_format_duration(self):
+        """Test 'format_duration' method."""
+        self.assertEqual(progress.format_duration(65), '1:05')
+        self.assertEqual(progress.format_duration(3725), '1:02:05')
+
+    def test_upload_progress(self):
+        """Test 'UploadProgress' and 'ProgressFile' reporting reads."""
+        stream = StringIO()
+        upload_progress = progress.UploadProgress('Uploading', 10, stream,
+                                                  interactive=False)
+        fp = progress.ProgressFile(StringIO('x' * 10), upload_progress)
+
+        self.assertEqual(fp.read(4), 'xxxx')
+        self.assertEqual(upload_progress.sent, 4)
+        self.assertEqual(upload_progress.end_time, None)
+
+        # Rewinding for a retry starts over.
+        fp.seek(0)
+        self.assertEqual(upload_progress.sent, 0)
+        self.assertEqual(fp.read(), 'x' * 10)
+        self.assertEqual(upload_progress.sent, 10)
+        self.assertNotEqual(upload_progress.end_time, None)
+
+        # Nothing is shown until the upload is done.
+        self.assertEqual(stream.getvalue(), '')
+        upload_progress.finish()
+        self.assertTrue(stream.getvalue().startswith(
+            'Uploading: sent 10 bytes in '))
+
+    def test_upload_progress_abort(self):
+        """Test 'UploadProgress.abort' replacing the status line."""
+        stream = StringIO()
+        upload_progress = progress.UploadProgress('Uploading', 10, stream,
+                                                  interactive=True)
+        upload_progress.update(4)
+        upload_progress.abort()
+        self.assertTrue(stream.getvalue().endswith(
+            '\rUploading: aborted after 4 bytes of 10 bytes\033[K\n'))
+
+        # Without a status line, there's nothing to replace.
+        stream = StringIO()
+        upload_progress = progress.UploadProgress('Uploading', 10, stream,
+                                                  interactive=False)
+        upload_progress.update(4)
+        upload_progress.abort()
+        self.assertEqual(stream.getvalue(), '')
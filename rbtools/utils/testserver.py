@@ -0,0 +1,846 @@
+"""A stand-in Review Board server for tests and benchmarks.
+
+This implements the subset of the Review Board web API that post-review
+uses, on top of the standard library's HTTP server, so that post-review
+can be run end to end on localhost without a real server. It speaks
+HTTP/1.1 with persistent connections, Expect: 100-continue, gzip and
+ETags, so transport behavior can be measured, and it can add latency and
+limit bandwidth to mimic a remote server.
+
+It can also be run on its own:
+
+    python -m rbtools.utils.testserver --port 8080 --latency 0.05
+"""
+import base64
+import cgi
+import gzip
+import re
+import socket
+import sys
+import threading
+import time
+import urllib
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from optparse import OptionParser
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+try:
+    from hashlib import md5
+except ImportError:
+    # Python 2.4
+    from md5 import new as md5
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from rbtools.api.compression import gunzip
+
+
+# Review Board API error codes, along with their HTTP status codes.
+DOES_NOT_EXIST = (100, 404, 'Object does not exist')
+PERMISSION_DENIED = (101, 403, 'You don\'t have permission for this')
+NOT_LOGGED_IN = (103, 401, 'You are not logged in')
+INVALID_FORM_DATA = (105, 400, 'One or more fields had errors')
+CHANGE_NUMBER_IN_USE = (204, 409, 'The change number is already in use')
+INVALID_REPOSITORY = (206, 400, 'The repository path specified is not in '
+                                'the list of known repositories')
+REPO_INFO_ERROR = (210, 500, 'There was an error fetching extended '
+                             'information for this repository')
+
+CHUNK_SIZE = 16 * 1024
+
+
+class APIFailure(Exception):
+    def __init__(self, error, rsp=None):
+        Exception.__init__(self, error[2])
+        self.error = error
+        self.rsp = rsp or {}
+
+
+class FakeReviewBoardRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer responses, so that the status line and headers go out along
+    # with the body instead of as many small writes. Those would stall on
+    # delayed ACKs on reused connections, and skew transport measurements.
+    # BaseHTTPRequestHandler flushes once each request is handled.
+    wbufsize = -1
+
+    ROUTES = [
+        (re.compile(r'^/api/$'), 'root'),
+        (re.compile(r'^/api/info/$'), 'info'),
+        (re.compile(r'^/api/repositories/$'), 'repositories'),
+        (re.compile(r'^/api/repositories/(\d+)/$'), 'repository'),
+        (re.compile(r'^/api/repositories/(\d+)/info/$'), 'repository_info'),
+        (re.compile(r'^/api/review-requests/$'), 'review_requests'),
+        (re.compile(r'^/api/review-requests/(\d+)/$'), 'review_request'),
+        (re.compile(r'^/api/review-requests/(\d+)/draft/$'), 'draft'),
+        (re.compile(r'^/api/review-requests/(\d+)/diffs/$'), 'diffs'),
+    ]
+
+    # Resources that can be read without logging in.
+    ANONYMOUS_ROUTES = ('root', 'info')
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.add_connection(self.connection)
+
+    def finish(self):
+        BaseHTTPRequestHandler.finish(self)
+        self.server.remove_connection(self.connection)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _handle(self):
+        server = self.server
+        server.count('requests')
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        path, query = urllib.splitquery(self.path)
+        self.query = cgi.parse_qs(query or '')
+        self.set_cookie = None
+
+        for regex, name in self.ROUTES:
+            m = regex.match(path)
+
+            if m:
+                break
+        else:
+            self._discard_body()
+            self._send_error(DOES_NOT_EXIST)
+            return
+
+        func = getattr(self, '%s_%s' % (self.command.lower(), name), None)
+
+        if func is None:
+            self._discard_body()
+            self._send_json(405, {
+                'stat': 'fail',
+                'err': {
+                    'code': 0,
+                    'msg': 'Method not allowed',
+                },
+            })
+            return
+
+        if name not in self.ANONYMOUS_ROUTES and not self._check_login():
+            # Reject the request without reading the body. If the client
+            # didn't wait for a 100 Continue, the connection is unusable.
+            self.close_connection = 1
+            self._send_error(NOT_LOGGED_IN, headers={
+                'WWW-Authenticate': 'Basic realm="Web API"',
+                'Connection': 'close',
+            })
+            return
+
+        try:
+            self.body = self._read_body()
+            server.lock.acquire()
+
+            try:
+                status, rsp = func(*m.groups())
+            finally:
+                server.lock.release()
+        except APIFailure, e:
+            self._send_error(e.error, e.rsp)
+            return
+
+        rsp['stat'] = 'ok'
+        self._send_json(status, rsp)
+
+    #
+    # Authentication
+    #
+
+    def _check_login(self):
+        server = self.server
+
+        if not server.users:
+            return True
+
+        for cookie in self.headers.getheaders('Cookie'):
+            for part in cookie.split(';'):
+                name, value = (part.strip().split('=', 1) + [''])[:2]
+
+                if name == 'rbsessionid' and value in server.sessions:
+                    return True
+
+        auth = self.headers.get('Authorization', '')
+
+        if auth.startswith('Basic '):
+            try:
+                username, password = \
+                    base64.b64decode(auth[6:]).split(':', 1)
+            except (TypeError, ValueError):
+                return False
+
+            if server.users.get(username) == password:
+                session_id = uuid.uuid4().hex
+                server.sessions[session_id] = username
+                # Like Review Board's, sessions last two weeks, so the
+                # cookie is saved between runs.
+                expires = time.strftime('%a, %d-%b-%Y %H:%M:%S GMT',
+                                        time.gmtime(time.time() +
+                                                    14 * 24 * 60 * 60))
+                self.set_cookie = 'rbsessionid=%s; Path=/; Expires=%s' % \
+                                  (session_id, expires)
+                server.count('logins')
+                return True
+
+        return False
+
+    #
+    # Transport
+    #
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+
+        if not length:
+            return ''
+
+        if self.headers.get('Expect', '').lower() == '100-continue':
+            self.wfile.write('HTTP/1.1 100 Continue\r\n\r\n')
+            self.wfile.flush()
+
+        chunks = []
+
+        while length > 0:
+            chunk = self.rfile.read(min(length, CHUNK_SIZE))
+
+            if not chunk:
+                break
+
+            chunks.append(chunk)
+            length -= len(chunk)
+            self._throttle(len(chunk))
+
+        body = ''.join(chunks)
+        self.server.count('bytes_received', len(body))
+
+        if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+            body = gunzip(body)
+
+        return body
+
+    def _discard_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+
+        if length and self.headers.get('Expect', '') != '100-continue':
+            self.rfile.read(length)
+
+    def _send_json(self, status, rsp, headers={}):
+        body = json.dumps(rsp)
+        etag = '"%s"' % md5(body).hexdigest()
+        headers = dict(headers)
+
+        if self.command == 'GET' and status == 200:
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            headers['ETag'] = etag
+
+        if ('gzip' in self.headers.get('Accept-Encoding', '') and
+            self.server.gzip_responses):
+            buf = StringIO()
+            gz = gzip.GzipFile(mode='wb', fileobj=buf)
+            gz.write(body)
+            gz.close()
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+
+        if self.set_cookie:
+            self.send_header('Set-Cookie', self.set_cookie)
+
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+
+        self.end_headers()
+
+        for i in xrange(0, len(body), CHUNK_SIZE):
+            chunk = body[i:i + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            self._throttle(len(chunk))
+
+        self.server.count('bytes_sent', len(body))
+
+    def _send_error(self, error, rsp=None, headers={}):
+        code, http_status, msg = error
+        rsp = dict(rsp or {})
+        rsp.update({
+            'stat': 'fail',
+            'err': {
+                'code': code,
+                'msg': msg,
+            },
+        })
+        self._send_json(http_status, rsp, headers)
+
+    def _throttle(self, size):
+        if self.server.bandwidth:
+            time.sleep(float(size) / self.server.bandwidth)
+
+    #
+    # Helpers
+    #
+
+    def _url(self, path):
+        return '%s%s' % (self.server.url, path)
+
+    def _paginate(self, items, key, path):
+        start = int(self.query.get('start', [0])[0])
+        max_results = int(self.query.get('max-results',
+                                         [self.server.page_size])[0])
+        rsp = {
+            key: items[start:start + max_results],
+            'total_results': len(items),
+            'links': {},
+        }
+
+        args = dict([(name, values[0])
+                     for name, values in self.query.iteritems()])
+
+        if start + max_results < len(items):
+            args.update({
+                'start': start + max_results,
+                'max-results': max_results,
+            })
+            rsp['links']['next'] = {
+                'href': self._url(path + '?' +
+                                  urllib.urlencode(sorted(args.items()))),
+            }
+
+        if start > 0:
+            args.update({
+                'start': max(0, start - max_results),
+                'max-results': max_results,
+            })
+            rsp['links']['prev'] = {
+                'href': self._url(path + '?' +
+                                  urllib.urlencode(sorted(args.items()))),
+            }
+
+        return rsp
+
+    def _get_review_request(self, review_request_id):
+        try:
+            return self.server.review_requests[int(review_request_id)]
+        except KeyError:
+            raise APIFailure(DOES_NOT_EXIST)
+
+    def _get_repository(self, repository_id):
+        try:
+            return self.server.repositories[int(repository_id) - 1]
+        except IndexError:
+            raise APIFailure(DOES_NOT_EXIST)
+
+    def _parse_form(self):
+        content_type = self.headers.get('Content-Type', '')
+
+        if content_type.startswith('multipart/form-data'):
+            form = cgi.FieldStorage(
+                fp=StringIO(self.body),
+                headers={
+                    'content-type': content_type,
+                    'content-length': str(len(self.body)),
+                },
+                environ={
+                    'REQUEST_METHOD': 'POST',
+                })
+        else:
+            form = cgi.FieldStorage(
+                fp=StringIO(self.body),
+                environ={
+                    'REQUEST_METHOD': 'POST',
+                    'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                    'CONTENT_LENGTH': str(len(self.body)),
+                })
+
+        fields = {}
+        files = {}
+
+        for name in form.keys():
+            item = form[name]
+
+            if item.filename:
+                content = item.value
+
+                if item.filename.endswith('.gz'):
+                    content = gunzip(content)
+
+                files[name] = content
+            else:
+                fields[name] = item.value
+
+        return fields, files
+
+    #
+    # Resources
+    #
+
+    def get_root(self):
+        return 200, {
+            'links': {
+                'info': {
+                    'href': self._url('/api/info/'),
+                    'method': 'GET',
+                },
+                'repositories': {
+                    'href': self._url('/api/repositories/'),
+                    'method': 'GET',
+                },
+                'review_requests': {
+                    'href': self._url('/api/review-requests/'),
+                    'method': 'GET',
+                },
+                'self': {
+                    'href': self._url('/api/'),
+                    'method': 'GET',
+                },
+            },
+        }
+
+    def get_info(self):
+        return 200, {
+            'info': {
+                'product': {
+                    'name': 'Review Board',
+                    'package_version': self.server.package_version,
+                },
+            },
+        }
+
+    def get_repositories(self):
+        repositories = self.server.repositories
+
+        for name, field in (('tool', 'tool'), ('path', 'path')):
+            if name in self.query:
+                values = self.query[name][0].split(',')
+                repositories = [repository for repository in repositories
+                                if repository[field] in values]
+
+        return 200, self._paginate(
+            [self._serialize_repository(repository)
+             for repository in repositories],
+            'repositories', '/api/repositories/')
+
+    def get_repository(self, repository_id):
+        return 200, {
+            'repository': self._serialize_repository(
+                self._get_repository(repository_id)),
+        }
+
+    def get_repository_info(self, repository_id):
+        repository = self._get_repository(repository_id)
+
+        if not repository.get('uuid'):
+            raise APIFailure(REPO_INFO_ERROR)
+
+        return 200, {
+            'info': {
+                'uuid': repository['uuid'],
+                'url': repository['path'],
+                'root_url': repository.get('root_url', repository['path']),
+                'repopath': repository['path'],
+            },
+        }
+
+    def _serialize_repository(self, repository):
+        href = self._url('/api/repositories/%d/' % repository['id'])
+
+        return {
+            'id': repository['id'],
+            'name': repository['name'],
+            'path': repository['path'],
+            'tool': repository['tool'],
+            'links': {
+                'self': {
+                    'href': href,
+                    'method': 'GET',
+                },
+                'info': {
+                    'href': href + 'info/',
+                    'method': 'GET',
+                },
+            },
+        }
+
+    def get_review_requests(self):
+        return 200, self._paginate(
+            [self._serialize_review_request(review_request)
+             for review_request in self.server.review_requests.values()],
+            'review_requests', '/api/review-requests/')
+
+    def post_review_requests(self):
+        server = self.server
+        fields, files = self._parse_form()
+        repository_path = fields.get('repository')
+
+        for repository in server.repositories:
+            if repository_path in (repository['path'], repository['name'],
+                                   str(repository['id'])):
+                break
+        else:
+            raise APIFailure(INVALID_REPOSITORY)
+
+        changenum = fields.get('changenum')
+
+        if changenum:
+            for review_request in server.review_requests.itervalues():
+                if review_request['changenum'] == changenum:
+                    raise APIFailure(CHANGE_NUMBER_IN_USE, {
+                        'review_request':
+                            self._serialize_review_request(review_request),
+                    })
+
+        review_request_id = len(server.review_requests) + 1
+        review_request = {
+            'id': review_request_id,
+            'status': 'pending',
+            'public': False,
+            'changenum': changenum,
+            'repository': repository['id'],
+            'submitter': fields.get('submit_as'),
+            'summary': '',
+            'description': '',
+            'testing_done': '',
+            'branch': '',
+            'bugs_closed': [],
+            'target_groups': [],
+            'target_people': [],
+            'draft': {},
+            'diffs': [],
+        }
+        server.review_requests[review_request_id] = review_request
+
+        return 201, {
+            'review_request': self._serialize_review_request(review_request),
+        }
+
+    def get_review_request(self, review_request_id):
+        return 200, {
+            'review_request': self._serialize_review_request(
+                self._get_review_request(review_request_id)),
+        }
+
+    def put_review_request(self, review_request_id):
+        review_request = self._get_review_request(review_request_id)
+        fields, files = self._parse_form()
+
+        if 'status' in fields:
+            review_request['status'] = fields['status']
+
+        return 200, {
+            'review_request': self._serialize_review_request(review_request),
+        }
+
+    def _serialize_review_request(self, review_request):
+        href = self._url('/api/review-requests/%d/' % review_request['id'])
+        data = dict([(key, value)
+                     for key, value in review_request.iteritems()
+                     if key not in ('draft', 'diffs')])
+        data['links'] = {
+            'self': {
+                'href': href,
+                'method': 'GET',
+            },
+            'draft': {
+                'href': href + 'draft/',
+                'method': 'GET',
+            },
+            'diffs': {
+                'href': href + 'diffs/',
+                'method': 'GET',
+            },
+        }
+
+        return data
+
+    def get_draft(self, review_request_id):
+        review_request = self._get_review_request(review_request_id)
+
+        return 200, {
+            'draft': review_request['draft'],
+        }
+
+    def put_draft(self, review_request_id):
+        review_request = self._get_review_request(review_request_id)
+        fields, files = self._parse_form()
+        public = fields.pop('public', None)
+        review_request['draft'].update(fields)
+
+        if public in ('1', 'true', 'True'):
+            for name, value in review_request['draft'].iteritems():
+                if name in ('bugs_closed', 'target_groups', 'target_people'):
+                    value = [item.strip() for item in value.split(',')
+                             if item.strip()]
+
+                if name in review_request:
+                    review_request[name] = value
+
+            review_request['draft'] = {}
+            review_request['public'] = True
+            self.server.count('publishes')
+
+        return 200, {
+            'draft': review_request['draft'],
+        }
+
+    def get_diffs(self, review_request_id):
+        review_request = self._get_review_request(review_request_id)
+
+        return 200, self._paginate(
+            [self._serialize_diff(review_request, diff)
+             for diff in review_request['diffs']],
+            'diffs', '/api/review-requests/%s/diffs/' % review_request_id)
+
+    def post_diffs(self, review_request_id):
+        review_request = self._get_review_request(review_request_id)
+        fields, files = self._parse_form()
+
+        if not files.get('path'):
+            raise APIFailure(INVALID_FORM_DATA, {
+                'fields': {
+                    'path': ['The diff file is empty'],
+                },
+            })
+
+        diff = {
+            'revision': len(review_request['diffs']) + 1,
+            'basedir': fields.get('basedir'),
+            'diff': files['path'],
+            'parent_diff': files.get('parent_diff_path'),
+        }
+        review_request['diffs'].append(diff)
+        self.server.count('diffs_uploaded')
+
+        return 201, {
+            'diff': self._serialize_diff(review_request, diff),
+        }
+
+    def _serialize_diff(self, review_request, diff):
+        return {
+            'id': diff['revision'],
+            'revision': diff['revision'],
+            'links': {
+                'self': {
+                    'href': self._url('/api/review-requests/%d/diffs/%d/'
+                                      % (review_request['id'],
+                                         diff['revision'])),
+                    'method': 'GET',
+                },
+            },
+        }
+
+
+class FakeReviewBoardServer(ThreadingMixIn, HTTPServer):
+    """A stand-in Review Board server.
+
+    repositories is a list of dictionaries with name, path and tool keys,
+    and optionally uuid (needed for the repository's info resource) and
+    root_url. If not given, repository_count Subversion repositories are
+    made up.
+
+    If users (a dictionary of usernames to passwords) is given, every
+    resource but the API root and server info requires logging in with
+    HTTP Basic auth or a session cookie.
+
+    latency is the number of seconds added to every request, and bandwidth
+    is the number of bytes per second request and response bodies are
+    limited to.
+
+    The stats dictionary counts the requests, connections, logins,
+    publishes, uploaded diffs and bytes transferred.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), repositories=None,
+                 repository_count=3, users=None, latency=0, bandwidth=None,
+                 page_size=25, package_version='1.6', gzip_responses=True,
+                 verbose=False):
+        HTTPServer.__init__(self, address, FakeReviewBoardRequestHandler)
+
+        if repositories is None:
+            repositories = [
+                {
+                    'name': 'Repository %d' % i,
+                    'path': 'svn://svn.example.com/repo%d' % i,
+                    'tool': 'Subversion',
+                    'uuid': str(uuid.uuid5(uuid.NAMESPACE_URL, str(i))),
+                }
+                for i in xrange(1, repository_count + 1)
+            ]
+
+        self.repositories = []
+
+        for i, repository in enumerate(repositories):
+            repository = dict(repository)
+            repository['id'] = i + 1
+            self.repositories.append(repository)
+
+        self.users = users or {}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.page_size = page_size
+        self.package_version = package_version
+        self.gzip_responses = gzip_responses
+        self.verbose = verbose
+        self.url = 'http://%s:%d' % self.server_address
+        self.review_requests = {}
+        self.sessions = {}
+        self.lock = threading.RLock()
+        self._connections = set()
+        self._thread = None
+        self._stopping = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            'requests': 0,
+            'connections': 0,
+            'logins': 0,
+            'publishes': 0,
+            'diffs_uploaded': 0,
+            'bytes_received': 0,
+            'bytes_sent': 0,
+        }
+
+    def count(self, name, amount=1):
+        self.lock.acquire()
+
+        try:
+            self.stats[name] += amount
+        finally:
+            self.lock.release()
+
+    def add_connection(self, connection):
+        self.lock.acquire()
+
+        try:
+            self._connections.add(connection)
+            self.stats['connections'] += 1
+        finally:
+            self.lock.release()
+
+    def remove_connection(self, connection):
+        self.lock.acquire()
+
+        try:
+            self._connections.discard(connection)
+        finally:
+            self.lock.release()
+
+    def handle_error(self, request, client_address):
+        """Reports an error raised while handling a request.
+
+        Tracebacks are only printed when verbose. The default handler
+        prints them to sys.stdout, which tests may be capturing. The socket
+        errors of connections cut off by stop() are never reported.
+        """
+        if not self.verbose:
+            return
+
+        if self._stopping and isinstance(sys.exc_info()[1], socket.error):
+            return
+
+        HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        """Serves requests in a background thread."""
+        self._stopping = False
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops a server started with start().
+
+        Connections that clients kept alive are shut down, so their threads
+        exit.
+        """
+        self._stopping = True
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+        self.lock.acquire()
+
+        try:
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        finally:
+            self.lock.release()
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--repositories', type='int', default=3,
+                      help='the number of repositories to make up')
+    parser.add_option('--user', action='append', default=[],
+                      help='a username:password that can log in. If given, '
+                           'logging in is required')
+    parser.add_option('--latency', type='float', default=0,
+                      help='seconds of latency added to each request')
+    parser.add_option('--bandwidth', type='int', default=None,
+                      help='the bandwidth limit, in bytes per second')
+    options, args = parser.parse_args()
+
+    server = FakeReviewBoardServer(
+        (options.host, options.port),
+        repository_count=options.repositories,
+        users=dict([user.split(':', 1) for user in options.user]),
+        latency=options.latency,
+        bandwidth=options.bandwidth,
+        verbose=True)
+    print 'Serving a fake Review Board API at %s/api/' % server.url
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    print server.stats
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import re
+
+
+VERSION_COMPONENT_RE = re.compile(r'(\d+|[a-z]+|\.|-|\s+)')
+
+# Spellings of pre-release and post-release markers, and what they sort as.
+VERSION_COMPONENT_ALIASES = {
+    'pre': 'c',
+    'preview': 'c',
+    '-': 'final-',
+    'rc': 'c',
+    'dev': '@',
+}
+
+
+def parse_version(version):
+    """
+    Returns a key for a version string that compares in version order.
+
+    This follows the ordering of setuptools' parse_version (so '1.5.2' <
+    '1.5.3.1' < '1.6alpha1' < '1.6rc1' < '1.6'), without the cost of
+    importing pkg_resources.
+    """
+    parts = []
+
+    for part in _iter_version_components(version.lower()):
+        if part.startswith('*'):
+            # Remove trailing zeros before a pre-release marker, and "-"
+            # before anything but a post-release marker.
+            if part < '*final':
+                while parts and parts[-1] == '*final-':
+                    parts.pop()
+
+            while parts and parts[-1] == '00000000':
+                parts.pop()
+
+        parts.append(part)
+
+    return tuple(parts)
+
+
+def _iter_version_components(version):
+    for part in VERSION_COMPONENT_RE.split(version):
+        part = VERSION_COMPONENT_ALIASES.get(part, part)
+
+        if not part.strip() or part == '.':
+            continue
+
+        if part[0].isdigit():
+            # Pad numbers so that they compare correctly as strings.
+            yield part.zfill(8)
+        else:
+            yield '*' + part
+
+    yield '*final'
@@ -0,0 +1,250 @@
+import Queue
+import sys
+import threading
+import time
+from StringIO import StringIO
+from collections import deque
+
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class Future(object):
+    """The eventual result of a call made by a WorkerPool."""
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        """Returns whether the call has finished."""
+        return self._event.isSet()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the call to finish, or for timeout seconds if given.
+
+        Returns whether the call has finished.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while not self._event.isSet():
+            # Waiting with a timeout keeps the main thread responsive to
+            # Ctrl-C.
+            if timeout is None:
+                self._event.wait(1)
+            else:
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    break
+
+                self._event.wait(min(1, remaining))
+
+        return self._event.isSet()
+
+    def result(self):
+        """
+        Returns the result of the call, waiting for it if needed.
+
+        If the call raised an exception, it's raised again here.
+        """
+        self.wait()
+
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        return self._result
+
+    def _run(self, func, args, kwargs):
+        # This catches everything, including the SystemExit raised by die(),
+        # so that the caller is never left waiting.
+        try:
+            self._result = func(*args, **kwargs)
+        except:
+            self._exc_info = sys.exc_info()
+
+        self._event.set()
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of threads that calls functions in the background.
+
+    Calls are queued by submit(), which returns a Future for the result. At
+    most max_workers calls run at once. Threads are started as they're
+    needed, and exit once shutdown() is called and the queue is drained.
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self._tasks = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Queues a call to func, returning a Future for its result."""
+        future = Future()
+        self._tasks.put((future, func, args, kwargs))
+
+        self._lock.acquire()
+
+        try:
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+        return future
+
+    def shutdown(self):
+        """Lets the threads exit once the queued calls are done."""
+        self._lock.acquire()
+
+        try:
+            for thread in self._threads:
+                self._tasks.put(None)
+
+            self._threads = []
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+
+            if task is None:
+                return
+
+            future, func, args, kwargs = task
+            future._run(func, args, kwargs)
+
+
+def imap_ordered(func, iterable, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Calls func on each item of iterable in a bounded pool of threads.
+
+    This yields (item, result) tuples in the order of iterable, as soon as
+    each result is available. At most max_workers calls run at once, and
+    iterable is consumed lazily from the calling thread, only as far ahead
+    as the pool needs.
+
+    If func raises an exception, it's raised again from the generator when
+    that item's turn comes up.
+
+    When the generator is closed early (for instance, when the caller
+    breaks out of a loop after finding what it was looking for), no further
+    items are started and the worker threads exit after their current call.
+    """
+    if max_workers <= 1:
+        for item in iterable:
+            yield item, func(item)
+
+        return
+
+    pool = WorkerPool(max_workers)
+    pending = deque()
+
+    try:
+        for item in iterable:
+            pending.append((item, pool.submit(func, item)))
+
+            if len(pending) >= max_workers:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    finally:
+        pool.shutdown()
+
+
+class BackgroundTask(object):
+    """
+    Runs a function in a background thread.
+
+    The result, or the exception raised, is kept for the caller to pick up
+    once it calls wait().
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.result = None
+        self.exc_info = None
+        self._thread = threading.Thread(target=self._run,
+                                        args=(func, args, kwargs))
+        self._thread.setDaemon(True)
+
+    def start(self):
+        """Starts the task, returning it for convenience."""
+        self._thread.start()
+
+        return self
+
+    def wait(self):
+        """
+        Waits for the task to finish.
+
+        Returns whether the function returned without raising an exception.
+        """
+        while self._thread.isAlive():
+            # Joining with a timeout keeps the main thread responsive to
+            # Ctrl-C.
+            self._thread.join(1)
+
+        return self.exc_info is None
+
+    def _run(self, func, args, kwargs):
+        try:
+            self.result = func(*args, **kwargs)
+        except:
+            self.exc_info = sys.exc_info()
+
+
+class ThreadLocalOutput(object):
+    """
+    A stand-in for sys.stdout or sys.stderr that can hold back what some
+    threads write.
+
+    Writes from a thread that has called capture() are buffered until it
+    calls release(), which returns them. Writes from other threads go
+    straight to the wrapped stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def capture(self):
+        """Starts holding back the current thread's output."""
+        self._local.buffer = StringIO()
+
+    def release(self):
+        """Stops holding back the current thread's output, returning it."""
+        buf = getattr(self._local, 'buffer', None)
+        self._local.buffer = None
+
+        if buf is None:
+            return ''
+
+        return buf.getvalue()
+
+    def write(self, s):
+        buf = getattr(self._local, 'buffer', None)
+
+        if buf is None:
+            self.stream.write(s)
+        else:
+            buf.write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
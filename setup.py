@@ -19,10 +19,14 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 
+import sys
+
 from ez_setup import use_setuptools
 use_setuptools()
 
 from setuptools import setup, find_packages
+from setuptools.command.develop import develop
+from setuptools.command.easy_install import easy_install
 from setuptools.command.test import test
 
 from rbtools import get_package_version, is_release, VERSION
@@ -46,14 +50,64 @@ except ImportError:
     install_requires.append('simplejson')
 
 
+def get_script_header(script_text):
+    try:
+        from setuptools.command.easy_install import ScriptWriter
+        return ScriptWriter.get_header(script_text)
+    except (ImportError, AttributeError):
+        # setuptools older than 12.0
+        from setuptools.command.easy_install import get_script_header
+        return get_script_header(script_text)
+
+
+class PlainScriptsMixin:
+    """Installs scripts as they are.
+
+    "setup.py install" and "setup.py develop" normally replace scripts
+    with wrappers that import pkg_resources and look up the distribution
+    before running them, which is slow. Only the #! line is rewritten
+    here, as distutils and pip do.
+    """
+    def install_script(self, dist, script_name, script_text, dev_path=None):
+        if script_text.startswith('#!'):
+            script_text = script_text.split('\n', 1)[1]
+
+        self.write_script(script_name,
+                          get_script_header(script_text) + script_text)
+
+
+class plain_scripts_easy_install(PlainScriptsMixin, easy_install):
+    pass
+
+
+class plain_scripts_develop(PlainScriptsMixin, develop):
+    pass
+
+
+# The console_scripts wrappers generated by setuptools import pkg_resources,
+# which slows down every run. A plain script is installed instead, except on
+# Windows, where the wrappers provide the .exe launchers.
+if sys.platform == 'win32':
+    entry_points = {
+        'console_scripts': [
+            'post-review = rbtools.postreview:main',
+        ],
+    }
+    scripts = []
+else:
+    entry_points = {}
+    scripts = ['scripts/post-review']
+
+
 setup(name=PACKAGE_NAME,
       version=get_package_version(),
       license="MIT",
       description="Command line tools for use with Review Board",
-      entry_points = {
-          'console_scripts': [
-              'post-review = rbtools.postreview:main',
-          ],
+      entry_points=entry_points,
+      scripts=scripts,
+      cmdclass={
+          'develop': plain_scripts_develop,
+          'easy_install': plain_scripts_easy_install,
       },
       install_requires=install_requires,
       dependency_links = [